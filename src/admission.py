@@ -0,0 +1,145 @@
+"""请求准入：按前缀树匹配的 CIDR 封禁与令牌桶限流
+
+两者每次检查的开销都与已登记的条目数无关：前缀树最多走地址位数（32/128）步，
+令牌桶是一次字典查找加几次浮点运算。令牌桶按最近访问顺序排列，
+每次检查顺带淘汰队首空闲过久的桶（空闲超过 burst / rate 的桶本来就是满的，
+丢掉后重建结果不变），桶的总数另有上限，内存有界。
+"""
+
+import collections
+import ipaddress
+import socket
+import threading
+import time
+
+# 单个限流器最多保留的桶数
+MAX_BUCKETS = 100000
+# 每次检查最多顺带淘汰的桶数，摊还 O(1)
+EVICT_PER_CHECK = 2
+IPV4_MAPPED_PREFIX = bytes(10) + b'\xff\xff'
+
+
+class PrefixTrie:
+    """IPv4/IPv6 网段集合，支持 'ip in trie'；单个地址按 /32、/128 处理"""
+
+    def __init__(self):
+        # 节点为 [0 子树, 1 子树, 是否为已登记网段的终点]
+        self._roots = {4: [None, None, False], 6: [None, None, False]}
+        self._networks = set()
+
+    @staticmethod
+    def _parse(value):
+        return ipaddress.ip_network(value, strict=False)
+
+    def add(self, value):
+        """登记网段（如 '10.0.0.0/8'、'1.2.3.4'），格式不对时抛出 ValueError"""
+        network = self._parse(value)
+        bits = int(network.network_address)
+        width = network.max_prefixlen
+        node = self._roots[network.version]
+        for i in range(network.prefixlen):
+            bit = (bits >> (width - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, False]
+            node = node[bit]
+        node[2] = True
+        self._networks.add(str(network))
+        return str(network)
+
+    def discard(self, value):
+        """取消登记网段，只影响完全相同的网段"""
+        network = self._parse(value)
+        bits = int(network.network_address)
+        width = network.max_prefixlen
+        node = self._roots[network.version]
+        for i in range(network.prefixlen):
+            node = node[(bits >> (width - 1 - i)) & 1]
+            if node is None:
+                return str(network)
+        node[2] = False
+        self._networks.discard(str(network))
+        return str(network)
+
+    def __contains__(self, ip):
+        if not self._networks:
+            return False
+        try:
+            packed = socket.inet_pton(socket.AF_INET, ip)
+            version = 4
+        except (OSError, TypeError):
+            try:
+                packed = socket.inet_pton(socket.AF_INET6, ip)
+            except (OSError, TypeError):
+                return False
+            # 双栈监听时 IPv4 客户端显示为 ::ffff:a.b.c.d，按 IPv4 匹配
+            if packed[:12] == IPV4_MAPPED_PREFIX:
+                packed, version = packed[12:], 4
+            else:
+                version = 6
+        bits = int.from_bytes(packed, 'big')
+        width = len(packed) * 8
+        node = self._roots[version]
+        for i in range(width):
+            if node[2]:
+                return True
+            node = node[(bits >> (width - 1 - i)) & 1]
+            if node is None:
+                return False
+        return node[2]
+
+    def __iter__(self):
+        return iter(sorted(self._networks))
+
+    def __len__(self):
+        return len(self._networks)
+
+
+class TokenBucketLimiter:
+    """每个键一个令牌桶：每秒补充 rate 个令牌，最多积攒 burst 个"""
+
+    def __init__(self, rate, burst, max_buckets=MAX_BUCKETS, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.idle = burst / rate
+        self.max_buckets = max_buckets
+        self.clock = clock
+        # key -> [令牌数, 上次访问时间]，按上次访问时间排列
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key, cost=1):
+        """消耗 cost 个令牌，不足时返回 False"""
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            self._evict(now)
+            if bucket[0] < cost:
+                return False
+            bucket[0] -= cost
+            return True
+
+    def retry_after(self, key, cost=1):
+        """距离令牌足够还需等待的秒数"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return 0.0
+            return max(0.0, (cost - bucket[0]) / self.rate)
+
+    def _evict(self, now):
+        for _ in range(EVICT_PER_CHECK):
+            if not self._buckets:
+                return
+            key, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < self.idle and len(self._buckets) <= self.max_buckets:
+                return
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
@@ -0,0 +1,491 @@
+"""asyncio 服务入口：与 server.py 共用路由处理函数与游戏逻辑
+
+    python aserver.py [port] [host]
+
+全部游戏状态只在事件循环线程中修改，房间锁换成不加锁的 RoomWaiters，
+长轮询与 /events 订阅在等待期间只占一个 Future 而不占线程，
+单核即可保持上万个空闲连接。
+"""
+
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import sys
+import time
+
+from loguru import logger
+
+import httpio
+import ids
+import server
+import wire
+
+HOST = '0.0.0.0'
+PORT = 5000
+
+
+class RoomWaiters:
+    """asyncio 模式下的房间锁：单线程无需互斥，notify_all 唤醒等待该房间的协程"""
+
+    def __init__(self):
+        self._waiters = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def notify_all(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    def wait_for(self, predicate, timeout=None):
+        # 同步的处理函数不能阻塞事件循环，等待已经在 wait_changed 中完成
+        return predicate()
+
+    async def wait_changed(self, predicate, timeout):
+        """等待直到 predicate() 为真或超时，返回 predicate() 的结果"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not predicate():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            waiter = loop.create_future()
+            self._waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                self._waiters.discard(waiter)
+        return True
+
+
+class AsyncScheduler:
+    """用事件循环的定时器代替调度线程，回调同样在事件循环中执行"""
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._pending = 0
+
+    def call_at(self, when, callback, *args):
+        self._pending += 1
+        self._loop.call_later(max(when - time.time(), 0), self._fire, callback, args)
+
+    def pending(self):
+        return self._pending
+
+    def _fire(self, callback, args):
+        self._pending -= 1
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.error(f"Scheduled task {callback.__name__} failed: {e}")
+
+
+def request_rooms(request):
+    """请求涉及的房间号：uid/观战令牌所在的房间、join 与 spectate 的 id、/batch 各操作的 uid"""
+    if request.method == 'GET':
+        data = {'uid': request.query.get('uid')}
+    else:
+        data = request.json() or {}
+    uids = [data.get('uid')]
+    ops = data.get('ops')
+    if isinstance(ops, list):
+        uids.extend(op.get('uid') for op in ops if isinstance(op, dict))
+    room_ids = {data.get('id')} if isinstance(data.get('id'), str) else set()
+    for uid in uids:
+        if isinstance(uid, str):
+            # 旧格式 uid 的归属在 where 中，新格式直接取自 uid
+            room_ids.add(server.where.get(uid) or ids.room_of(uid))
+    return room_ids
+
+
+async def load_rooms(room_ids):
+    """在线程池中读回尚未载入的房间，处理函数随后直接拿到房间，不在事件循环中读盘；
+    读取失败的留给处理函数按原路径读回并记录错误"""
+    loop = asyncio.get_running_loop()
+    pending = [
+        (room_id, server.stored_rooms[room_id])
+        for room_id in room_ids
+        if room_id in server.stored_rooms and room_id not in server.room_locks
+    ]
+    if not pending:
+        return
+    results = await asyncio.gather(
+        *(
+            loop.run_in_executor(None, server.read_stored_room, stored)
+            for _, stored in pending
+        ),
+        return_exceptions=True,
+    )
+    for (room_id, stored), loaded in zip(pending, results):
+        if not isinstance(loaded, Exception):
+            server.install_room(room_id, stored, *loaded)
+
+
+def to_response(result):
+    """把处理函数的返回值（沿用 Flask 约定）转为 (status, body, content_type)"""
+    status = 200
+    if isinstance(result, tuple):
+        result, status = result
+    if status == 304:
+        return status, b'', None
+    if isinstance(result, (dict, list)):
+        body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        return status, body, 'application/json'
+    if isinstance(result, (server.JsonBody, server.BinaryBody)):
+        return status, result, result.content_type
+    if isinstance(result, bytes):
+        return status, result, 'application/octet-stream'
+    return status, str(result).encode('utf-8'), 'text/html; charset=utf-8'
+
+
+async def status(request):
+    data = request.json()
+    server.log_request('status', request.remote_addr, data)
+    if data is None:
+        return {'status': 'fail', 'reason': 'Invalid JSON'}, 400
+    # 长轮询：在协程中等待版本变化，再以 timeout=0 交给同步处理函数
+    since = data.get('since')
+    room_id = (
+        server.room_of_uid(data.get('uid'))
+        if isinstance(data.get('uid'), str)
+        else None
+    )
+    waiters = server.room_locks.get(room_id)
+    if isinstance(since, int) and waiters is not None:
+        timeout = data.get('timeout', server.LONG_POLL_TIMEOUT)
+        if not isinstance(timeout, (int, float)) or timeout < 0:
+            timeout = server.LONG_POLL_TIMEOUT
+        await waiters.wait_changed(
+            lambda: room_id not in server.room
+            or server.room[room_id].get('version', 0) != since,
+            min(timeout, server.LONG_POLL_TIMEOUT),
+        )
+        data = dict(data, timeout=0)
+    binary = wire.MEDIA_TYPE in request.headers.get('accept', '')
+    return server.handle_status(data, binary)
+
+
+async def history(request):
+    data = request.json() or {}
+    server.log_request('history', request.remote_addr, data)
+    read = server.prepare_history(data)
+    if not isinstance(read, server.HistoryRead):
+        return read
+    # 归档部分在线程池中读取，不阻塞事件循环
+    loop = asyncio.get_running_loop()
+    try:
+        archived = await loop.run_in_executor(None, read.read_archived)
+    except OSError as e:
+        return read.unavailable(e)
+    return read.reply(archived)
+
+
+async def join(request):
+    data = request.json() or {}
+    server.log_request('join', request.remote_addr, data)
+    return server.handle_join(data)
+
+
+async def spectate(request):
+    data = request.json() or {}
+    server.log_request('spectate', request.remote_addr, data)
+    return server.handle_spectate(data)
+
+
+async def create(request):
+    data = request.json() or {}
+    server.log_request('create', request.remote_addr, data)
+    return server.handle_create(data)
+
+
+async def play(request):
+    data = request.json() or {}
+    server.log_request('play', request.remote_addr, data)
+    return server.handle_play(data)
+
+
+async def batch(request):
+    data = request.json() or {}
+    server.log_request('batch', request.remote_addr, data)
+    return server.handle_batch(data)
+
+
+async def ban_ip(request):
+    return server.handle_ban_ip(request.json() or {}, request.remote_addr)
+
+
+async def unban_ip(request):
+    return server.handle_unban_ip(request.json() or {}, request.remote_addr)
+
+
+async def index(request):
+    return server.index_page()
+
+
+async def metrics_page(request):
+    return TextResponse(
+        server.handle_metrics().encode('utf-8'), server.metrics.CONTENT_TYPE
+    )
+
+
+async def product(request):
+    dist_path = server.product_path()
+    logger.info(f"/product 请求，查找路径: {dist_path}")
+    if not os.path.exists(dist_path):
+        logger.warning(f"client.exe not found at {dist_path}")
+        return f'client.exe not found at {dist_path}', 404
+    loop = asyncio.get_running_loop()
+    with open(dist_path, 'rb') as f:
+        body = await loop.run_in_executor(None, f.read)
+    return FileResponse(body, 'client.exe')
+
+
+async def events(request):
+    uid = request.query.get('uid')
+    server.log_request('events', request.remote_addr, {'uid': uid})
+    if not uid:
+        return {'status': 'fail', 'reason': 'Missing uid'}
+    room_id = server.room_of_uid(uid)
+    if room_id is None:
+        return {'status': 'fail', 'reason': 'Invalid uid'}
+    waiters = server.room_locks.get(room_id)
+    if waiters is None:
+        return {'status': 'fail', 'reason': 'Room not found'}
+    last_id = request.headers.get('last-event-id') or request.query.get('since')
+    since = int(last_id) if last_id and last_id.isdigit() else None
+
+    async def stream():
+        nonlocal since
+        while True:
+            server.mark_active(room_id)
+            if since is not None:
+                await waiters.wait_changed(
+                    lambda: room_id not in server.room
+                    or server.room[room_id].get('version', 0) != since,
+                    server.EVENT_KEEPALIVE,
+                )
+            pending, since = server.collect_events(room_id, since)
+            if not pending:
+                yield ': keepalive\n\n'
+                continue
+            yield ''.join(server.format_event(event) for event in pending)
+            if pending[-1]['event'] == 'closed':
+                return
+
+    return EventStream(stream())
+
+
+class FileResponse:
+    __slots__ = ('body', 'filename')
+
+    def __init__(self, body, filename):
+        self.body = body
+        self.filename = filename
+
+
+class TextResponse:
+    __slots__ = ('body', 'content_type')
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+
+
+class EventStream:
+    __slots__ = ('chunks',)
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+
+ROUTES = {
+    ('POST', '/status'): status,
+    ('POST', '/history'): history,
+    ('GET', '/events'): events,
+    ('POST', '/join'): join,
+    ('POST', '/spectate'): spectate,
+    ('POST', '/create'): create,
+    ('POST', '/play'): play,
+    ('POST', '/batch'): batch,
+    ('GET', '/product'): product,
+    ('POST', '/ban_ip'): ban_ip,
+    ('POST', '/unban_ip'): unban_ip,
+    ('GET', '/'): index,
+    ('GET', '/metrics'): metrics_page,
+}
+
+
+async def dispatch(request, writer, keep_alive):
+    """处理一个请求并写回响应，返回连接是否继续保持"""
+    if request.remote_addr in server.BANNED_IPS:
+        logger.warning(f"Blocked banned IP: {request.remote_addr}")
+        result = {'status': 'fail', 'reason': 'IP banned'}, 403
+    elif request.method == 'OPTIONS':
+        # CORS 预检
+        writer.write(
+            httpio.encode_response(
+                204,
+                keep_alive=keep_alive,
+                headers=(
+                    'Access-Control-Allow-Methods: GET, POST, OPTIONS',
+                    'Access-Control-Allow-Headers: Content-Type, Last-Event-ID',
+                ),
+            )
+        )
+        return keep_alive
+    else:
+        handler = ROUTES.get((request.method, request.path))
+        rejected = None
+        if handler is not None and (handler.__name__, 'ip') in server.RATE_LIMITERS:
+            rejected = server.check_rate_limit(
+                handler.__name__,
+                request.remote_addr,
+                request.uid(),
+                server.request_cost(handler.__name__, request.json()),
+            )
+        if handler is None:
+            result = {'status': 'fail', 'reason': 'Not found'}, 404
+        elif rejected is not None:
+            body, status_code, headers = rejected
+            server.observe_request(handler.__name__, status_code, 0.0)
+            writer.write(
+                httpio.encode_response(
+                    status_code,
+                    json.dumps(body).encode('utf-8'),
+                    'application/json',
+                    keep_alive,
+                    [f'{key}: {value}' for key, value in headers.items()],
+                )
+            )
+            return keep_alive
+        else:
+            start = time.perf_counter()
+            try:
+                await load_rooms(request_rooms(request))
+                result = await handler(request)
+            except Exception as e:
+                logger.error(f"{request.path} failed: {e}")
+                result = {'status': 'fail', 'reason': 'Internal error'}, 500
+            server.observe_request(
+                handler.__name__,
+                result[1] if isinstance(result, tuple) else 200,
+                time.perf_counter() - start,
+            )
+
+    if isinstance(result, FileResponse):
+        writer.write(
+            httpio.encode_response(
+                200,
+                result.body,
+                'application/octet-stream',
+                keep_alive,
+                (f'Content-Disposition: attachment; filename={result.filename}',),
+            )
+        )
+        return keep_alive
+    if isinstance(result, TextResponse):
+        writer.write(
+            httpio.encode_response(200, result.body, result.content_type, keep_alive)
+        )
+        return keep_alive
+    if isinstance(result, EventStream):
+        writer.write(
+            httpio.encode_response(
+                200,
+                None,
+                'text/event-stream',
+                keep_alive,
+                ('Cache-Control: no-cache', 'X-Accel-Buffering: no'),
+            )
+        )
+        async for chunk in result.chunks:
+            data = chunk.encode('utf-8')
+            writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+            await writer.drain()
+        writer.write(b'0\r\n\r\n')
+        return keep_alive
+    status_code, body, content_type = to_response(result)
+    writer.write(httpio.encode_response(status_code, body, content_type, keep_alive))
+    return keep_alive
+
+
+async def save_data_periodically():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(server.SAVE_INTERVAL)
+        start = time.perf_counter()
+        try:
+            # WAL 切分与写盘放到线程池，房间拷贝与登记表的更新在事件循环中进行
+            mark = await loop.run_in_executor(None, server.wal.rotate)
+            snapshot = server.capture_snapshot(mark)
+            written = await loop.run_in_executor(None, server.write_snapshot, snapshot)
+            server.finish_snapshot(snapshot, *written)
+            server.SAVE_SECONDS.observe(time.perf_counter() - start)
+        except Exception as e:
+            logger.error(f"Failed to save data: {e}")
+
+
+async def hibernate_periodically():
+    """定期空闲检查：选房间与移出内存在事件循环中进行，整批写记录文件放到线程池"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(server.HIBERNATE_INTERVAL)
+        try:
+            captured = server.capture_idle_rooms(time.time())
+            if captured:
+                written = await loop.run_in_executor(
+                    None, server.write_hibernated, captured
+                )
+                server.finish_hibernation(captured, *written)
+        except Exception as e:
+            logger.error(f"Failed to hibernate idle rooms: {e}")
+
+
+async def serve(host=HOST, port=PORT):
+    loop = asyncio.get_running_loop()
+    server.scheduler = AsyncScheduler(loop)
+    server.load_data_on_start()
+    server.resume_timers()
+    saver = asyncio.create_task(save_data_periodically())
+    sweeper = asyncio.create_task(hibernate_periodically())
+    listener = await asyncio.start_server(
+        functools.partial(httpio.handle_connection, dispatch_request=dispatch),
+        host,
+        port,
+        backlog=httpio.LISTEN_BACKLOG,
+        reuse_address=True,
+    )
+    logger.info(f"asyncio server listening on {host}:{port}")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        saver.cancel()
+        sweeper.cancel()
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    host = sys.argv[2] if len(sys.argv) > 2 else HOST
+    # 单线程事件循环：房间锁与成员表锁都不需要真正加锁
+    server.new_room_lock = RoomWaiters
+    server.registry_lock = contextlib.nullcontext()
+    httpio.raise_fd_limit()
+    try:
+        import uvloop
+    except ImportError:
+        pass
+    else:
+        uvloop.install()
+    asyncio.run(serve(host, port))
+
+
+if __name__ == '__main__':
+    main()
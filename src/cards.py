@@ -0,0 +1,168 @@
+"""牌面编码：54 种牌面映射为 0..53 的小整数，整数顺序即手牌显示顺序
+
+对外（JSON API、日志、事件）仍使用两字符编码，如 'R5'、'WD'；
+服务端内部的牌堆、出牌记录是 bytearray，手牌是按牌面计数的 Hand，
+出牌判定查预计算表。
+"""
+
+import itertools
+import random
+
+COLORS = 'RYGB'
+# 同一颜色内的顺序：数字 0-9，然后跳过、反转、+2
+FACES = '0123456789SRD'
+
+CARD_CODES = tuple(c + f for c in COLORS for f in FACES) + ('WD', 'WW')
+CARD_KINDS = len(CARD_CODES)
+
+# 出牌记录中的特殊标记：主动跳过（SK）与超时（TL）
+SK = CARD_KINDS
+TL = CARD_KINDS + 1
+CODES = CARD_CODES + ('SK', 'TL')
+CARD_INDEX = {code: i for i, code in enumerate(CODES)}
+
+# 颜色索引：0-3 对应 RYGB，4 表示万能牌/未选颜色
+WILD_COLOR = 4
+COLOR_OF = bytes(
+    COLORS.index(code[0]) if code[0] in COLORS else WILD_COLOR for code in CARD_CODES
+)
+IS_DIGIT = bytes(code[1].isdigit() for code in CARD_CODES)
+IS_WILD = bytes(code[0] == 'W' for code in CARD_CODES)
+REVERSES = bytes(code.endswith('R') for code in CARD_CODES)
+# 跳过牌、+2、+4 都会跳过下家
+SKIPS = bytes(code.endswith(('S', 'D')) for code in CARD_CODES)
+DRAW_COUNT = bytes(
+    4 if code == 'WD' else 2 if code.endswith('D') else 0 for code in CARD_CODES
+)
+
+# 108 张整副牌：每色 0 一张，1-9 与 S/R/D 各两张，WW/WD 各四张
+FULL_DECK = bytes(
+    [CARD_INDEX[c + '0'] for c in COLORS]
+    + [CARD_INDEX[c + f] for c in COLORS for f in FACES[1:] for _ in range(2)]
+    + [CARD_INDEX['WW'], CARD_INDEX['WD']] * 4
+)
+
+
+def _match(card, top, chosen_color):
+    # 与原字符串版 can_play 一致：同色、同面值、顶牌或出牌为万能牌即可出，
+    # 目前的规则不看选定颜色，保留这一维以便调整规则时只改这里
+    card_code = CARD_CODES[card]
+    top_code = CARD_CODES[top]
+    return (
+        card_code[0] == top_code[0]
+        or top_code[0] == 'W'
+        or card_code[0] == 'W'
+        or card_code[1:] == top_code[1:]
+    )
+
+
+# PLAYABLE[(card * CARD_KINDS + top) * 5 + chosen_color]
+PLAYABLE = bytes(
+    _match(card, top, chosen_color)
+    for card in range(CARD_KINDS)
+    for top in range(CARD_KINDS)
+    for chosen_color in range(WILD_COLOR + 1)
+)
+
+
+def can_play(card, top, chosen_color=None):
+    if chosen_color is None:
+        chosen_color = WILD_COLOR
+    return PLAYABLE[(card * CARD_KINDS + top) * (WILD_COLOR + 1) + chosen_color]
+
+
+def new_deck(rng=random):
+    deck = bytearray(FULL_DECK)
+    rng.shuffle(deck)
+    return deck
+
+
+def encode(code):
+    """两字符编码转整数，未知编码返回 None"""
+    return CARD_INDEX.get(code)
+
+
+def encode_cards(codes):
+    return bytearray(CARD_INDEX[code] for code in codes)
+
+
+def decode_cards(cards):
+    return [CODES[card] for card in cards]
+
+
+def encode_color(color):
+    """颜色字母转 0-3，缺失或非法（含 None）返回 None"""
+    if isinstance(color, str) and len(color) == 1 and color in COLORS:
+        return COLORS.index(color)
+    return None
+
+
+def decode_color(color):
+    return None if color is None else COLORS[color]
+
+
+class Hand:
+    """手牌多重集：按牌面计数存储，插入/删除 O(1)
+
+    按编码顺序遍历计数即得到有序手牌，不再需要排序；/status 用到的
+    字符串列表在下次变化前一直缓存"""
+
+    __slots__ = ('counts', 'size', '_cards', '_codes')
+
+    def __init__(self, cards=()):
+        self.counts = bytearray(CARD_KINDS)
+        self.size = 0
+        self._cards = None
+        self._codes = None
+        self.extend(cards)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, card):
+        return 0 <= card < CARD_KINDS and self.counts[card] > 0
+
+    def __iter__(self):
+        return iter(self.cards())
+
+    def add(self, card):
+        self.counts[card] += 1
+        self.size += 1
+        self._cards = self._codes = None
+
+    def extend(self, cards):
+        for card in cards:
+            self.counts[card] += 1
+        self.size += len(cards)
+        self._cards = self._codes = None
+
+    def remove(self, card):
+        if card not in self:
+            raise ValueError(f'card {card} not in hand')
+        self.counts[card] -= 1
+        self.size -= 1
+        self._cards = self._codes = None
+
+    def draw_from(self, deck, count):
+        """一次从牌堆末尾摸 count 张（牌堆不足时摸完为止），返回实际摸到的张数"""
+        count = min(count, len(deck))
+        if count:
+            self.extend(deck[-count:])
+            del deck[-count:]
+        return count
+
+    def cards(self):
+        """有序手牌的整数编码"""
+        if self._cards is None:
+            self._cards = bytes(
+                itertools.chain.from_iterable(
+                    itertools.repeat(card, n) for card, n in enumerate(self.counts) if n
+                )
+            )
+        return self._cards
+
+    def codes(self):
+        """有序手牌的两字符编码列表"""
+        if self._codes is None:
+            self._codes = [CODES[card] for card in self.cards()]
+        return self._codes
@@ -7,6 +7,8 @@ import os
 import threading
 import queue
 
+import wire
+
 # 终端颜色
 COLORS = {
     'R': '\033[91m',  # 红
@@ -19,7 +21,7 @@ COLORS = {
 }
 
 SERVER = 'http://8.137.13.242:5000'
-CLIENT_VERSION = '3.1.0'
+CLIENT_VERSION = '3.2.0'
 BAR = r'''  ___        _ _              _   _ _   _  ___
  / _ \ _ __ | (_)_ __   ___  | | | | \ | |/ _ \
 | | | | '_ \| | | '_ \ / _ \ | | | |  \| | | | |
@@ -32,6 +34,28 @@ try:
 except Exception:
     VERSION = CLIENT_VERSION
 
+# 订阅模式：通过 /events 接收服务端推送，不再轮询 /status
+SUBSCRIBE = os.environ.get('UNO_SUBSCRIBE', '') not in ('', '0')
+# 订阅模式下长时间未收到事件时的兜底刷新间隔（秒）
+EVENT_WAIT = 30
+# /status 使用紧凑二进制格式（见 wire），服务端不支持时自动回落到 JSON
+BINARY_STATUS = os.environ.get('UNO_BINARY_STATUS', '1') != '0'
+# 牌桌上显示的最近出牌数
+HISTORY_SHOWN = 25
+
+# 所有请求共用一个保持连接的会话
+SESSION = requests.Session()
+# 请求超时（连接, 读取），长轮询的读取超时要长于服务端最长挂起时间（25 秒）
+REQUEST_TIMEOUT = (5, 10)
+POLL_TIMEOUT = (5, 35)
+# 断线重连的指数退避：第 n 次失败后等待 [0, min(BACKOFF_MAX, BACKOFF_BASE * 2^n)) 秒
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10
+# 服务端不支持长轮询（旧版本）时的轮询间隔：下家是自己时更勤快
+POLL_INTERVAL_NEXT = 0.5
+POLL_INTERVAL_OTHER = 1.5
+POLL_INTERVAL_WAITING = 3
+
 
 def color_card(card):
     if card in ['SK', 'TL']:
@@ -53,9 +77,53 @@ def print_hand(hand):
     print('你的手牌:', ' '.join([color_card(card) for card in hand]))
 
 
-def play(card, uid, server=SERVER):
+def backoff_delay(failures):
+    '''第 failures 次连续失败后的等待时间（带随机抖动）'''
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**failures))
+
+
+def post(path, payload, timeout=REQUEST_TIMEOUT, retries=2, headers=None):
+    '''通过共享会话发送 POST，连接失败时退避重试 retries 次
+
+    出牌等非幂等请求应传 retries=0，由调用方决定是否重发'''
+    for attempt in range(retries + 1):
+        try:
+            resp = SESSION.post(
+                f'{SERVER}{path}', json=payload, timeout=timeout, headers=headers
+            )
+        except requests.RequestException:
+            if attempt == retries:
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        if resp.status_code == 429 and attempt < retries:
+            # 被限流：按服务端给出的时间等待后重试
+            time.sleep(retry_after(resp))
+            continue
+        return resp
+
+
+def retry_after(resp):
+    '''429 回复建议的等待秒数'''
+    try:
+        return float(resp.headers.get('Retry-After', 1))
+    except ValueError:
+        return 1.0
+
+
+def poll_interval(status_data):
+    '''服务端没有挂起 /status 时，两次轮询之间的最小间隔'''
+    if status_data.get('game_status') != 'playing':
+        return POLL_INTERVAL_WAITING
+    current_idx, next_idx, my_idx = who(status_data)
+    if current_idx == my_idx or next_idx == my_idx:
+        return POLL_INTERVAL_NEXT
+    return POLL_INTERVAL_OTHER
+
+
+def play(card, uid):
     '''出牌动作，返回服务端响应'''
-    resp = requests.post(f'{server}/play', json={'uid': uid, 'card': card})
+    resp = post('/play', {'uid': uid, 'card': card}, retries=0)
     return resp.json()
 
 
@@ -147,28 +215,124 @@ def input_with_timeout(prompt, timeout=60):
         return None
 
 
-def hash_dict(d):
-    json_str = json.dumps(d, sort_keys=True)
-    return hash(json_str)
+def subscribe_events(uid):
+    '''后台订阅 /events，每收到一条房间事件就放入返回的队列'''
+    events = queue.Queue()
+
+    def worker():
+        # 流式响应会一直占用连接，单独用一个会话
+        session = requests.Session()
+        last_id = None
+        failures = 0
+        while True:
+            headers = {'Last-Event-ID': last_id} if last_id else {}
+            try:
+                with session.get(
+                    f'{SERVER}/events',
+                    params={'uid': uid},
+                    headers=headers,
+                    stream=True,
+                    timeout=(5, 60),
+                ) as resp:
+                    for line in resp.iter_lines(decode_unicode=True):
+                        failures = 0
+                        if line.startswith('id:'):
+                            last_id = line[3:].strip()
+                        elif line.startswith('event:'):
+                            event = line[6:].strip()
+                            events.put(event)
+                            if event == 'closed':
+                                return
+            except Exception:
+                pass
+            failures += 1
+            time.sleep(backoff_delay(failures))
+
+    t = threading.Thread(target=worker, daemon=True)
+    t.start()
+    return events
+
+
+def fetch_status(uid, version=None, events=None, history_cursor=None, roster=None):
+    '''获取房间状态，版本未变化时返回 None
+
+    订阅模式下先阻塞等待推送事件，否则由服务端长轮询挂起到版本变化；
+    传入 history_cursor 时只拉取该位置之后新增的出牌记录；
+    传入 roster（wire.Roster）时请求二进制格式，座次变化时才拉取昵称并原地更新'''
+    if events is not None and version is not None:
+        try:
+            events.get(timeout=EVENT_WAIT)
+        except queue.Empty:
+            pass
+        # 合并积压的事件，只拉取一次状态
+        while not events.empty():
+            events.get_nowait()
+        payload = {'uid': uid, 'since': version, 'timeout': 0}
+    else:
+        payload = {'uid': uid, 'since': version}
+    if history_cursor is None:
+        payload['history_last'] = HISTORY_SHOWN
+    else:
+        payload['history_from'] = history_cursor
+    headers = None
+    if roster is not None and BINARY_STATUS:
+        payload['roster'] = roster.version
+        headers = {'Accept': f'{wire.MEDIA_TYPE}, application/json'}
+    resp = post('/status', payload, timeout=POLL_TIMEOUT, retries=0, headers=headers)
+    if resp.status_code == 304:
+        return None
+    if resp.status_code == 429:
+        time.sleep(retry_after(resp))
+        return None
+    if resp.headers.get('Content-Type', '').startswith(wire.MEDIA_TYPE):
+        return wire.decode_status(resp.content, roster)
+    return resp.json()
 
 
-def game_loop(uid, room_id=None):
-    last_hash = 0
+def game_loop(uid, room_id=None, events=None, spectator=False):
+    '''spectator 为 True 时 uid 是观战令牌，只显示公开状态'''
+    # 房间版本号，服务端在版本变化前会挂起 /status（长轮询）
+    version = None
+    # 本地保留最近的出牌记录，history_cursor 为服务端历史中已同步到的位置
+    history = []
+    history_cursor = None
+    # 已知的座次，二进制格式下座次变化时才拉取昵称
+    roster = wire.Roster()
+    failures = 0
+    # 服务端未挂起请求时，下一次轮询最早的时间点
+    next_poll = 0
+    if events is None and SUBSCRIBE:
+        events = subscribe_events(uid)
     while True:
+        time.sleep(max(0, next_poll - time.monotonic()))
         try:
-            resp = requests.post(f'{SERVER}/status', json={'uid': uid})
-        except:
+            data = fetch_status(uid, version, events, history_cursor, roster)
+        except Exception:
+            failures += 1
             print('与服务器的连接丢失，正在重连...')
-            time.sleep(0.5)
-        data = resp.json()
+            time.sleep(backoff_delay(failures))
+            continue
+        failures = 0
+        if data is None:
+            continue
         if data['status'] != 'success':
             print('状态获取失败:', data.get('reason'))
             break
-        if hash_dict(data) == last_hash:
-            continue
-        last_hash = hash_dict(data)
+        version = data.get('version')
+        if version is None:
+            # 旧版服务端不支持长轮询，按轮到谁控制轮询频率
+            next_poll = time.monotonic() + poll_interval(data)
+        entries = data.get('table_history', [])
+        start = data.get('history_start', 0)
+        if history_cursor is not None and start == history_cursor:
+            history = (history + entries)[-HISTORY_SHOWN:]
+        else:
+            history = entries[-HISTORY_SHOWN:]
+        history_cursor = data.get('history_len', start + len(entries))
         clear_screen()
-        if room_id:
+        if spectator:
+            print(f'Room ID: {room_id} 观战中')
+        elif room_id:
             print(f'Room ID: {room_id} User ID: {uid}')
         else:
             print(f'User ID: {uid}')
@@ -193,21 +357,24 @@ def game_loop(uid, room_id=None):
                 print(', ', end='')
         print('')
         print(f'当前牌桌: ', end='')
-        for card in data.get('table_history', [])[::-1][:25]:
+        for card in history[::-1]:
             print(color_card(card), end=' ')
         print('')
-        print_hand(data['hand'])
+        if not spectator:
+            print_hand(data['hand'])
         if data.get('game_status') == 'finished':
             if data.get('winner'):
                 print(f'游戏结束，胜者：{data['winner']}')
             else:
                 print('游戏结束')
-            clear_uid()
+            if not spectator:
+                clear_uid()
             input('按 Enter 继续...')
             break
         who_idx = who(data)
         if who_idx[0] == who_idx[2] and who_idx[2] != -1:
-            last_hash = 0
+            # 无论出牌成功与否，下一轮都立即刷新
+            version = None
             print('你的回合！')
             print('输入要出的牌（如 R5），或输入 SK 跳过：')
             card = input_with_timeout('> ', timeout=65)
@@ -221,21 +388,22 @@ def game_loop(uid, room_id=None):
                 input('按 Enter 继续...')
                 continue
             try:
-                resp = requests.post(f'{SERVER}/play', json={'uid': uid, 'card': card})
-            except:
+                play_data = play(card, uid)
+            except Exception:
+                # 出牌不自动重发，重连后以服务端状态为准
                 print('与服务器的连接丢失，正在重连...')
-                time.sleep(1)
+                time.sleep(backoff_delay(1))
                 continue
-            play_data = resp.json()
+            next_poll = 0
             if play_data['status'] != 'success':
                 print('出牌失败:', play_data.get('reason'))
                 continue
         else:
             print('等待其他玩家出牌...')
-            time.sleep(0.2)
 
 
 def main():
+    global SERVER
     try:
         print(f'已更换到自定义服务器: {sys.argv[1]}')
         SERVER = sys.argv[1]
@@ -244,7 +412,7 @@ def main():
     except:
         pass
     try:
-        resp = requests.post(f'{SERVER}/status', json={'uid': 'version_check'})
+        resp = post('/status', {'uid': 'version_check'})
         data = resp.json()
         min_version = data.get('min_client_version')
         if min_version and CLIENT_VERSION < min_version:
@@ -257,7 +425,7 @@ def main():
     # 断线重连机制
     uid = get_uid()
     if uid:
-        resp = requests.post(f'{SERVER}/status', json={'uid': uid})
+        resp = post('/status', {'uid': uid})
         data = resp.json()
         # 只有游戏已开始且未结束才自动恢复
         if data.get('status') == 'success' and data.get('game_status') == 'playing':
@@ -275,10 +443,19 @@ def main():
     clear_screen()
     print(BAR)
     print(f'UNO 牌的网络联机版，版本号：{CLIENT_VERSION}')
-    mode = input('1. 创建房间  2. 加入房间 选择: ')
+    mode = input('1. 创建房间  2. 加入房间  3. 观战 选择: ')
+    if mode == '3':
+        room_id = input('输入房间ID: ').strip()
+        resp = post('/spectate', {'id': room_id}, retries=0)
+        data = resp.json()
+        if data['status'] != 'success':
+            print('观战失败:', data.get('reason'))
+            return
+        game_loop(data['token'], room_id, spectator=True)
+        return
     if mode == '1':
         count = int(input('房间人数(2-8): '))
-        resp = requests.post(f'{SERVER}/create', json={'count': count})
+        resp = post('/create', {'count': count}, retries=0)
         data = resp.json()
         if data['status'] != 'success':
             print('创建失败:', data.get('reason'))
@@ -288,7 +465,7 @@ def main():
     else:
         room_id = input('输入房间ID: ').strip()
     clear_screen()
-    resp = requests.post(f'{SERVER}/join', json={'id': room_id, 'username': username})
+    resp = post('/join', {'id': room_id, 'username': username}, retries=0)
     data = resp.json()
     if data['status'] != 'success':
         print('加入失败:', data.get('reason'))
@@ -296,18 +473,24 @@ def main():
     uid = data['uid']
     save_uid(uid)
     print(f'加入成功，等待其他玩家...\n你的身份ID: {uid}')
-    last_hash = 0
+    version = None
+    roster = wire.Roster()
+    failures = 0
+    events = subscribe_events(uid) if SUBSCRIBE else None
     while True:
         try:
-            resp = requests.post(f'{SERVER}/status', json={'uid': uid})
-        except:
+            data = fetch_status(uid, version, events, roster=roster)
+        except Exception:
+            failures += 1
             print('与服务器的连接丢失，正在重连...')
-            time.sleep(0.5)
+            time.sleep(backoff_delay(failures))
             continue
-        data = resp.json()
-        if hash_dict(data) == last_hash:
+        failures = 0
+        if data is None:
             continue
-        last_hash = hash_dict(data)
+        version = data.get('version')
+        if version is None:
+            time.sleep(POLL_INTERVAL_WAITING)
         clear_screen()
         print(f'Room ID: {room_id} User ID: {uid}')
         if data['status'] != 'success':
@@ -320,8 +503,7 @@ def main():
             break
         print('玩家: ', ', '.join(data.get('players', [])))
         print('当前已加入:', len(data['players']))
-        time.sleep(0.2)
-    game_loop(uid, room_id)
+    game_loop(uid, room_id, events)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,186 @@
+"""UNO 规则引擎：发牌与开局翻牌、出牌判定、功能牌效果、超时处理
+
+GameEngine 只读写传入的状态 dict，不依赖 Flask、日志和锁，随机数全部来自
+可指定种子的 rng。服务端各路由在房间锁内调用它，再把产生的事件转发给客户端；
+进程内模拟可以直接用 GameEngine.new_game 跑对局。
+
+状态 dict 与服务端的房间 dict 相同，引擎用到的键：
+player, hand, deck, top, turn, direction, table_history, chosen_color,
+status, winner。玩家用调用方给出的标识（服务端为 uid）区分，牌为 cards 中的整数编码。
+"""
+
+import random
+
+import cards
+
+# 每个房间的人数范围
+MIN_COUNT = 2
+MAX_COUNT = 12
+HAND_SIZE = 7
+
+
+class IllegalMove(Exception):
+    """不合法的操作，消息即返回给客户端的 reason"""
+
+
+def new_state(players=()):
+    return {
+        'player': list(players),
+        'hand': {},
+        'deck': bytearray(),
+        'top': None,
+        'turn': 0,
+        'direction': 1,
+        'table_history': bytearray(),
+        'chosen_color': None,
+        'status': 'waiting',
+        'winner': None,
+    }
+
+
+class GameEngine:
+    """单局游戏的状态机
+
+    每个操作直接修改 state，并把产生的事件以 (event, payload) 追加到 events，
+    payload 中的玩家为玩家标识、牌与颜色为整数编码，由调用方取走并转换"""
+
+    __slots__ = ('state', 'rng', 'events')
+
+    def __init__(self, state=None, rng=random):
+        self.state = new_state() if state is None else state
+        self.rng = rng
+        self.events = []
+
+    @classmethod
+    def new_game(cls, players, seed=None):
+        """用独立的随机数发生器开一局，供模拟使用"""
+        engine = cls(new_state(players), random.Random(seed))
+        engine.start()
+        return engine
+
+    def emit(self, event, **payload):
+        self.events.append((event, payload))
+
+    def drain_events(self):
+        events, self.events = self.events, []
+        return events
+
+    @property
+    def current_player(self):
+        return self.state['player'][self.state['turn']]
+
+    def start(self):
+        """人齐开局：打乱座次、每人发 7 张，翻开的第一张必须是数字牌"""
+        state = self.state
+        self.rng.shuffle(state['player'])
+        deck = cards.new_deck(self.rng)
+        state['deck'] = deck
+        for player in state['player']:
+            hand = cards.Hand()
+            hand.draw_from(deck, HAND_SIZE)
+            state['hand'][player] = hand
+
+        while True:
+            self.refill_deck()
+            deck = state['deck']
+            top = deck.pop()
+            if cards.IS_DIGIT[top]:
+                break
+            deck.append(top)
+            self.rng.shuffle(deck)
+
+        state['top'] = top
+        state['table_history'] = bytearray([top])
+        state['status'] = 'playing'
+        self.emit('game_started')
+
+    def refill_deck(self):
+        """牌堆为空时换一副新洗好的牌，返回是否补过牌"""
+        if self.state['deck']:
+            return False
+        self.state['deck'] = cards.new_deck(self.rng)
+        self.emit('deck_refilled')
+        return True
+
+    def can_play(self, card):
+        return cards.can_play(card, self.state['top'], self.state['chosen_color'])
+
+    def check_turn(self, player):
+        if self.state['status'] != 'playing':
+            raise IllegalMove('Game is not in progress')
+        if self.current_player != player:
+            raise IllegalMove('Not your turn')
+
+    def skip(self, player):
+        """SK：摸一张牌，轮到下家"""
+        self.check_turn(player)
+        self.refill_deck()
+        drawn = self.state['hand'][player].draw_from(self.state['deck'], 1)
+        if drawn:
+            self.state['table_history'].append(cards.SK)
+        self.emit('draw', player=player, count=drawn)
+        self.rotate_turn()
+
+    def play(self, player, card, color=None):
+        """出牌；card 为 None 表示无法识别的牌面，万能牌未给 color 时随机选色"""
+        self.check_turn(player)
+        state = self.state
+        hand = state['hand'][player]
+        if card is None or card not in hand:
+            raise IllegalMove('Card not in hand')
+        if not self.can_play(card):
+            raise IllegalMove('Card does not match')
+
+        hand.remove(card)
+        state['top'] = card
+        state['table_history'].append(card)
+        if cards.IS_WILD[card]:
+            if color is None:
+                color = self.rng.randrange(len(cards.COLORS))
+            state['chosen_color'] = color
+        else:
+            # 打出普通牌后，清除万能牌颜色状态
+            state['chosen_color'] = None
+        self.emit('card_played', player=player, card=card, color=state['chosen_color'])
+
+        self.rotate_turn(card)
+
+        if not hand:
+            state['status'] = 'finished'
+            state['winner'] = player
+            self.emit('game_finished', winner=player)
+
+    def timeout(self):
+        """当前玩家超时：摸一张牌，记一个 TL，轮到下家"""
+        player = self.current_player
+        self.refill_deck()
+        if self.state['hand'][player].draw_from(self.state['deck'], 1):
+            self.state['table_history'].append(cards.TL)
+        self.emit('timeout', player=player)
+        self.rotate_turn()
+
+    def rotate_turn(self, played_card=None):
+        state = self.state
+        players = state['player']
+        n = len(players)
+        direction = state['direction']
+
+        if played_card is not None:
+            if cards.REVERSES[played_card]:
+                direction = -direction
+                state['direction'] = direction
+            draw_count = cards.DRAW_COUNT[played_card]
+            if draw_count:
+                target = players[(state['turn'] + direction) % n]
+                self.refill_deck()
+                drawn = state['hand'][target].draw_from(state['deck'], draw_count)
+                self.emit('draw', player=target, count=drawn)
+            # 万能牌后继续由自己出牌
+            if cards.IS_WILD[played_card]:
+                return
+            # 跳过/加2都跳到下下家
+            if cards.SKIPS[played_card]:
+                state['turn'] = (state['turn'] + 2 * direction) % n
+                return
+        # 普通牌正常轮换
+        state['turn'] = (state['turn'] + direction) % n
@@ -0,0 +1,153 @@
+"""asyncio 下的 HTTP/1.1 收发：解析 keep-alive 连接上的请求、编码响应
+
+aserver 与 router 共用，不依赖 server，路由进程只导入这里而不加载游戏状态。
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import urllib.parse
+
+# /batch 单次最多的操作数，server 校验、router 按分片拆分时共用
+MAX_BATCH_OPS = 256
+# keep-alive 连接空闲超过该时间（秒）即关闭
+IDLE_TIMEOUT = 300
+MAX_BODY_SIZE = 64 * 1024
+LISTEN_BACKLOG = 4096
+# 部署在 router.py 之后时，以本机对端传来的 X-Forwarded-For 作为客户端地址
+TRUST_PROXY = os.environ.get('UNO_TRUST_PROXY', '') not in ('', '0')
+LOOPBACK = ('127.0.0.1', '::1')
+
+REASONS = {
+    200: 'OK',
+    204: 'No Content',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    403: 'Forbidden',
+    404: 'Not Found',
+    413: 'Payload Too Large',
+    429: 'Too Many Requests',
+    500: 'Internal Server Error',
+    502: 'Bad Gateway',
+}
+
+
+class Request:
+    __slots__ = (
+        'method',
+        'target',
+        'path',
+        'query',
+        'headers',
+        'body',
+        'remote_addr',
+        '_json',
+    )
+
+    def __init__(self, method, target, headers, body, remote_addr):
+        self.method = method
+        self.target = target
+        path, _, query = target.partition('?')
+        self.path = path
+        self.query = dict(urllib.parse.parse_qsl(query))
+        self.headers = headers
+        self.body = body
+        self.remote_addr = remote_addr
+        self._json = None
+
+    def json(self):
+        """请求体解析为 dict，结果缓存（限流与处理函数都会用到）"""
+        if self._json is None:
+            try:
+                data = json.loads(self.body or b'null')
+            except ValueError:
+                data = None
+            self._json = (data if isinstance(data, dict) else None,)
+        return self._json[0]
+
+    def uid(self):
+        if self.method == 'GET':
+            return self.query.get('uid')
+        data = self.json()
+        return data.get('uid') if data else None
+
+
+def encode_response(status, body=b'', content_type=None, keep_alive=True, headers=()):
+    """body 为 None 表示分块传输的流式响应"""
+    lines = [
+        f'HTTP/1.1 {status} {REASONS.get(status, "OK")}',
+        'Access-Control-Allow-Origin: *',
+        f'Connection: {"keep-alive" if keep_alive else "close"}',
+    ]
+    if body is None:
+        lines.append('Transfer-Encoding: chunked')
+    elif status != 304:
+        lines.append(f'Content-Length: {len(body)}')
+    if content_type:
+        lines.append(f'Content-Type: {content_type}')
+    lines.extend(headers)
+    head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+    return head + (body or b'')
+
+
+async def handle_connection(reader, writer, dispatch_request):
+    """解析 keep-alive 连接上的请求，逐个交给 dispatch_request 处理"""
+    peer = writer.get_extra_info('peername')
+    remote_addr = peer[0] if peer else ''
+    try:
+        while True:
+            request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+            if not request_line:
+                break
+            method, target, version = request_line.decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY_SIZE:
+                writer.write(encode_response(413, keep_alive=False))
+                break
+            body = await reader.readexactly(length) if length else b''
+            connection = headers.get('connection', '').lower()
+            keep_alive = (
+                connection != 'close'
+                if version == 'HTTP/1.1'
+                else connection == 'keep-alive'
+            )
+            client_addr = remote_addr
+            if TRUST_PROXY and remote_addr in LOOPBACK:
+                forwarded = headers.get('x-forwarded-for')
+                if forwarded:
+                    client_addr = forwarded.split(',')[0].strip()
+            request = Request(method, target, headers, body, client_addr)
+            keep_alive = await dispatch_request(request, writer, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+        pass
+    except ValueError:
+        # 请求行或请求头格式错误
+        writer.write(encode_response(400, keep_alive=False))
+    finally:
+        with contextlib.suppress(Exception):
+            writer.close()
+            await writer.wait_closed()
+
+
+def raise_fd_limit():
+    # 上万个连接需要足够的文件描述符，Windows 上没有 resource 模块
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        with contextlib.suppress(ValueError, OSError):
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
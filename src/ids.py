@@ -0,0 +1,139 @@
+"""房间号与玩家 uid 的分配与校验
+
+房间号 6 位 = 5 位编号 + 1 位 Damm 校验位。编号对分片数取模即所属分片；
+每个进程把本分片的全部编号洗牌后放进空闲队列，分配从队头取、房间清理后放回队尾，
+O(1) 且不会与存活房间重复，回收的号码要等其余号码都用过一轮才会再次出现。
+
+uid 21 位 = 房间号 + 2 位座位序号 + 12 位随机数 + 1 位校验位。同一房间内座位序号
+不重复，存活房间号又互不相同，所以 uid 天然唯一。uid 是出牌的唯一凭证，
+而房间号对同房间的玩家公开、座位序号只有几种，不可猜测性全靠随机部分，
+因此保留与旧版相同的 12 位；它也让房间号回收后旧 uid 不会误命中新玩家。
+不查任何表就能校验格式、取出房间号、算出所属分片。
+旧版数据中的 12 位随机 uid 不满足这一结构，仍按原样查表使用。
+
+观战令牌与 uid 格式相同，座位序号固定为 SPECTATOR_SEAT（玩家座位不会用到），
+路由与校验方式也与 uid 完全一致。
+"""
+
+import collections
+import random
+
+ROOM_SERIAL_LEN = 5
+ROOM_ID_LEN = ROOM_SERIAL_LEN + 1
+SEAT_LEN = 2
+TOKEN_LEN = 12
+SPECTATOR_SEAT = 99
+PLAYER_ID_LEN = ROOM_ID_LEN + SEAT_LEN + TOKEN_LEN + 1
+
+# Damm 算法的全反对称拟群表：能发现所有单个数字错误与相邻数字对调
+DAMM_TABLE = (
+    (0, 3, 1, 7, 5, 9, 8, 6, 4, 2),
+    (7, 0, 9, 2, 1, 5, 4, 8, 6, 3),
+    (4, 2, 0, 6, 8, 7, 1, 3, 5, 9),
+    (1, 7, 5, 0, 9, 8, 3, 4, 2, 6),
+    (6, 1, 2, 3, 0, 4, 5, 9, 7, 8),
+    (3, 6, 7, 4, 2, 0, 9, 5, 8, 1),
+    (5, 8, 6, 9, 7, 2, 0, 1, 3, 4),
+    (8, 9, 4, 5, 3, 6, 2, 0, 1, 7),
+    (9, 4, 3, 8, 6, 1, 7, 2, 0, 5),
+    (2, 5, 8, 1, 4, 3, 6, 7, 9, 0),
+)
+
+
+def damm(digits):
+    interim = 0
+    for d in digits:
+        interim = DAMM_TABLE[interim][ord(d) - 48]
+    return interim
+
+
+def with_check_digit(digits):
+    return digits + str(damm(digits))
+
+
+def is_valid_room_id(value):
+    return (
+        isinstance(value, str)
+        and len(value) == ROOM_ID_LEN
+        and value.isdigit()
+        and damm(value) == 0
+    )
+
+
+def is_valid_uid(value):
+    return (
+        isinstance(value, str)
+        and len(value) == PLAYER_ID_LEN
+        and value.isdigit()
+        and damm(value) == 0
+        and damm(value[:ROOM_ID_LEN]) == 0
+    )
+
+
+def room_of(uid):
+    """新格式 uid 中的房间号，其他值返回 None"""
+    return uid[:ROOM_ID_LEN] if is_valid_uid(uid) else None
+
+
+def is_spectator_token(value):
+    return (
+        is_valid_uid(value)
+        and int(value[ROOM_ID_LEN : ROOM_ID_LEN + SEAT_LEN]) == SPECTATOR_SEAT
+    )
+
+
+def shard_of(value, count):
+    """房间号或 uid 所属的分片，格式不对时返回 None"""
+    if is_valid_uid(value):
+        value = value[:ROOM_ID_LEN]
+    elif not is_valid_room_id(value):
+        return None
+    return int(value[:ROOM_SERIAL_LEN]) % count
+
+
+def make_uid(room_id, seat, rng=random):
+    token = str(rng.randrange(10**TOKEN_LEN)).zfill(TOKEN_LEN)
+    return with_check_digit(f'{room_id}{seat:0{SEAT_LEN}d}{token}')
+
+
+def make_spectator_token(room_id, rng=random):
+    return make_uid(room_id, SPECTATOR_SEAT, rng)
+
+
+class RoomIdAllocator:
+    """本分片房间号的空闲队列"""
+
+    def __init__(self, shard_count=1, shard_index=0, rng=random):
+        self.shard_count = shard_count
+        self.shard_index = shard_index
+        self.rng = rng
+        self.free = collections.deque()
+        self.rebuild(())
+
+    def rebuild(self, live_ids):
+        """重新生成空闲队列，跳过 live_ids（启动时传入已恢复的房间号，含旧格式）"""
+        used = {
+            int(room_id[:ROOM_SERIAL_LEN])
+            for room_id in live_ids
+            if room_id[:ROOM_SERIAL_LEN].isdigit()
+        }
+        serials = [
+            serial
+            for serial in range(self.shard_index, 10**ROOM_SERIAL_LEN, self.shard_count)
+            if serial not in used
+        ]
+        self.rng.shuffle(serials)
+        self.free = collections.deque(serials)
+
+    def allocate(self):
+        """取一个空闲房间号，全部用完时返回 None"""
+        try:
+            serial = self.free.popleft()
+        except IndexError:
+            return None
+        return with_check_digit(str(serial).zfill(ROOM_SERIAL_LEN))
+
+    def release(self, room_id):
+        """房间清理后归还号码；旧格式的房间号不回收"""
+        if is_valid_room_id(room_id):
+            self.free.append(int(room_id[:ROOM_SERIAL_LEN]))
@@ -0,0 +1,312 @@
+"""无界面压测：对运行中的服务端开 N 个房间，每个房间 M 个机器人对局
+
+机器人只出合法牌，偶尔主动 SK，也会按概率故意不出牌等待服务端超时跳过。
+结束后以 JSON 输出各接口的吞吐、p50/p95/p99 延迟与错误率。所有机器人来自同一 IP，
+服务端需关闭限流，例如：
+
+    UNO_TURN_TIMEOUT=2 UNO_RATE_LIMIT=0 python server.py
+    python loadtest.py --rooms 200 --players 2-8 --output result.json
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+import requests
+
+import cards
+from engine import MIN_COUNT, MAX_COUNT
+
+# 带 since 的 /status 会挂起到版本变化，单独统计，不计入 /status 延迟
+STATUS_WAIT = 'status_wait'
+
+
+class Recorder:
+    """线程安全的请求统计：按接口记录延迟（秒）、传输错误与业务失败"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.errors = {}
+        self.fails = {}
+        self.counters = {}
+
+    def record(self, endpoint, elapsed, error=False, fail=False):
+        with self._lock:
+            self.latency.setdefault(endpoint, []).append(elapsed)
+            if error:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            if fail:
+                self.fails[endpoint] = self.fails.get(endpoint, 0) + 1
+
+    def count(self, key, n=1):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def report(self, duration):
+        endpoints = {}
+        total = total_errors = 0
+        with self._lock:
+            for endpoint, samples in sorted(self.latency.items()):
+                samples = sorted(samples)
+                n = len(samples)
+                errors = self.errors.get(endpoint, 0)
+                fails = self.fails.get(endpoint, 0)
+                total += n
+                total_errors += errors
+                endpoints[endpoint] = {
+                    'count': n,
+                    'rps': round(n / duration, 2) if duration else 0,
+                    'errors': errors,
+                    'fails': fails,
+                    'error_rate': round(errors / n, 6),
+                    'fail_rate': round(fails / n, 6),
+                    'mean_ms': round(sum(samples) / n * 1000, 3),
+                    'p50_ms': percentile_ms(samples, 50),
+                    'p95_ms': percentile_ms(samples, 95),
+                    'p99_ms': percentile_ms(samples, 99),
+                    'max_ms': round(samples[-1] * 1000, 3),
+                }
+            counters = dict(self.counters)
+        return {
+            'duration': round(duration, 3),
+            'requests': total,
+            'rps': round(total / duration, 2) if duration else 0,
+            'error_rate': round(total_errors / total, 6) if total else 0,
+            'counters': counters,
+            'endpoints': endpoints,
+        }
+
+
+def percentile_ms(samples, p):
+    """已排序样本的最近秩百分位数，单位毫秒"""
+    index = max(0, -(-len(samples) * p // 100) - 1)
+    return round(samples[index] * 1000, 3)
+
+
+class Bot:
+    def __init__(self, server, room_id, username, recorder, args, seed):
+        self.server = server
+        self.room_id = room_id
+        self.username = username
+        self.recorder = recorder
+        self.args = args
+        self.rng = random.Random(seed)
+        self.session = requests.Session()
+        self.uid = None
+
+    def call(self, endpoint, payload, timeout=10):
+        """发送请求并记录统计，传输失败或非 200/304 时返回 None"""
+        path = 'status' if endpoint == STATUS_WAIT else endpoint
+        start = time.perf_counter()
+        try:
+            resp = self.session.post(
+                f'{self.server}/{path}', json=payload, timeout=timeout
+            )
+        except requests.RequestException:
+            self.recorder.record(endpoint, time.perf_counter() - start, error=True)
+            return None
+        elapsed = time.perf_counter() - start
+        if resp.status_code == 304:
+            self.recorder.record(endpoint, elapsed)
+            return {}
+        if resp.status_code != 200:
+            self.recorder.record(endpoint, elapsed, error=True)
+            return None
+        data = resp.json()
+        self.recorder.record(endpoint, elapsed, fail=data.get('status') != 'success')
+        return data
+
+    def choose(self, data):
+        """返回要出的牌与万能牌颜色；SK 表示摸一张跳过"""
+        top = cards.encode(data['top'])
+        chosen_color = cards.encode_color(data.get('chosen_color'))
+        legal = [
+            code
+            for code in set(data['hand'])
+            if cards.can_play(cards.encode(code), top, chosen_color)
+        ]
+        if not legal or self.rng.random() < self.args.sk_rate:
+            return 'SK', None
+        card = self.rng.choice(legal)
+        color = None
+        if card[0] == 'W':
+            # 选手里最多的颜色
+            colors = [code[0] for code in data['hand'] if code[0] in cards.COLORS]
+            color = max(cards.COLORS, key=colors.count) if colors else 'R'
+        return card, color
+
+    def run(self, deadline):
+        joined = self.call('join', {'id': self.room_id, 'username': self.username})
+        if not joined or joined.get('status') != 'success':
+            return
+        self.uid = joined['uid']
+        version = None
+        idle_version = None
+        while time.time() < deadline:
+            if version is None:
+                data = self.call('status', {'uid': self.uid, 'history_last': 1})
+            else:
+                data = self.call(
+                    STATUS_WAIT,
+                    {'uid': self.uid, 'since': version, 'history_last': 1},
+                    timeout=60,
+                )
+            if data is None:
+                time.sleep(0.5)
+                version = None
+                continue
+            if not data:
+                # 304：版本未变化，继续等
+                continue
+            if data.get('status') != 'success':
+                return
+            version = data['version']
+            if data['game_status'] == 'finished':
+                if data.get('winner') == self.username:
+                    self.recorder.count('games_finished')
+                return
+            if (
+                data['game_status'] != 'playing'
+                or data['current_idx'] != data['my_idx']
+            ):
+                continue
+            if version == idle_version:
+                continue
+            if self.rng.random() < self.args.timeout_rate:
+                # 故意不出牌，等服务端超时跳过
+                idle_version = version
+                self.recorder.count('intentional_timeouts')
+                continue
+            if self.args.think:
+                time.sleep(self.rng.uniform(0, self.args.think))
+            card, color = self.choose(data)
+            payload = {'uid': self.uid, 'card': card}
+            if color:
+                payload['color'] = color
+            result = self.call('play', payload)
+            self.recorder.count('turns')
+            if card == 'SK':
+                self.recorder.count('skips')
+            if result and result.get('status') == 'success':
+                # 自己的出牌已经改变了版本，立即刷新
+                version = None
+
+
+def run_room(index, args, recorder, deadline, threads):
+    rng = random.Random(args.seed * 1000003 + index)
+    count = rng.randint(*args.players)
+    start = time.perf_counter()
+    try:
+        resp = requests.post(f'{args.server}/create', json={'count': count}, timeout=10)
+        data = resp.json()
+    except (requests.RequestException, ValueError):
+        recorder.record('create', time.perf_counter() - start, error=True)
+        return
+    recorder.record(
+        'create', time.perf_counter() - start, fail=data.get('status') != 'success'
+    )
+    if data.get('status') != 'success':
+        return
+    recorder.count('rooms')
+    for seat in range(count):
+        bot = Bot(
+            args.server,
+            data['id'],
+            f'bot{index}-{seat}',
+            recorder,
+            args,
+            rng.getrandbits(64),
+        )
+        t = threading.Thread(target=bot.run, args=(deadline,), daemon=True)
+        t.start()
+        threads.append(t)
+
+
+def parse_players(value):
+    low, _, high = value.partition('-')
+    low = int(low)
+    high = int(high) if high else low
+    if not (MIN_COUNT <= low <= high <= MAX_COUNT):
+        raise argparse.ArgumentTypeError(
+            f'player count must be within {MIN_COUNT}..{MAX_COUNT}'
+        )
+    return low, high
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UNO server load test')
+    parser.add_argument('--server', default='http://127.0.0.1:5000')
+    parser.add_argument('--rooms', type=int, default=50, help='number of rooms')
+    parser.add_argument(
+        '--players',
+        type=parse_players,
+        default=(4, 4),
+        help='players per room, e.g. 4 or 2-8 (random per room)',
+    )
+    parser.add_argument(
+        '--duration', type=float, default=300, help='stop after this many seconds'
+    )
+    parser.add_argument(
+        '--ramp', type=float, default=0, help='spread room creation over seconds'
+    )
+    parser.add_argument(
+        '--sk-rate', type=float, default=0.05, help='chance to SK with a legal card'
+    )
+    parser.add_argument(
+        '--timeout-rate',
+        type=float,
+        default=0.01,
+        help='chance to idle a turn until the server times it out',
+    )
+    parser.add_argument(
+        '--think', type=float, default=0, help='max random delay before playing'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument(
+        '--max-error-rate',
+        type=float,
+        default=None,
+        help='exit with status 1 if the overall error rate is higher',
+    )
+    args = parser.parse_args()
+    args.server = args.server.rstrip('/')
+
+    recorder = Recorder()
+    threads = []
+    start = time.time()
+    deadline = start + args.duration
+    for index in range(args.rooms):
+        if args.ramp:
+            time.sleep(max(0, start + args.ramp * index / args.rooms - time.time()))
+        run_room(index, args, recorder, deadline, threads)
+    for t in threads:
+        t.join(max(0, deadline - time.time()))
+    duration = time.time() - start
+
+    report = recorder.report(duration)
+    report['config'] = {
+        'server': args.server,
+        'rooms': args.rooms,
+        'players': list(args.players),
+        'sk_rate': args.sk_rate,
+        'timeout_rate': args.timeout_rate,
+        'think': args.think,
+        'seed': args.seed,
+    }
+    report['counters']['unfinished_bots'] = sum(t.is_alive() for t in threads)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+    if args.max_error_rate is not None and report['error_rate'] > args.max_error_rate:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
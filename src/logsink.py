@@ -0,0 +1,110 @@
+"""loguru 后台写出：请求线程只把日志记录放进有界队列，格式化与写盘都在后台线程
+
+loguru 自带的 enqueue=True 仍在调用线程格式化并 pickle 记录、写入管道，
+写出跟不上时会反压到请求线程；这里队列满了直接丢弃并计数，绝不阻塞。
+控制台输出为可读文本，文件为每行一个 JSON（bind 的字段展开到顶层），
+文件的切分与保留仍交给 loguru 的文件 sink，只是由后台线程调用。
+"""
+
+import atexit
+import copy
+import json
+import sys
+import threading
+import queue
+
+from loguru import logger
+
+QUEUE_SIZE = 10000
+# 后台线程一次最多合并写出的记录数
+BATCH_SIZE = 256
+
+
+def format_console(record):
+    line = '[{:%Y-%m-%d %H:%M:%S}] <{}> {}'.format(
+        record['time'], record['level'].name, record['message']
+    )
+    body = record['extra'].get('body')
+    if body is not None:
+        line += ' ' + json.dumps(body, ensure_ascii=False, default=str)
+    return line + '\n'
+
+
+def format_json(record):
+    entry = {
+        'time': record['time'].isoformat(),
+        'level': record['level'].name,
+        'message': record['message'],
+        'module': record['name'],
+        'line': record['line'],
+        **record['extra'],
+    }
+    if record['exception'] is not None:
+        entry['exception'] = repr(record['exception'].value)
+    return json.dumps(entry, ensure_ascii=False, default=str) + '\n'
+
+
+class BackgroundWriter:
+    """作为 loguru 的 sink 使用：logger.add(writer, level='DEBUG', format='{message}')"""
+
+    def __init__(self, console_level='INFO', path=None, maxsize=QUEUE_SIZE, **options):
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.console_level = logger.level(console_level).no
+        self.file_logger = None
+        if path:
+            # 独立的 loguru 实例，只在后台线程里写文件
+            self.file_logger = copy.deepcopy(logger)
+            self.file_logger.remove()
+            self.file_logger.add(path, format='{message}', **options)
+        self._write_lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.flush)
+
+    def __call__(self, message):
+        try:
+            self.queue.put_nowait(message.record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _take(self, block):
+        records = []
+        try:
+            if block:
+                records.append(self.queue.get())
+            while len(records) < BATCH_SIZE:
+                records.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return records
+
+    def _write(self, records):
+        with self._write_lock:
+            console = [
+                format_console(r)
+                for r in records
+                if r['level'].no >= self.console_level
+            ]
+            if console:
+                sys.stdout.write(''.join(console))
+                sys.stdout.flush()
+            if self.file_logger is not None:
+                self.file_logger.opt(raw=True).info(
+                    ''.join(format_json(r) for r in records)
+                )
+
+    def _run(self):
+        while True:
+            records = self._take(block=True)
+            try:
+                self._write(records)
+            except Exception as e:
+                sys.stderr.write(f'Failed to write logs: {e}\n')
+
+    def flush(self):
+        """退出前把队列中剩余的记录同步写完"""
+        while True:
+            records = self._take(block=False)
+            if not records:
+                return
+            self._write(records)
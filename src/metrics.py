@@ -0,0 +1,191 @@
+"""进程内指标与 Prometheus 文本格式输出
+
+计数器、直方图每次更新只持有各自的一把小锁做几次整数加法，开销在微秒以下，
+可以在生产环境常开；房间数、定时器数这类量用 Gauge 回调在抓取时才计算。
+"""
+
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 请求与锁耗时的默认分桶（秒），上限覆盖长轮询的挂起时间
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+
+_metrics = []
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{n}="{escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        _metrics.append(self)
+
+    def labels(self, *values):
+        """取某组标签值对应的子指标；调用方可缓存返回值以省去查表"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('_lock', 'value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def _render_child(self, values, child):
+        labels = format_labels(self.labelnames, values)
+        yield f'{self.name}{labels} {format_value(child.value)}'
+
+
+class _HistogramChild:
+    __slots__ = ('_lock', 'bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self._lock = threading.Lock()
+        self.bounds = bounds
+        # 最后一格是 +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def _render_child(self, values, child):
+        with child._lock:
+            counts = list(child.counts)
+            total = child.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = 'le="' + format_value(float(bound)) + '"'
+            labels = format_labels(self.labelnames, values, le)
+            yield f'{self.name}_bucket{labels} {cumulative}'
+        labels = format_labels(self.labelnames, values)
+        yield f'{self.name}_sum{labels} {format_value(total)}'
+        yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Gauge(Metric):
+    """抓取时调用 collect()，返回 {标签值元组: 数值}"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        for values, value in sorted(self.collect().items()):
+            labels = format_labels(self.labelnames, values)
+            lines.append(f'{self.name}{labels} {format_value(value)}')
+        return lines
+
+
+class CallbackCounter(Gauge):
+    """抓取时调用 collect() 的计数器，数值由其他模块自行累加、只增不减"""
+
+    kind = 'counter'
+
+
+def render():
+    """所有已注册指标的 Prometheus 文本格式"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
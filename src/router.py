@@ -0,0 +1,336 @@
+"""多进程分片入口：启动 N 个 aserver 工作进程，按房间号/uid 把请求转发到所属进程
+
+    python router.py [workers] [port]
+
+第 i 个工作进程只创建编号 % N == i 的房间，uid 内含房间号（见 ids），
+因此路由只需从请求中的 id/uid 算出分片，不需要任何全局表；/create 轮流分给各进程，
+/ban_ip 与 /unban_ip 广播到所有进程，
+/batch 按 uid 拆成各分片的子批量并发转发，再按原顺序合并结果。工作进程监听 127.0.0.1 上的
+WORKER_BASE_PORT + i，各自写 data-<i>.json、data-<i>.wal 与 uno_server-<i>.log，
+退出后由路由进程自动拉起并从自己的数据文件恢复。
+/metrics 转发到 0 号进程，各分片的指标请直接抓取对应工作进程的端口。
+"""
+
+import asyncio
+import contextlib
+import functools
+import itertools
+import json
+import os
+import signal
+import subprocess
+import sys
+
+from loguru import logger
+
+import httpio
+import ids
+
+HOST = '0.0.0.0'
+PORT = 5000
+WORKER_HOST = '127.0.0.1'
+WORKER_BASE_PORT = 5100
+# 每个工作进程保留的空闲上游连接数
+MAX_IDLE_CONNECTIONS = 64
+# 转发给工作进程的请求头
+FORWARD_HEADERS = ('content-type', 'accept', 'last-event-id')
+# 请求中用来确定分片的字段：路由 -> (位置, 字段名)
+SHARD_KEYS = {
+    '/status': ('body', 'uid'),
+    '/play': ('body', 'uid'),
+    '/history': ('body', 'uid'),
+    '/join': ('body', 'id'),
+    '/spectate': ('body', 'id'),
+    '/events': ('query', 'uid'),
+}
+BROADCAST_PATHS = ('/ban_ip', '/unban_ip')
+
+
+class Worker:
+    """一个工作进程及到它的空闲 keep-alive 连接池"""
+
+    def __init__(self, index, count, port):
+        self.index = index
+        self.count = count
+        self.port = port
+        self.process = None
+        self.idle = []
+
+    def start(self):
+        env = dict(
+            os.environ,
+            UNO_SHARDS=str(self.count),
+            UNO_SHARD=str(self.index),
+            UNO_TRUST_PROXY='1',
+        )
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aserver.py')
+        self.process = subprocess.Popen(
+            [sys.executable, script, str(self.port), WORKER_HOST], env=env
+        )
+        logger.info(f"Worker {self.index} started on port {self.port}")
+
+    async def acquire(self):
+        while self.idle:
+            reader, writer = self.idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.open_connection(WORKER_HOST, self.port)
+        return reader, writer, False
+
+    def release(self, reader, writer):
+        if len(self.idle) < MAX_IDLE_CONNECTIONS and not writer.is_closing():
+            self.idle.append((reader, writer))
+        else:
+            writer.close()
+
+
+class Router:
+    def __init__(self, count, base_port=WORKER_BASE_PORT):
+        self.workers = [Worker(i, count, base_port + i) for i in range(count)]
+        self._next_create = itertools.cycle(range(count))
+
+    def pick(self, request):
+        """返回处理该请求的工作进程列表（广播时为全部）"""
+        if request.path in BROADCAST_PATHS:
+            return self.workers
+        if request.path == '/create':
+            return [self.workers[next(self._next_create)]]
+        key = SHARD_KEYS.get(request.path)
+        value = None
+        if key is not None:
+            where, field = key
+            if where == 'query':
+                value = request.query.get(field)
+            else:
+                data = request.json()
+                value = data.get(field) if data else None
+        # 格式不对的号码交给 0 号进程，由它返回错误
+        shard = ids.shard_of(value, len(self.workers))
+        return [self.workers[shard or 0]]
+
+    def split_batch(self, request):
+        """/batch 的操作按分片分组，返回 (操作总数, [(分片, 原下标列表, 子请求)])；
+        无需拆分（只有一个进程、格式错误或超出上限）时返回 None"""
+        data = request.json()
+        ops = data.get('ops') if data else None
+        if len(self.workers) == 1 or not isinstance(ops, list):
+            return None
+        if not ops or len(ops) > httpio.MAX_BATCH_OPS:
+            return None
+        groups = {}
+        for i, op in enumerate(ops):
+            uid = op.get('uid') if isinstance(op, dict) else None
+            shard = ids.shard_of(uid, len(self.workers))
+            groups.setdefault(shard or 0, []).append(i)
+        parts = []
+        for shard, indexes in groups.items():
+            body = json.dumps({'ops': [ops[i] for i in indexes]}).encode('utf-8')
+            sub = httpio.Request(
+                request.method,
+                request.target,
+                request.headers,
+                body,
+                request.remote_addr,
+            )
+            parts.append((shard, indexes, sub))
+        return len(ops), parts
+
+    async def batch(self, total, parts):
+        """并发执行各分片的子批量，返回合并后的响应体"""
+        responses = await asyncio.gather(
+            *(self.fetch(self.workers[shard], sub) for shard, _, sub in parts)
+        )
+        results = [None] * total
+        for (_, indexes, _), (_, body) in zip(parts, responses):
+            reply = json.loads(body)
+            if reply.get('status') != 'success':
+                return body
+            for i, result in zip(indexes, reply['results']):
+                results[i] = result
+        return json.dumps(
+            {'status': 'success', 'results': results}, ensure_ascii=False
+        ).encode('utf-8')
+
+    async def dispatch(self, request, writer, keep_alive):
+        split = self.split_batch(request) if request.path == '/batch' else None
+        if split is not None:
+            try:
+                body = await self.batch(*split)
+                status = 200
+            except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                logger.error(f"Worker unavailable for {request.path}: {e}")
+                body = json.dumps({'status': 'fail', 'reason': 'Shard unavailable'})
+                body, status = body.encode('utf-8'), 502
+            writer.write(
+                httpio.encode_response(status, body, 'application/json', keep_alive)
+            )
+            return keep_alive
+        workers = self.pick(request)
+        try:
+            if len(workers) > 1:
+                # 广播：所有进程都执行，回复 0 号进程的结果
+                responses = await asyncio.gather(
+                    *(self.fetch(worker, request) for worker in workers)
+                )
+            else:
+                upstream = await self.send(workers[0], request)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            logger.error(f"Worker unavailable for {request.path}: {e}")
+            body = json.dumps({'status': 'fail', 'reason': 'Shard unavailable'})
+            writer.write(
+                httpio.encode_response(
+                    502, body.encode('utf-8'), 'application/json', keep_alive
+                )
+            )
+            return keep_alive
+        if len(workers) > 1:
+            head, body = responses[0]
+            writer.write(rewrite_head(head, keep_alive) + body)
+        else:
+            # 响应头写出之后的错误只能断开客户端连接
+            await self.relay(workers[0], *upstream, writer, keep_alive)
+        return keep_alive
+
+    async def send(self, worker, request):
+        """发出请求并读回响应头；复用的连接已被对端关闭时换新连接重试一次"""
+        for attempt in range(2):
+            reader, upstream, reused = await worker.acquire()
+            try:
+                upstream.write(encode_request(request))
+                status_line = await reader.readline()
+                if not status_line:
+                    raise ConnectionError('upstream closed')
+                head, headers = await read_head(reader, status_line)
+                return reader, upstream, head, headers
+            except (OSError, asyncio.IncompleteReadError):
+                upstream.close()
+                if not reused or attempt:
+                    raise
+
+    async def fetch(self, worker, request):
+        reader, upstream, head, headers = await self.send(worker, request)
+        body = await read_body(reader, headers)
+        worker.release(reader, upstream)
+        return head, body
+
+    async def relay(self, worker, reader, upstream, head, headers, writer, keep_alive):
+        try:
+            writer.write(rewrite_head(head, keep_alive))
+            if headers.get('transfer-encoding', '').lower() == 'chunked':
+                # /events：逐块转发直到结束块，客户端断开时连同上游连接一起关闭
+                while True:
+                    size_line = await reader.readline()
+                    size = int(size_line.split(b';')[0], 16)
+                    writer.write(size_line + await reader.readexactly(size + 2))
+                    await writer.drain()
+                    if size == 0:
+                        break
+            else:
+                writer.write(await read_body(reader, headers))
+        except BaseException:
+            upstream.close()
+            raise
+        worker.release(reader, upstream)
+
+    async def supervise(self):
+        """工作进程退出后重新拉起"""
+        while True:
+            await asyncio.sleep(1)
+            for worker in self.workers:
+                code = worker.process.poll()
+                if code is not None:
+                    logger.warning(f"Worker {worker.index} exited with {code}")
+                    for _, writer in worker.idle:
+                        writer.close()
+                    worker.idle.clear()
+                    worker.start()
+
+    def stop(self):
+        for worker in self.workers:
+            if worker.process and worker.process.poll() is None:
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process:
+                with contextlib.suppress(subprocess.TimeoutExpired):
+                    worker.process.wait(5)
+
+
+def encode_request(request):
+    lines = [
+        f'{request.method} {request.target} HTTP/1.1',
+        f'Host: {WORKER_HOST}',
+        f'Content-Length: {len(request.body)}',
+        f'X-Forwarded-For: {request.remote_addr}',
+    ]
+    for key in FORWARD_HEADERS:
+        value = request.headers.get(key)
+        if value is not None:
+            lines.append(f'{key}: {value}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + request.body
+
+
+async def read_head(reader, status_line):
+    """读取响应头，返回 (原始行列表, 小写键的 dict)"""
+    lines = [status_line]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        lines.append(line)
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    return lines, headers
+
+
+async def read_body(reader, headers):
+    length = int(headers.get('content-length', 0))
+    return await reader.readexactly(length) if length else b''
+
+
+def rewrite_head(lines, keep_alive):
+    """沿用工作进程的响应头，只把 Connection 换成与客户端之间的值"""
+    kept = [line for line in lines if not line.lower().startswith(b'connection:')]
+    kept.append(
+        b'Connection: keep-alive\r\n' if keep_alive else b'Connection: close\r\n'
+    )
+    return b''.join(kept) + b'\r\n'
+
+
+async def serve(count, host=HOST, port=PORT):
+    router = Router(count)
+    for worker in router.workers:
+        worker.start()
+    supervisor = asyncio.create_task(router.supervise())
+    listener = await asyncio.start_server(
+        functools.partial(httpio.handle_connection, dispatch_request=router.dispatch),
+        host,
+        port,
+        backlog=httpio.LISTEN_BACKLOG,
+        reuse_address=True,
+    )
+    logger.info(f"Router listening on {host}:{port} with {count} workers")
+    # 收到 SIGTERM/SIGINT 时停止监听，并在 finally 中结束工作进程
+    task = asyncio.current_task()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):
+            asyncio.get_running_loop().add_signal_handler(signum, task.cancel)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        supervisor.cancel()
+        router.stop()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 1
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else PORT
+    httpio.raise_fd_limit()
+    with contextlib.suppress(KeyboardInterrupt, asyncio.CancelledError):
+        asyncio.run(serve(count, HOST, port))
+
+
+if __name__ == '__main__':
+    main()
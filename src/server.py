@@ -1,428 +1,1034 @@
 from loguru import logger
-import sys
 
 # 移除 Flask 默认日志
 import logging
+import os
 
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
+from logsink import BackgroundWriter
+
+# 多进程分片时（见 router.py）每个工作进程的日志与数据文件名带上分片编号
+SHARD_SUFFIX = f"-{os.environ['UNO_SHARD']}" if 'UNO_SHARD' in os.environ else ''
+
+# 日志只在后台线程格式化与写出：控制台 INFO 及以上，文件为 DEBUG 起的 JSON 行
 logger.remove()
-logger.add(
-    sys.stdout, level="INFO", format="[{time:YYYY-MM-DD HH:mm:ss}] <{level}> {message}"
-)
-logger.add(
-    "uno_server.log",
+log_writer = BackgroundWriter(
+    console_level="INFO",
+    path=f"uno_server{SHARD_SUFFIX}.log",
     rotation="10 MB",
     retention="10 days",
-    level="DEBUG",
     encoding="utf-8",
 )
+logger.add(log_writer, level="DEBUG", format="{message}")
 
+import collections
+import contextlib
+import heapq
+import itertools
 import json
 import flask
 import flask_cors
 import random
 import threading
 import time
-import os
+import queue
+
+import admission
+import cards
+import httpio
+import ids
+import metrics
+import wire
+from engine import MIN_COUNT, MAX_COUNT, GameEngine, IllegalMove
 
 app = flask.Flask(__name__)
 flask_cors.CORS(app)
 
-MIN_COUNT = 2
-MAX_COUNT = 12
-
-CHARSET = '0123456789'
-ROOM_ID_LEN = 6
-PLAYER_ID_LEN = 12
+# 分片：本进程只创建编号 % SHARD_COUNT == SHARD_INDEX 的房间，
+# uid 内含房间号，路由据此即可找到进程（见 ids.shard_of）
+SHARD_COUNT = int(os.environ.get('UNO_SHARDS', 1))
+SHARD_INDEX = int(os.environ.get('UNO_SHARD', 0))
 
 MIN_CLIENT_VERSION = '3.0.0'
 
+# /status 长轮询最长挂起时间（秒）
+LONG_POLL_TIMEOUT = 25
+# 每个房间保留的最近事件数，/events 断线重连时据此补发
+EVENT_BACKLOG = 256
+# /events 无事件时发送心跳的间隔（秒）
+EVENT_KEEPALIVE = 15
+# 各路由请求日志的级别与采样率，未列出的路由为 INFO、全量记录；
+# /status 轮询量最大，只按 1% 采样记到 DEBUG（仅写入文件）
+REQUEST_LOG_LEVELS = {'status': 'DEBUG', 'events': 'INFO'}
+REQUEST_LOG_SAMPLE = {'status': 0.01}
+# 回合超时自动跳过（秒），压测时可用环境变量调小
+TURN_TIMEOUT = float(os.environ.get('UNO_TURN_TIMEOUT', 60))
+# 房间休眠：超过 HIBERNATE_AFTER 秒无人访问的房间写入记录文件并移出内存，再次访问时读回；
+# 常驻内存的房间数超过 ROOM_BUDGET（0 为不限）时，按最久未访问的顺序提前写出。
+# ROOM_BUDGET 限制的是房间个数而不是内存：房间大小随人数与内存中的出牌记录而变，
+# 需按实际负载估算单个房间的占用再设定
+HIBERNATE_AFTER = float(os.environ.get('UNO_HIBERNATE_AFTER', 600))
+ROOM_BUDGET = int(os.environ.get('UNO_ROOM_BUDGET', 10000))
+# 空闲检查的间隔（秒）
+HIBERNATE_INTERVAL = 30
+# 按预算提前写出时也不动这段时间内访问过的房间，长轮询与 SSE 心跳都短于它
+HIBERNATE_MIN_IDLE = 2 * LONG_POLL_TIMEOUT
+# 休眠超过该时间（秒）仍无人访问的房间视为废弃：清理并回收房间号，不再随快照一代代拷贝
+HIBERNATE_MAX_AGE = float(os.environ.get('UNO_HIBERNATE_MAX_AGE', 86400))
+# 令牌桶限流：路由 -> {范围: (每秒补充令牌数, 桶容量)}，范围为来源 IP 或请求中的 uid；
+# 未列出的路由不限流，压测时可用 UNO_RATE_LIMIT=0 关闭。/batch 每个操作消耗一个令牌，
+# 桶容量需容得下一个最大的批量，其中每个操作还要过对应路由的 uid 限额
+RATE_LIMIT = os.environ.get('UNO_RATE_LIMIT', '1') != '0'
+ROUTE_LIMITS = {
+    'status': {'ip': (50, 100), 'uid': (10, 20)},
+    'play': {'ip': (20, 40), 'uid': (5, 10)},
+    'history': {'ip': (5, 10), 'uid': (1, 5)},
+    'events': {'ip': (2, 10), 'uid': (1, 5)},
+    'batch': {'ip': (100, httpio.MAX_BATCH_OPS)},
+    'join': {'ip': (2, 10)},
+    'spectate': {'ip': (2, 10)},
+    'create': {'ip': (1, 5)},
+    'ban_ip': {'ip': (1, 5)},
+    'unban_ip': {'ip': (1, 5)},
+}
+
 name = {}
 room = {}
 where = {}
+# 房间事件队列：room_id -> deque[{'event', 'version', ...}]，不做持久化
+room_events = {}
+# 状态快照缓存：room_id -> StatusSnapshot，房间版本变化时作废
+status_cache = {}
+# 尚未载入内存的房间：room_id -> StoredRoom，首次访问时由 hydrate_room 读回
+stored_rooms = {}
+# 房间最近一次被玩家或观众访问的时间：room_id -> time.time()，用于判断空闲
+room_activity = {}
+
+# 监控指标，由 /metrics 以 Prometheus 文本格式输出
+REQUESTS = metrics.Counter(
+    'uno_http_requests_total',
+    'HTTP requests by route and status code',
+    ('route', 'code'),
+)
+REQUEST_SECONDS = metrics.Histogram(
+    'uno_http_request_duration_seconds',
+    'HTTP request latency by route, long-poll waits included',
+    ('route',),
+)
+LOCK_WAIT_SECONDS = metrics.Histogram(
+    'uno_room_lock_wait_seconds', 'Time spent waiting to acquire a room lock'
+)
+LOCK_HOLD_SECONDS = metrics.Histogram(
+    'uno_room_lock_hold_seconds', 'Time a room lock is held, condition waits excluded'
+)
+DECK_REFILLS = metrics.Counter('uno_deck_refills_total', 'Decks refilled when empty')
+TURN_TIMEOUTS = metrics.Counter('uno_turn_timeouts_total', 'Turns skipped on timeout')
+HIBERNATED_ROOMS = metrics.Counter(
+    'uno_rooms_hibernated_total', 'Idle rooms written to disk and evicted from memory'
+)
+RATE_LIMITED = metrics.Counter(
+    'uno_rate_limited_total',
+    'Requests rejected by the rate limiter by route and scope',
+    ('route', 'scope'),
+)
+SAVE_SECONDS = metrics.Histogram(
+    'uno_snapshot_save_seconds',
+    'Duration of a periodic snapshot save',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
 
-lock = threading.Lock()
 
+def observe_request(route, code, seconds):
+    REQUESTS.labels(route, str(code)).inc()
+    REQUEST_SECONDS.labels(route).observe(seconds)
+
+
+class TimedCondition(threading.Condition):
+    """记录等锁与持锁时间的房间锁；重入只按最外层计时，wait() 挂起期间不计持锁"""
+
+    def __init__(self):
+        super().__init__()
+        self._depth = 0
+        self._acquired_at = 0.0
+        self._held = 0.0
+
+    def __enter__(self):
+        start = time.perf_counter()
+        result = super().__enter__()
+        if self._depth == 0:
+            self._acquired_at = time.perf_counter()
+            self._held = 0.0
+            LOCK_WAIT_SECONDS.observe(self._acquired_at - start)
+        self._depth += 1
+        return result
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            LOCK_HOLD_SECONDS.observe(
+                self._held + time.perf_counter() - self._acquired_at
+            )
+        return super().__exit__(*exc_info)
+
+    def wait(self, timeout=None):
+        # wait 期间锁完全释放，其他线程会改写这些字段，返回后恢复
+        depth, held = self._depth, self._held + time.perf_counter() - self._acquired_at
+        self._depth = 0
+        try:
+            return super().wait(timeout)
+        finally:
+            self._depth, self._held = depth, held
+            self._acquired_at = time.perf_counter()
+
+
+# 锁约定：
+# - 每个房间一把锁 room_locks[room_id]（Condition），保护该房间 dict 的全部内容，
+#   同时用于唤醒该房间的长轮询/订阅者；
+# - registry_lock 只保护 room/where/name/room_locks 的成员增删；
+# - 加锁顺序：房间锁 -> registry_lock。任一时刻至多持有一把房间锁，
+#   registry_lock 为最内层锁，持有期间不再获取任何其他锁；
+# - 只读查找（where.get/room.get）不加 registry_lock，拿到房间锁后须重新确认房间仍存在；
+# - 按房间号或 uid 查找须经过 get_room_lock/lookup_uid，未载入的房间在此读回内存。
+registry_lock = threading.Lock()
+room_locks = {}
+# 房间锁的构造函数，asyncio 模式下替换为不加锁的实现
+new_room_lock = TimedCondition
+
+
+def get_room_lock(room_id):
+    """房间锁，房间尚未载入时先从磁盘读回；房间不存在时返回 None"""
+    room_lock = room_locks.get(room_id)
+    if room_lock is None and room_id in stored_rooms:
+        room_lock = hydrate_room(room_id)
+    return room_lock
+
+
+def lookup_uid(uid):
+    """玩家 uid 所在的房间号；新格式 uid 自带房间号，所在房间未载入时先读回"""
+    room_id = where.get(uid)
+    if room_id is None:
+        room_id = ids.room_of(uid)
+        if room_id not in stored_rooms:
+            return None
+    elif room_id not in stored_rooms:
+        return room_id
+    # 旧格式 uid 的归属随快照一起保存，所在房间同样可能尚未载入
+    if hydrate_room(room_id) is None:
+        return None
+    return where.get(uid)
+
+
+@contextlib.contextmanager
+def room_locked(room_id):
+    """持有房间锁期间产出该锁，房间不存在时产出 None；查到锁与拿到锁之间房间可能恰好休眠，
+    旧锁随之作废，此时读回房间后用新锁重试"""
+    while True:
+        room_lock = get_room_lock(room_id)
+        if room_lock is None:
+            yield None
+            return
+        with room_lock:
+            if room_id in room or room_id not in stored_rooms:
+                yield room_lock
+                return
 
-def getDeck():
-    deck = []
-    # 每种颜色0-9各1张（0只有1张，1-9各2张），S/R/D各2张
-    for c in 'RYGB':
-        deck.append(f'{c}0')
-        for i in range(1, 10):
-            deck.append(f'{c}{i}')
-            deck.append(f'{c}{i}')
-        deck.append(f'{c}S')
-        deck.append(f'{c}S')
-        deck.append(f'{c}R')
-        deck.append(f'{c}R')
-        deck.append(f'{c}D')
-        deck.append(f'{c}D')
-    # 万能牌
-    for _ in range(4):
-        deck.append('WW')
-        deck.append('WD')
-    random.shuffle(deck)
-    return deck
 
+def mark_active(room_id):
+    """记录房间被访问，空闲检查据此决定是否休眠"""
+    room_activity[room_id] = time.time()
 
-def getUid():
-    return ''.join(random.choices(CHARSET, k=PLAYER_ID_LEN))
 
+class Scheduler:
+    """单线程定时调度器：按截止时间小根堆触发回调，取代每个房间各开线程"""
 
-def getId():
-    return ''.join(random.choices(CHARSET, k=ROOM_ID_LEN))
-
-
-def sort_hand(hand):
-    color_order = {'R': 0, 'Y': 1, 'G': 2, 'B': 3}
-    func_order = {'S': 1, 'R': 2, 'D': 3}
-
-    def card_key(card):
-        if card.startswith('W'):
-            return (4, 0, 0, card)
-        color = card[0]
-        value = card[1:]
-        if value.isdigit():
-            return (color_order[color], 0, int(value), card)
-        elif value in func_order:
-            return (color_order[color], 1, func_order[value], card)
-        else:
-            return (color_order[color], 2, 0, card)
+    def __init__(self):
+        self._heap = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._thread = None
 
-    return sorted(hand, key=card_key)
+    def call_at(self, when, callback, *args):
+        """在时间戳 when（time.time()）到达后于调度线程中调用 callback(*args)"""
+        with self._cond:
+            heapq.heappush(self._heap, (when, next(self._seq), callback, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            # 新的定时器可能早于当前等待的那个
+            self._cond.notify()
 
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
 
-# [FIX] 新增：当牌堆用完时，自动洗牌
-def refill_deck_if_needed(room_instance):
-    """如果牌堆为空，则将历史记录洗牌作为新牌堆"""
-    if not room_instance['deck']:
-        logger.warning(
-            f"Room {where.get(room_instance['player'][0], '')} deck is empty. Refilling from history."
-        )
-        room_instance['deck'] = getDeck()
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.time()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    timeout = self._heap[0][0] - now if self._heap else None
+                    self._cond.wait(timeout)
+                _, _, callback, args = heapq.heappop(self._heap)
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Scheduled task {callback.__name__} failed: {e}")
 
 
-def schedule_room_cleanup(room_id, timeout=300, only_if_waiting=False):
-    def cleanup():
-        time.sleep(timeout)
-        with lock:
-            if room_id in room:
-                if only_if_waiting and room[room_id].get('status') != 'waiting':
-                    return
-                # 使用list拷贝以避免在迭代时修改字典
-                players_in_room = list(room[room_id].get('player', []))
+scheduler = Scheduler()
+
+
+room_ids = ids.RoomIdAllocator(SHARD_COUNT, SHARD_INDEX)
+
+
+def getUid(room_id, seat):
+    return ids.make_uid(room_id, seat)
+
+
+def getId():
+    """分配本分片一个未被占用的房间号，号码用尽时返回 None"""
+    return room_ids.allocate()
+
+
+def touch_room(room_instance, event=None, **payload):
+    """房间状态变化：版本号加一、记录事件并唤醒长轮询/订阅者，调用方需持有房间锁"""
+    room_instance['version'] = room_instance.get('version', 0) + 1
+    status_cache.pop(room_instance['id'], None)
+    if event:
+        events = room_events.setdefault(
+            room_instance['id'], collections.deque(maxlen=EVENT_BACKLOG)
+        )
+        events.append({'event': event, 'version': room_instance['version'], **payload})
+    room_locks[room_instance['id']].notify_all()
+
+
+def publish(room_instance, engine):
+    """把规则引擎产生的事件转成对外格式（昵称、两字符牌面、颜色字母）并广播"""
+    spill_history(room_instance)
+    for event, payload in engine.drain_events():
+        if 'player' in payload:
+            payload['player'] = name.get(payload['player'])
+        if 'winner' in payload:
+            payload['winner'] = name.get(payload['winner'])
+        if 'card' in payload:
+            payload['card'] = cards.CODES[payload['card']]
+        if 'color' in payload:
+            payload['color'] = cards.decode_color(payload['color'])
+        if event == 'deck_refilled':
+            DECK_REFILLS.inc()
+            logger.warning(f"Room {room_instance['id']} deck is empty. Refilled.")
+        touch_room(room_instance, event, **payload)
+
+
+def cleanup_room(room_id, only_if_waiting=False):
+    stored = stored_rooms.get(room_id)
+    if stored is not None and only_if_waiting and stored.status != 'waiting':
+        return
+    room_lock = get_room_lock(room_id)
+    if room_lock is None:
+        return
+    with room_lock:
+        if room_id in room:
+            if only_if_waiting and room[room_id].get('status') != 'waiting':
+                return
+            # 使用list拷贝以避免在迭代时修改字典
+            players_in_room = list(room[room_id].get('player', []))
+            with registry_lock:
                 for uid in players_in_room:
                     if uid in name:
                         del name[uid]
                     if uid in where:
                         del where[uid]
                 del room[room_id]
-                logger.info(f"Cleaned up room {room_id}")
-
-    t = threading.Thread(target=cleanup, daemon=True)
-    t.start()
-
-
-def rotate_turn(room, played_card=None, skip_count=0):
-    players = room['player']
-    n = len(players)
-    direction = room.get('direction', 1)
-
-    if played_card:
-        if played_card.endswith('R'):
-            direction *= -1
-            room['direction'] = direction
-        # 跳过牌和+2/+4都应跳过下家
-        skip = 0
-        draw_count = 0
-        is_wild = False
-        if played_card.endswith('S'):
-            skip = 1
-        if played_card.endswith('D'):
-            draw_count = 2
-            skip = 1
-        if played_card == 'WD':
-            draw_count = 4
-            is_wild = True
-            skip = 1
-        if played_card == 'WW':
-            is_wild = True
-        if draw_count > 0:
-            target_idx = (room['turn'] + direction) % n
-            target_player_id = players[target_idx]
-            refill_deck_if_needed(room)
-            for _ in range(draw_count):
-                if room['deck']:
-                    room['hand'][target_player_id].append(room['deck'].pop())
-            room['hand'][target_player_id] = sort_hand(room['hand'][target_player_id])
-        # 万能牌/功能牌后，是否继续由自己出牌
-        if is_wild:
-            room['wait_time'] = [0] * n
+                del room_locks[room_id]
+                room_ids.release(room_id)
+            wal.append({'op': 'cleanup', 'id': room_id, 'uids': players_in_room})
+            room_events.pop(room_id, None)
+            status_cache.pop(room_id, None)
+            room_activity.pop(room_id, None)
+            remove_history(room_id)
+            room_lock.notify_all()
+            logger.info(f"Cleaned up room {room_id}")
+
+
+def schedule_room_cleanup(room_id, timeout=300, only_if_waiting=False):
+    # 清理时间点记录在房间中，重启后可由 resume_timers 恢复
+    cleanup_at = time.time() + timeout
+    room[room_id]['cleanup_at'] = cleanup_at
+    scheduler.call_at(cleanup_at, cleanup_room, room_id, only_if_waiting)
+
+
+def reset_turn_deadline(room_instance):
+    """开始新的回合：记录本回合的超时时间点并登记到调度器"""
+    deadline = time.time() + TURN_TIMEOUT
+    room_instance['turn_deadline'] = deadline
+    scheduler.call_at(deadline, turn_timeout, room_instance['id'])
+
+
+def turn_timeout(room_id):
+    stored = stored_rooms.get(room_id)
+    if stored is not None and stored.timer_at is None:
+        # 休眠中的对局暂停计时，不再替缺席的玩家自动跳过
+        return
+    room_lock = get_room_lock(room_id)
+    if room_lock is None:
+        return
+    with room_lock:
+        current_room = room.get(room_id)
+        if current_room is None or current_room.get('status') != 'playing':
             return
-        # 跳过/加2/加4都应跳到下下家
-        if skip > 0:
-            room['turn'] = (room['turn'] + (1 + skip) * direction) % n
-            room['wait_time'] = [0] * n
+        # 回合已被出牌/跳过刷新，这是过期的定时器
+        deadline = current_room.get('turn_deadline')
+        if deadline is None or deadline > time.time():
             return
-    # 普通牌正常轮换
-    room['turn'] = (room['turn'] + direction) % n
-    if n > 0:
-        room['wait_time'] = [0] * n
 
+        engine = GameEngine(current_room)
+        logger.info(
+            f"Player {name.get(engine.current_player)} in room {room_id} timed out."
+        )
+        engine.timeout()
+        TURN_TIMEOUTS.inc()
+        publish(current_room, engine)
+        reset_turn_deadline(current_room)
+        log_room('timeout', current_room)
+
+
+def resume_timers():
+    """重启后按房间中保存的时间点恢复回合超时与房间清理，未载入的房间到点时再读回；
+    休眠的对局没有回合超时，读回时才重新计时，休眠到期的照常清理"""
+    now = time.time()
+    for room_id, stored in list(stored_rooms.items()):
+        if stored.expires_at is not None:
+            scheduler.call_at(
+                stored.expires_at, expire_room, room_id, stored.expires_at
+            )
+        timer_at = stored.timer_at
+        if stored.status == 'playing':
+            if timer_at is not None:
+                scheduler.call_at(timer_at, turn_timeout, room_id)
+        elif stored.status in ('waiting', 'finished'):
+            if timer_at is None:
+                timer_at = now + (300 if stored.status == 'waiting' else 600)
+            scheduler.call_at(
+                timer_at, cleanup_room, room_id, stored.status == 'waiting'
+            )
+    for room_id, room_lock in list(room_locks.items()):
+        with room_lock:
+            current_room = room.get(room_id)
+            if current_room is None:
+                continue
+            status = current_room.get('status')
+            if status == 'playing':
+                deadline = current_room.get('turn_deadline')
+                if deadline is None:
+                    deadline = now + TURN_TIMEOUT
+                    current_room['turn_deadline'] = deadline
+                scheduler.call_at(deadline, turn_timeout, room_id)
+            elif status in ('waiting', 'finished'):
+                cleanup_at = current_room.get('cleanup_at')
+                if cleanup_at is None:
+                    cleanup_at = now + (300 if status == 'waiting' else 600)
+                    current_room['cleanup_at'] = cleanup_at
+                scheduler.call_at(
+                    cleanup_at, cleanup_room, room_id, status == 'waiting'
+                )
+    logger.info(f"Resumed timers for {len(room) + len(stored_rooms)} rooms")
+
+
+def log_request(route, remote_addr, data=None):
+    """按路由级别与采样率记录一次请求；请求体由日志线程序列化"""
+    rate = REQUEST_LOG_SAMPLE.get(route, 1)
+    if rate < 1 and random.random() >= rate:
+        return
+    logger.bind(route=route, ip=remote_addr, sample=rate, body=data).log(
+        REQUEST_LOG_LEVELS.get(route, 'INFO'), f"/{route} called by {remote_addr}"
+    )
 
-def start_auto_skip_thread(room_id):
-    def auto_skip():
-        while True:
-            time.sleep(1)
-            with lock:
-                if (
-                    room_id not in room
-                    or room.get(room_id, {}).get('status') != 'playing'
-                ):
-                    break
 
-                current_room = room[room_id]
-                turn = current_room.get('turn', 0)
-                players = current_room['player']
+# 路由处理函数与 Web 框架无关：入参为请求 JSON，返回值沿用 Flask 的约定
+# （dict 或 (body, status_code)），Flask 与 asyncio 两种服务入口共用
+def room_of_uid(uid):
+    """玩家 uid 或观战令牌所在的房间号，无效时返回 None"""
+    id = lookup_uid(uid)
+    if id is None:
+        # 观战令牌不登记在 where 中，房间号直接取自令牌本身
+        id = ids.room_of(uid)
+        if get_room_lock(id) is None:
+            return None
+        current_room = room.get(id)
+        if current_room is None or current_room.get('spectator_token') != uid:
+            return None
+    mark_active(id)
+    return id
+
+
+def handle_status(data, binary=False):
+    if data.get('uid') == 'version_check':
+        return {'min_client_version': MIN_CLIENT_VERSION}
+    if 'uid' not in data:
+        return {'status': 'fail', 'reason': 'Missing uid'}
 
-                if 'wait_time' not in current_room or len(
-                    current_room['wait_time']
-                ) != len(players):
-                    current_room['wait_time'] = [0] * len(players)
+    uid = data['uid']
+    id = room_of_uid(uid)
+    if id is None:
+        return {'status': 'fail', 'reason': 'Invalid uid'}
 
-                current_room['wait_time'][turn] += 1
+    with room_locked(id) as room_lock:
+        if room_lock is None:
+            return {'status': 'fail', 'reason': 'Room not found'}
+        # 长轮询：携带 since 时挂起，直到房间版本变化或超时
+        since = data.get('since')
+        if isinstance(since, int):
+            timeout = data.get('timeout', LONG_POLL_TIMEOUT)
+            if not isinstance(timeout, (int, float)) or timeout < 0:
+                timeout = LONG_POLL_TIMEOUT
+            room_lock.wait_for(
+                lambda: id not in room or room[id].get('version', 0) != since,
+                timeout=min(timeout, LONG_POLL_TIMEOUT),
+            )
+            if id in room and room[id].get('version', 0) == since:
+                return '', 304
+        if id not in room:
+            return {'status': 'fail', 'reason': 'Room not found'}
+        return build_status(room[id], uid, data, binary)
 
-                if current_room['wait_time'][turn] >= 60:
-                    logger.info(
-                        f"Player {name.get(players[turn])} in room {room_id} timed out."
-                    )
-                    uid = players[turn]
 
-                    refill_deck_if_needed(current_room)  # [FIX] 摸牌前检查牌堆
-                    if current_room['deck']:
-                        current_room['hand'][uid].append(current_room['deck'].pop())
-                        current_room['hand'][uid] = sort_hand(current_room['hand'][uid])
-                        current_room['table_history'].append('TL')
+@app.route('/status', methods=['POST'])
+def status():
+    data = flask.request.get_json()
+    log_request('status', flask.request.remote_addr, data)
+    binary = wire.MEDIA_TYPE in flask.request.headers.get('Accept', '')
+    response = body_response(handle_status(data, binary))
+    if isinstance(response, flask.Response):
+        response.vary.add('Accept')
+    return response
+
+
+class HistoryRead:
+    """一次 /history 读取：在房间锁内定下范围并拷贝内存中的部分，归档部分随后不持锁读取。
+    归档只按偏移追加写入，锁外读到的仍是同一段记录；asyncio 模式下归档在线程池中读取"""
+
+    __slots__ = ('room_id', 'start', 'offset', 'tail', 'history_len')
+
+    def __init__(self, current_room, start):
+        self.room_id = current_room['id']
+        self.start = start
+        self.offset = current_room.get('history_offset', 0)
+        self.tail = bytes(current_room['table_history'][max(start - self.offset, 0) :])
+        self.history_len = history_length(current_room)
+
+    def read_archived(self):
+        """已归档的 [start, offset) 部分，读取失败时抛出 OSError"""
+        if self.start >= self.offset:
+            return b''
+        return history_archive.read(self.room_id, self.start, self.offset)
+
+    def reply(self, archived):
+        return {
+            'status': 'success',
+            'table_history': cards.decode_cards(archived + self.tail),
+            'history_start': self.start,
+            'history_len': self.history_len,
+        }
 
-                    rotate_turn(current_room, skip_count=0)
+    def unavailable(self, error):
+        logger.error(f"Failed to read history of room {self.room_id}: {error}")
+        return {'status': 'fail', 'reason': 'History unavailable'}
 
-    t = threading.Thread(target=auto_skip, daemon=True)
-    t.start()
 
+def prepare_history(data):
+    """校验 /history 请求并在房间锁内生成 HistoryRead，失败时返回错误回复"""
+    uid = data.get('uid')
+    if not uid:
+        return {'status': 'fail', 'reason': 'Missing uid'}
+    id = room_of_uid(uid)
+    if id is None:
+        return {'status': 'fail', 'reason': 'Invalid uid'}
+    with room_locked(id) as room_lock:
+        if room_lock is None:
+            return {'status': 'fail', 'reason': 'Room not found'}
+        current_room = room.get(id)
+        if current_room is None:
+            return {'status': 'fail', 'reason': 'Room not found'}
+        history_len = history_length(current_room)
+        start = data.get('from', 0)
+        if not isinstance(start, int) or start < 0:
+            start = 0
+        return HistoryRead(current_room, min(start, history_len))
+
+
+def handle_history(data):
+    """完整出牌记录（含已归档部分），from 为起始位置，用于回放；观众令牌同样可用"""
+    read = prepare_history(data)
+    if not isinstance(read, HistoryRead):
+        return read
+    try:
+        archived = read.read_archived()
+    except OSError as e:
+        return read.unavailable(e)
+    return read.reply(archived)
 
-@app.route('/status', methods=['POST'])
-def status():
-    logger.info(f"/status called by {flask.request.remote_addr}")
+
+@app.route('/history', methods=['POST'])
+def history():
     data = flask.request.get_json()
-    if data.get('uid') == 'version_check':
-        return {'min_client_version': MIN_CLIENT_VERSION}
-    if 'uid' not in data:
-        return {'status': 'fail', 'reason': 'Missing uid'}
+    log_request('history', flask.request.remote_addr, data)
+    return handle_history(data)
 
-    uid = data['uid']
-    if uid not in where:
+
+class JsonBody(bytes):
+    """已序列化好的 JSON 响应体，Flask 与 aserver 都按 application/json 原样返回"""
+
+    content_type = 'application/json'
+
+
+class BinaryBody(bytes):
+    """已编码好的二进制 /status 响应体（见 wire）"""
+
+    content_type = wire.MEDIA_TYPE
+
+
+def body_response(result):
+    """Flask 路由的返回值：预编码的响应体包装成 Response，其余沿用 Flask 约定"""
+    if isinstance(result, (JsonBody, BinaryBody)):
+        return flask.Response(result, content_type=result.content_type)
+    return result
+
+
+def dump_json(value):
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+
+class StatusSnapshot:
+    """某个版本的房间状态：公共部分只序列化一次，历史切片与各玩家的私有部分按需缓存，
+    拼好的整个响应体也按 (uid, 历史起点) 缓存，观众共用令牌，因此共用同一份字节串"""
+
+    __slots__ = ('names', 'public', 'history', 'private', 'bodies')
+
+    def __init__(self, current_room):
+        players = current_room['player']
+        turn_idx = current_room.get('turn', 0)
+        direction = current_room.get('direction', 1)
+        top = current_room.get('top')
+        self.names = [name.get(pid, 'Joining...') for pid in players]
+        public = {
+            'status': 'success',
+            'players': self.names,
+            'current_idx': turn_idx,
+            'next_idx': (turn_idx + direction) % len(players) if players else 0,
+            'top': top if top is None else cards.CODES[top],
+            'chosen_color': cards.decode_color(current_room.get('chosen_color')),
+            'history_len': history_length(current_room),
+            'game_status': current_room.get('status', 'unknown'),
+            'winner': current_room.get('winner', None),
+            'hand_count': [len(current_room['hand'].get(pid, b'')) for pid in players],
+            'direction': direction,
+            'version': current_room.get('version', 0),
+            'roster': current_room.get('roster', 0),
+        }
+        # 去掉首尾的花括号，响应由 公共 + 历史 + 私有 三段拼接而成
+        self.public = dump_json(public)[1:-1]
+        self.history = {}
+        self.private = {}
+        self.bodies = {}
+
+    def history_part(self, current_room, start):
+        part = self.history.get(start)
+        if part is None:
+            history = current_room.get('table_history', b'')
+            offset = current_room.get('history_offset', 0)
+            part = dump_json(
+                {
+                    'table_history': cards.decode_cards(history[start - offset :]),
+                    'history_start': start,
+                }
+            )[1:-1]
+            self.history[start] = part
+        return part
+
+    def private_part(self, current_room, uid):
+        part = self.private.get(uid)
+        if part is None:
+            hand = current_room['hand'].get(uid)
+            players = current_room['player']
+            part = dump_json(
+                {
+                    'hand': hand.codes() if hand is not None else [],
+                    'my_idx': players.index(uid) if uid in players else -1,
+                }
+            )[1:-1]
+            self.private[uid] = part
+        return part
+
+    def body(self, current_room, uid, start):
+        body = self.bodies.get((uid, start))
+        if body is None:
+            body = JsonBody(
+                b'{%s, %s, %s}'
+                % (
+                    self.public,
+                    self.history_part(current_room, start),
+                    self.private_part(current_room, uid),
+                )
+            )
+            self.bodies[uid, start] = body
+        return body
+
+    def binary_body(self, current_room, uid, start, with_names):
+        key = (uid, start, with_names)
+        body = self.bodies.get(key)
+        if body is None:
+            body = BinaryBody(
+                wire.encode_status(current_room, self.names, uid, start, with_names)
+            )
+            self.bodies[key] = body
+        return body
+
+
+def history_length(current_room):
+    """出牌记录总条数：已归档的加上内存中的"""
+    return current_room.get('history_offset', 0) + len(
+        current_room.get('table_history', b'')
+    )
+
+
+def build_status(current_room, uid, data, binary=False):
+    """生成 uid 视角的房间状态（JsonBody，binary 时为 BinaryBody），调用方需持有房间锁"""
+    snapshot = status_cache.get(current_room['id'])
+    if snapshot is None:
+        snapshot = status_cache[current_room['id']] = StatusSnapshot(current_room)
+
+    # 增量历史：history_from 只返回游标之后追加的牌，history_last 只返回最后 N 张；
+    # 起点不早于内存中保留的部分，更早的记录通过 /history 获取
+    history_len = history_length(current_room)
+    history_start = 0
+    history_from = data.get('history_from')
+    history_last = data.get('history_last')
+    if isinstance(history_from, int) and history_from >= 0:
+        history_start = min(history_from, history_len)
+    elif isinstance(history_last, int) and history_last >= 0:
+        history_start = max(history_len - history_last, 0)
+    history_start = max(history_start, current_room.get('history_offset', 0))
+
+    if binary:
+        # 二进制格式只在客户端的座次版本 roster 过期时才发昵称
+        roster = data.get('roster')
+        with_names = not (
+            isinstance(roster, int) and roster == current_room.get('roster', 0)
+        )
+        return snapshot.binary_body(current_room, uid, history_start, with_names)
+    return snapshot.body(current_room, uid, history_start)
+
+
+def collect_events(room_id, since):
+    """取出版本 since 之后的事件，返回 (events, 新的 since)，调用方需持有房间锁"""
+    current_room = room.get(room_id)
+    if current_room is None:
+        return [{'event': 'closed', 'version': since or 0}], since
+    version = current_room.get('version', 0)
+    backlog = room_events.get(room_id, ())
+    pending = [e for e in backlog if since is not None and e['version'] > since]
+    # 首次订阅或积压事件已被丢弃时，通知客户端整体刷新
+    if version != since and (
+        since is None or not pending or pending[0]['version'] > since + 1
+    ):
+        pending = [{'event': 'sync', 'version': version}]
+    return pending, version
+
+
+def format_event(event):
+    return (
+        f"id: {event['version']}\n"
+        f"event: {event['event']}\n"
+        f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+    )
+
+
+@app.route('/events', methods=['GET'])
+def events():
+    # SSE 推送：订阅一次即可持续收到房间事件，GET 以便浏览器直接使用 EventSource
+    uid = flask.request.args.get('uid')
+    log_request('events', flask.request.remote_addr, {'uid': uid})
+    if not uid:
+        return {'status': 'fail', 'reason': 'Missing uid'}
+    id = room_of_uid(uid)
+    if id is None:
         return {'status': 'fail', 'reason': 'Invalid uid'}
 
-    id = where[uid]
-    if id not in room:
+    room_lock = room_locks.get(id)
+    if room_lock is None:
         return {'status': 'fail', 'reason': 'Room not found'}
 
-    current_room = room[id]
-    players = current_room['player']
-    player_names = [name.get(pid, 'Joining...') for pid in players]
-    hand = current_room['hand'].get(uid, [])
-    turn_idx = current_room.get('turn', 0)
-    direction = current_room.get('direction', 1)
-    next_idx = (turn_idx + direction) % len(players) if players else 0
+    # 断线重连时从 Last-Event-ID 之后补发
+    last_id = flask.request.headers.get('Last-Event-ID') or flask.request.args.get(
+        'since'
+    )
+    since = int(last_id) if last_id and last_id.isdigit() else None
 
-    # [FIX] 增加状态展示，特别是 chosen_color
-    return {
-        'status': 'success',
-        'players': player_names,
-        'hand': hand,
-        'current_idx': turn_idx,
-        'next_idx': next_idx,
-        'my_idx': players.index(uid) if uid in players else -1,
-        'top': current_room.get('top', None),
-        'chosen_color': current_room.get('chosen_color', None),
-        'table_history': current_room.get('table_history', []),
-        'game_status': current_room.get('status', 'unknown'),
-        'winner': current_room.get('winner', None),
-        'hand_count': [len(current_room['hand'].get(pid, [])) for pid in players],
-        'direction': current_room.get('direction', 1),
-    }
+    def stream():
+        nonlocal since
+        while True:
+            # 保持订阅的房间不算空闲
+            mark_active(id)
+            with room_lock:
+                if since is not None:
+                    room_lock.wait_for(
+                        lambda: id not in room or room[id].get('version', 0) != since,
+                        timeout=EVENT_KEEPALIVE,
+                    )
+                pending, since = collect_events(id, since)
+            if not pending:
+                yield ': keepalive\n\n'
+                continue
+            for event in pending:
+                yield format_event(event)
+            if pending[-1]['event'] == 'closed':
+                return
+
+    return flask.Response(
+        stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
 
 
-@app.route('/join', methods=['POST'])
-def join():
-    logger.info(f"/join called: {flask.request.get_json()}")
-    data = flask.request.get_json()
+def handle_join(data):
     id = data.get('id')
     username = data.get('username')
 
     if not id or not username:
         return {'status': 'fail', 'reason': 'Missing id or username'}
-    if id not in room:
-        return {'status': 'fail', 'reason': 'Room not found'}
-    if room[id]['status'] != 'waiting':
-        return {'status': 'fail', 'reason': 'Game has already started'}
-
-    with lock:
-        if len(room[id]['player']) >= room[id]['count']:
+    with room_locked(id) as room_lock:
+        if room_lock is None:
+            return {'status': 'fail', 'reason': 'Room not found'}
+        mark_active(id)
+        current_room = room.get(id)
+        if current_room is None:
+            return {'status': 'fail', 'reason': 'Room not found'}
+        if current_room['status'] != 'waiting':
+            return {'status': 'fail', 'reason': 'Game has already started'}
+        if len(current_room['player']) >= current_room['count']:
             return {'status': 'fail', 'reason': 'Room is full'}
 
-        uid = getUid()
-        name[uid] = username
-        where[uid] = id
-        room[id]['player'].append(uid)
+        uid = getUid(id, len(current_room['player']))
+        with registry_lock:
+            name[uid] = username
+            where[uid] = id
+        current_room['player'].append(uid)
+        touch_room(current_room, 'player_joined', player=username)
 
         # 检查是否全部加入
-        if len(room[id]['player']) == room[id]['count']:
-            current_room = room[id]
-            random.shuffle(current_room['player'])
+        if len(current_room['player']) == current_room['count']:
+            engine = GameEngine(current_room)
+            engine.start()
+            publish(current_room, engine)
+            reset_turn_deadline(current_room)
+        # 加入与开局洗牌都会改变座次，二进制 /status 据此重发昵称
+        current_room['roster'] = current_room['version']
+        log_room('join', current_room)
 
-            deck = getDeck()
-            current_room['deck'] = deck
+    return {'status': 'success', 'uid': uid}
 
-            for pid in current_room['player']:
-                hand = [deck.pop() for _ in range(7)]
-                current_room['hand'][pid] = sort_hand(hand)
 
-            # [FIX] 确保开局第一张是数字牌
-            while True:
-                refill_deck_if_needed(current_room)
-                top_card = deck.pop()
-                if top_card[1].isdigit():
-                    current_room['top'] = top_card
-                    break
-                else:
-                    deck.append(top_card)
-                    random.shuffle(deck)
+@app.route('/join', methods=['POST'])
+def join():
+    data = flask.request.get_json()
+    log_request('join', flask.request.remote_addr, data)
+    return handle_join(data)
 
-            current_room['table_history'] = [current_room['top']]
-            current_room['status'] = 'playing'
-            start_auto_skip_thread(id)
 
-    return {'status': 'success', 'uid': uid}
+def handle_spectate(data):
+    """取房间的观战令牌：同一房间的观众共用一个令牌，只能查看公开状态"""
+    id = data.get('id')
+    if not id:
+        return {'status': 'fail', 'reason': 'Missing id'}
+    with room_locked(id) as room_lock:
+        if room_lock is None:
+            return {'status': 'fail', 'reason': 'Room not found'}
+        mark_active(id)
+        current_room = room.get(id)
+        if current_room is None:
+            return {'status': 'fail', 'reason': 'Room not found'}
+        if not ids.is_valid_room_id(id):
+            # 旧版房间号不带校验位，无法从令牌中还原
+            return {'status': 'fail', 'reason': 'Spectating is not supported'}
+        token = current_room.get('spectator_token')
+        if token is None:
+            token = current_room['spectator_token'] = ids.make_spectator_token(id)
+            log_room('spectate', current_room)
+    return {'status': 'success', 'token': token}
+
+
+@app.route('/spectate', methods=['POST'])
+def spectate():
+    data = flask.request.get_json()
+    log_request('spectate', flask.request.remote_addr, data)
+    return handle_spectate(data)
 
 
-@app.route('/create', methods=['POST'])
-def create():
-    logger.info(f"/create called: {flask.request.get_json()}")
-    data = flask.request.get_json()
+def handle_create(data):
     count = data.get('count')
     if not isinstance(count, int) or not (MIN_COUNT <= count <= MAX_COUNT):
         return {'status': 'fail', 'reason': 'Invalid player count'}
 
     id = getId()
-    with lock:
+    if id is None:
+        logger.error("Room ids exhausted")
+        return {'status': 'fail', 'reason': 'Server is full'}
+    room_lock = new_room_lock()
+    with room_lock:
         # [FIX] 完整初始化房间状态
-        room[id] = {
+        current_room = {
+            'id': id,
             'count': count,
             'status': 'waiting',
             'player': [],
             'hand': {},
-            'deck': [],
+            'deck': bytearray(),
             'top': None,
             'turn': 0,
             'direction': 1,
-            'table_history': [],
+            'table_history': bytearray(),
             'chosen_color': None,
             'winner': None,
+            'version': 0,
         }
-    schedule_room_cleanup(id, timeout=300, only_if_waiting=True)
+        with registry_lock:
+            room[id] = current_room
+            room_locks[id] = room_lock
+        schedule_room_cleanup(id, timeout=300, only_if_waiting=True)
+        log_room('create', current_room)
     logger.info(f"Room {id} created for {count} players.")
     return {'status': 'success', 'id': id}
 
 
-@app.route('/play', methods=['POST'])
-def play():
-    logger.info(f"/play called: {flask.request.get_json()}")
+@app.route('/create', methods=['POST'])
+def create():
     data = flask.request.get_json()
+    log_request('create', flask.request.remote_addr, data)
+    return handle_create(data)
+
+
+def handle_play(data):
     uid = data.get('uid')
     card = data.get('card')
 
     if not uid or not card:
         return {'status': 'fail', 'reason': 'Missing uid or card'}
-    if uid not in where:
+    id = lookup_uid(uid)
+    if id is None:
         return {'status': 'fail', 'reason': 'Invalid uid'}
+    mark_active(id)
+
+    with room_locked(id) as room_lock:
+        if room_lock is None:
+            return {'status': 'fail', 'reason': 'Room not found'}
+        current_room = room.get(id)
+        if current_room is None:
+            return {'status': 'fail', 'reason': 'Room not found'}
+        engine = GameEngine(current_room)
+        try:
+            if card == 'SK':
+                engine.skip(uid)
+            else:
+                # 请求中的两字符牌面只在这里转换为内部整数编码
+                engine.play(
+                    uid, cards.encode(card), cards.encode_color(data.get('color'))
+                )
+        except IllegalMove as e:
+            return {'status': 'fail', 'reason': str(e)}
+        if current_room['status'] == 'finished':
+            current_room['winner'] = name[uid]
+        publish(current_room, engine)
 
-    id = where[uid]
-    if id not in room:
-        return {'status': 'fail', 'reason': 'Room not found'}
-
-    with lock:
-        current_room = room[id]
-        players = current_room['player']
-        turn = current_room['turn']
-
-        if players[turn] != uid:
-            return {'status': 'fail', 'reason': 'Not your turn'}
-
-        hand = current_room['hand'][uid]
-
-        if card == 'SK':
-            refill_deck_if_needed(current_room)  # [FIX] 摸牌前检查牌堆
-            if current_room['deck']:
-                hand.append(current_room['deck'].pop())
-                current_room['table_history'].append('SK')
-                current_room['hand'][uid] = sort_hand(hand)
-            rotate_turn(current_room, skip_count=0)
-            return {'status': 'success'}
-
-        if card not in hand:
-            return {'status': 'fail', 'reason': 'Card not in hand'}
-
-        top = current_room['top']
-        chosen_color = current_room.get('chosen_color')
-
-        # [FIX] 重构 can_play 逻辑
-        def can_play(p_card, p_top, p_chosen_color):
-            if p_card[0] == p_top[0] or p_top[0] == 'W':
-                return True
-            if p_card.startswith('W'):
-                return True
-            if p_top and (p_card[0] == p_top[0] or p_card[1:] == p_top[1:]):
-                return True
-            return False
-
-        if not can_play(card, top, chosen_color):
-            return {'status': 'fail', 'reason': 'Card does not match'}
-
-        hand.remove(card)
-        current_room['top'] = card
-        current_room['table_history'].append(card)
-
-        # [FIX] 万能牌处理
-        if card.startswith('W'):
-            color = data.get('color')
-            if color not in ['R', 'Y', 'G', 'B']:
-                # 如果客户端没传颜色，服务器随便选一个，增加容错
-                color = random.choice(['R', 'Y', 'G', 'B'])
-            current_room['chosen_color'] = color
+        if current_room['status'] == 'playing':
+            reset_turn_deadline(current_room)
         else:
-            # 打出普通牌后，清除万能牌颜色状态
-            current_room['chosen_color'] = None
-
-        rotate_turn(current_room, played_card=card)
-
-        if not hand:
-            current_room['status'] = 'finished'
-            current_room['winner'] = name[uid]
             schedule_room_cleanup(id, timeout=600, only_if_waiting=False)
+        log_room('play', current_room)
 
         return {'status': 'success'}
 
 
-@app.route('/product', methods=['GET'])
-def product():
+@app.route('/play', methods=['POST'])
+def play():
+    data = flask.request.get_json()
+    log_request('play', flask.request.remote_addr, data)
+    return handle_play(data)
+
+
+def encode_result(result):
+    """处理函数的返回值编码为 JSON 字节串（批量响应中逐项拼接）"""
+    if isinstance(result, JsonBody):
+        return result
+    return dump_json(result)
+
+
+def handle_batch(data):
+    """按顺序执行一组 status/play 操作；连续落在同一房间的操作只加一次房间锁"""
+    ops = data.get('ops')
+    if not isinstance(ops, list) or not ops:
+        return {'status': 'fail', 'reason': 'Missing ops'}
+    if len(ops) > httpio.MAX_BATCH_OPS:
+        return {'status': 'fail', 'reason': 'Too many ops'}
+
+    results = []
+    held = None
+    try:
+        for op in ops:
+            handler = BATCH_HANDLERS.get(op.get('op')) if isinstance(op, dict) else None
+            if handler is None:
+                results.append(dump_json({'status': 'fail', 'reason': 'Unknown op'}))
+                continue
+            uid = op.get('uid')
+            rejected = check_rate_limit(op['op'], None, uid)
+            if rejected is not None:
+                results.append(dump_json(rejected[0]))
+                continue
+            room_lock = (
+                get_room_lock(room_of_uid(uid)) if isinstance(uid, str) else None
+            )
+            if room_lock is not held:
+                # 任一时刻至多持有一把房间锁：换房间前先释放上一把
+                if held is not None:
+                    held.__exit__(None, None, None)
+                    held = None
+                if room_lock is not None:
+                    room_lock.__enter__()
+                    held = room_lock
+            # 批量请求不挂起，忽略长轮询参数
+            op = {k: v for k, v in op.items() if k not in ('since', 'timeout')}
+            results.append(encode_result(handler(op)))
+    finally:
+        if held is not None:
+            held.__exit__(None, None, None)
+    return JsonBody(b'{"status": "success", "results": [%s]}' % b', '.join(results))
+
+
+BATCH_HANDLERS = {'status': handle_status, 'play': handle_play}
+
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    data = flask.request.get_json()
+    log_request('batch', flask.request.remote_addr, data)
+    return body_response(handle_batch(data))
+
+
+def product_path():
     # 绝对路径，便于调试
-    dist_path = os.path.abspath(
+    return os.path.abspath(
         os.path.join(os.path.dirname(__file__), 'dist', 'client.exe')
     )
+
+
+@app.route('/product', methods=['GET'])
+def product():
+    dist_path = product_path()
     logger.info(f"/product 请求，查找路径: {dist_path}")
     if not os.path.exists(dist_path):
         logger.warning(f"client.exe not found at {dist_path}")
@@ -430,9 +1036,65 @@ def product():
     return flask.send_file(dist_path, as_attachment=True, download_name='client.exe')
 
 
-# IP 封禁等管理功能保持不变
-BANNED_IPS = set()
+# 封禁的 IP 与网段，'ip in BANNED_IPS' 按前缀匹配
+BANNED_IPS = admission.PrefixTrie()
 BAN_IP_SECRET = os.environ.get('BAN_IP_SECRET', 'default_secret')
+RATE_LIMITERS = {
+    (route, scope): admission.TokenBucketLimiter(rate, burst)
+    for route, scopes in ROUTE_LIMITS.items()
+    for scope, (rate, burst) in scopes.items()
+}
+
+
+def request_cost(route, data):
+    """请求消耗的令牌数：/batch 按操作数计，其余为 1"""
+    if (
+        route == 'batch'
+        and isinstance(data, dict)
+        and isinstance(data.get('ops'), list)
+    ):
+        return min(max(len(data['ops']), 1), httpio.MAX_BATCH_OPS)
+    return 1
+
+
+def check_rate_limit(route, remote_addr, uid=None, cost=1):
+    """放行时返回 None，否则返回 (响应, 429, 响应头)，Flask 与 aserver 共用；
+    remote_addr 为 None 时只检查 uid 限额"""
+    if not RATE_LIMIT:
+        return None
+    if ids.is_spectator_token(uid):
+        # 同一房间的观众共用一个令牌，按令牌限流会让观众互相挤占，只按来源 IP 限
+        uid = None
+    for scope, key in (('ip', remote_addr), ('uid', uid)):
+        limiter = RATE_LIMITERS.get((route, scope))
+        if limiter is None or not isinstance(key, str):
+            continue
+        if not limiter.allow(key, cost):
+            RATE_LIMITED.labels(route, scope).inc()
+            retry_after = max(1, int(limiter.retry_after(key, cost) + 0.999))
+            return (
+                {'status': 'fail', 'reason': 'Too many requests'},
+                429,
+                {'Retry-After': str(retry_after)},
+            )
+    return None
+
+
+@app.before_request
+def start_request_timer():
+    flask.g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    start = flask.g.get('request_start')
+    if start is not None and flask.request.endpoint:
+        observe_request(
+            flask.request.endpoint,
+            response.status_code,
+            time.perf_counter() - start,
+        )
+    return response
 
 
 @app.before_request
@@ -443,87 +1105,819 @@ def block_banned_ip():
         return flask.jsonify({'status': 'fail', 'reason': 'IP banned'}), 403
 
 
-@app.route('/ban_ip', methods=['POST'])
-def ban_ip():
-    data = flask.request.get_json()
+@app.before_request
+def limit_request():
+    route = flask.request.endpoint
+    if (route, 'ip') not in RATE_LIMITERS:
+        return None
+    data = None
+    if flask.request.method == 'GET':
+        uid = flask.request.args.get('uid')
+    else:
+        data = flask.request.get_json(silent=True)
+        uid = data.get('uid') if isinstance(data, dict) else None
+    return check_rate_limit(
+        route, flask.request.remote_addr, uid, request_cost(route, data)
+    )
+
+
+def handle_ban_ip(data, remote_addr):
     ip = data.get('ip')
     secret = data.get('secret')
     if not ip or not secret:
         return {'status': 'fail', 'reason': 'Missing ip or secret'}
     if secret != BAN_IP_SECRET:
-        logger.warning(
-            f"Ban IP attempt failed: wrong secret from {flask.request.remote_addr}"
-        )
+        logger.warning(f"Ban IP attempt failed: wrong secret from {remote_addr}")
         return {'status': 'fail', 'reason': 'Unauthorized'}, 401
-    BANNED_IPS.add(ip)
-    logger.info(f"IP banned: {ip} by {flask.request.remote_addr}")
+    try:
+        ip = BANNED_IPS.add(ip)
+    except ValueError:
+        return {'status': 'fail', 'reason': 'Invalid ip'}
+    logger.info(f"IP banned: {ip} by {remote_addr}")
     return {'status': 'success', 'ip': ip}
 
 
-@app.route('/unban_ip', methods=['POST'])
-def unban_ip():
-    data = flask.request.get_json()
+@app.route('/ban_ip', methods=['POST'])
+def ban_ip():
+    return handle_ban_ip(flask.request.get_json(), flask.request.remote_addr)
+
+
+def handle_unban_ip(data, remote_addr):
     ip = data.get('ip')
     secret = data.get('secret')
     if not ip or not secret:
         return {'status': 'fail', 'reason': 'Missing ip or secret'}
     if secret != BAN_IP_SECRET:
-        logger.warning(
-            f"Unban IP attempt failed: wrong secret from {flask.request.remote_addr}"
-        )
+        logger.warning(f"Unban IP attempt failed: wrong secret from {remote_addr}")
         return {'status': 'fail', 'reason': 'Unauthorized'}, 401
-    BANNED_IPS.discard(ip)
-    logger.info(f"IP unbanned: {ip} by {flask.request.remote_addr}")
+    try:
+        ip = BANNED_IPS.discard(ip)
+    except ValueError:
+        return {'status': 'fail', 'reason': 'Invalid ip'}
+    logger.info(f"IP unbanned: {ip} by {remote_addr}")
     return {'status': 'success', 'ip': ip}
 
 
-@app.route('/')
-def index():
+@app.route('/unban_ip', methods=['POST'])
+def unban_ip():
+    return handle_unban_ip(flask.request.get_json(), flask.request.remote_addr)
+
+
+def index_page():
     # 确保index.html存在于脚本同级目录
     if os.path.exists('./index.html'):
         return open('./index.html', 'r', encoding='utf-8').read()
     return "<h1>UNO Server is running</h1><p>index.html not found.</p>"
 
 
-# 持久化功能保持不变
-DATA_FILE = 'data.json'
-SAVE_INTERVAL = 5
+@app.route('/')
+def index():
+    return index_page()
+
+
+def count_rooms():
+    counts = dict.fromkeys(('waiting', 'playing', 'finished'), 0)
+    for current_room in list(room.values()):
+        status = current_room.get('status')
+        counts[status] = counts.get(status, 0) + 1
+    for stored in list(stored_rooms.values()):
+        counts[stored.status] = counts.get(stored.status, 0) + 1
+    return {(status,): n for status, n in counts.items()}
+
+
+metrics.Gauge('uno_rooms', 'Rooms by status', ('status',), collect=count_rooms)
+metrics.Gauge(
+    'uno_scheduled_timers',
+    'Pending turn-timeout and cleanup timers',
+    collect=lambda: {(): scheduler.pending()},
+)
+
+
+metrics.CallbackCounter(
+    'uno_log_dropped_total',
+    'Log records dropped because the log queue was full',
+    collect=lambda: {(): log_writer.dropped},
+)
+
+
+def handle_metrics():
+    return metrics.render()
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_page():
+    return flask.Response(handle_metrics(), content_type=metrics.CONTENT_TYPE)
+
+
+# 持久化：WAL 记录每次变更后的房间状态，后台定期写紧凑快照
+# 快照分两部分：DATA_FILE 是索引（各房间在记录文件中的位置、状态与下一个定时点），
+# ROOMS_FILE.<seq> 是每行一个房间的记录文件，启动时只读索引，房间在首次访问时才解析
+DATA_FILE = f'data{SHARD_SUFFIX}.json'
+ROOMS_FILE = f'data{SHARD_SUFFIX}.rooms'
+SNAPSHOT_FORMAT = 2
+# 休眠的房间追加写到当前这一代记录文件末尾（索引不引用这部分），下次快照时一并拷贝到新的一代
+current_rooms_file = f'{ROOMS_FILE}.0'
+WAL_FILE = f'data{SHARD_SUFFIX}.wal'
+# 出牌记录归档目录：每个房间一个文件，按出牌顺序保存已移出内存的记录
+HISTORY_DIR = f'history{SHARD_SUFFIX}'
+# 内存中至少保留的最近出牌记录条数，超过两倍时把较早的部分写入归档
+HISTORY_KEEP = 256
+SAVE_INTERVAL = 60
+# WAL 组提交间隔（秒），同一批记录只 fsync 一次
+WAL_FSYNC_INTERVAL = 0.05
+
+
+class WriteAheadLog:
+    """追加写日志：请求线程只负责序列化入队，后台线程成批写入并统一 fsync
+
+    每条记录是某个房间变更后的完整状态，重放时整体覆盖，因此可以重复重放；
+    快照时切分出旧日志段，快照落盘后即可删除。
+
+    出牌记录归档也由这个线程写出：每批记录写入之前，先把 history_archive 中
+    待写的片段写入归档文件并 fsync。记录中的 history_offset 一旦落盘，
+    它之前的出牌记录必定已在归档文件中，任何时刻崩溃都不会丢失已移出内存的记录"""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.Queue()
+        self._seq = itertools.count(1)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def append(self, record):
+        """分配序号并入队，调用方需持有对应房间锁，以保证同一房间的记录有序"""
+        record['seq'] = next(self._seq)
+        self._queue.put(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+        self._ensure_started()
+
+    def rotate(self):
+        """切分日志段并返回切分序号，之后的快照只需覆盖该序号之前的记录"""
+        mark = next(self._seq)
+        rotated = threading.Event()
+        self._queue.put(('rotate', mark, rotated))
+        self._ensure_started()
+        rotated.wait()
+        return mark
+
+    def remove_archive(self, room_id):
+        """删除房间的归档文件；在此之前入队的记录（如 cleanup）落盘之后才删除"""
+        self._queue.put(('remove_archive', room_id))
+        self._ensure_started()
+
+    def flush(self):
+        """等待此前入队的记录与归档片段全部落盘"""
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        self._ensure_started()
+        done.wait()
+
+    def segments(self):
+        """已切分出的旧日志段 [(mark, path)]，按切分顺序排列"""
+        directory = os.path.dirname(self.path) or '.'
+        prefix = os.path.basename(self.path) + '.'
+        result = []
+        for filename in os.listdir(directory):
+            suffix = filename[len(prefix) :]
+            if filename.startswith(prefix) and suffix.isdigit():
+                result.append((int(suffix), os.path.join(directory, filename)))
+        return sorted(result)
+
+    def discard(self, mark):
+        """快照落盘后删除 mark 及之前切分出的日志段"""
+        for segment_mark, path in self.segments():
+            if segment_mark <= mark:
+                os.remove(path)
+
+    def replay(self, after, apply):
+        """按写入顺序重放序号大于 after 的记录，返回重放条数"""
+        last = after
+        count = 0
+        paths = [path for _, path in self.segments()] + [self.path]
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时只写了一半的末行
+                        continue
+                    last = max(last, record['seq'])
+                    if record['seq'] > after:
+                        apply(record)
+                        count += 1
+        self._seq = itertools.count(last + 1)
+        return count
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _commit(self, f, lines, keep_archive=None):
+        """先让归档片段落盘，再写入记录并 fsync；归档写失败时这批记录不写，
+        片段留在内存中下次重试，以免记录先于它引用的归档落盘"""
+        try:
+            history_archive.sync(skip=keep_archive)
+            for line in lines:
+                f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        except Exception as e:
+            logger.error(f"Failed to write WAL: {e}")
+        lines.clear()
+
+    def _run(self):
+        f = open(self.path, 'a', encoding='utf-8')
+        while True:
+            items = [self._queue.get()]
+            # 组提交：稍等片刻攒一批，整批只 fsync 一次
+            time.sleep(WAL_FSYNC_INTERVAL)
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for item in items:
+                if isinstance(item, str):
+                    lines.append(item)
+                    continue
+                # 其余操作都要求此前的记录先落盘
+                kind = item[0]
+                if kind == 'remove_archive':
+                    # 房间号回收后，新房间的片段要等旧文件删除之后再写
+                    self._commit(f, lines, keep_archive=item[1])
+                    try:
+                        history_archive.delete(item[1])
+                    except OSError as e:
+                        logger.error(f"Failed to remove history of room {item[1]}: {e}")
+                elif kind == 'rotate':
+                    _, mark, rotated = item
+                    self._commit(f, lines)
+                    try:
+                        f.close()
+                        os.replace(self.path, f'{self.path}.{mark}')
+                        f = open(self.path, 'a', encoding='utf-8')
+                    except Exception as e:
+                        logger.error(f"Failed to rotate WAL: {e}")
+                    finally:
+                        rotated.set()
+                else:
+                    self._commit(f, lines)
+                    item[1].set()
+            self._commit(f, lines)
+
+
+wal = WriteAheadLog(WAL_FILE)
+
+
+def history_path(room_id):
+    return os.path.join(HISTORY_DIR, f'{room_id}.bin')
+
+
+class HistoryArchive:
+    """出牌记录归档：请求线程只把片段记入内存，由 WAL 线程在写入记录之前写出并 fsync
+
+    写出之前的片段留在 pending 中，read 时与文件内容拼接，读到的始终是完整记录；
+    删除归档也经由 WAL 的队列，与同一房间的记录按提交顺序执行"""
+
+    def __init__(self):
+        # room_id -> [(偏移, 片段)]，落盘后移除
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def append(self, room_id, offset, data):
+        """登记从第 offset 条起的一段记录，调用方需持有房间锁；
+        此后写入 WAL 的记录落盘之前，这段记录已写入归档文件"""
+        with self._lock:
+            self._pending.setdefault(room_id, []).append((offset, bytes(data)))
+
+    def remove(self, room_id):
+        """删除房间的归档，尚未写出的片段直接丢弃"""
+        with self._lock:
+            self._pending.pop(room_id, None)
+        wal.remove_archive(room_id)
+
+    def read(self, room_id, start, end):
+        """第 [start, end) 条记录"""
+        # 先取待写片段再读文件：片段在写出之后才移出 pending，两边合起来不会缺
+        with self._lock:
+            chunks = list(self._pending.get(room_id, ()))
+        result = bytearray(end - start)
+        filled = start
+        with contextlib.suppress(FileNotFoundError):
+            with open(history_path(room_id), 'rb') as f:
+                f.seek(start)
+                data = f.read(end - start)
+                result[: len(data)] = data
+                filled += len(data)
+        for offset, chunk in sorted(chunks):
+            lo, hi = max(offset, start), min(offset + len(chunk), end)
+            if lo < hi:
+                result[lo - start : hi - start] = chunk[lo - offset : hi - offset]
+            if offset <= filled:
+                filled = max(filled, offset + len(chunk))
+        if filled < end:
+            raise OSError(f'history archive of room {room_id} ends at {filled}')
+        return bytes(result)
+
+    def flush(self):
+        """等待此前登记的片段全部落盘"""
+        wal.flush()
+
+    def sync(self, skip=None):
+        """把待写片段写入各自的归档文件并 fsync（跳过房间 skip），由 WAL 线程调用"""
+        with self._lock:
+            pending = {
+                room_id: list(chunks)
+                for room_id, chunks in self._pending.items()
+                if room_id != skip
+            }
+        if not pending:
+            return
+        os.makedirs(HISTORY_DIR, exist_ok=True)
+        for room_id, chunks in pending.items():
+            path = history_path(room_id)
+            with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                for offset, chunk in chunks:
+                    # 按偏移写入：从较旧的快照恢复后再次写出同一段，文件内容不变
+                    f.seek(offset)
+                    f.write(chunk)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+            with self._lock:
+                current = self._pending.get(room_id)
+                if current is not None and current[: len(chunks)] == chunks:
+                    del current[: len(chunks)]
+                    if not current:
+                        del self._pending[room_id]
+
+    def delete(self, room_id):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(history_path(room_id))
+
+
+history_archive = HistoryArchive()
+
+
+def spill_history(room_instance):
+    """内存中的出牌记录超过 2 * HISTORY_KEEP 条时，把最近 HISTORY_KEEP 条以前的部分
+    交给 history_archive 写入归档文件，room['history_offset'] 为已归档的条数，
+    调用方需持有房间锁"""
+    history = room_instance['table_history']
+    if len(history) < 2 * HISTORY_KEEP:
+        return
+    count = len(history) - HISTORY_KEEP
+    offset = room_instance.get('history_offset', 0)
+    history_archive.append(room_instance['id'], offset, history[:count])
+    del history[:count]
+    room_instance['history_offset'] = offset + count
+
+
+def remove_history(room_id):
+    history_archive.remove(room_id)
+
+
+def dump_room(room_instance):
+    """房间转为可写入 JSON 的紧凑副本：牌堆、手牌、出牌记录存为十六进制串"""
+    data = dict(room_instance)
+    data['player'] = list(room_instance['player'])
+    data['deck'] = room_instance['deck'].hex()
+    data['hand'] = {
+        uid: hand.cards().hex() for uid, hand in room_instance['hand'].items()
+    }
+    data['table_history'] = room_instance['table_history'].hex()
+    return data
+
+
+def load_room(data):
+    """dump_room 的逆过程，兼容旧版以字符串列表保存的牌面"""
+
+    def load_cards(value):
+        if isinstance(value, list):
+            return cards.encode_cards(value)
+        return bytearray.fromhex(value)
+
+    data['deck'] = load_cards(data.get('deck', ''))
+    data['hand'] = {
+        uid: cards.Hand(load_cards(hand)) for uid, hand in data['hand'].items()
+    }
+    data['table_history'] = load_cards(data.get('table_history', ''))
+    if isinstance(data.get('top'), str):
+        data['top'] = cards.encode(data['top'])
+    if isinstance(data.get('chosen_color'), str):
+        data['chosen_color'] = cards.encode_color(data['chosen_color'])
+    return data
+
+
+def log_room(op, room_instance):
+    """把房间变更后的状态追加到 WAL，调用方需持有房间锁"""
+    wal.append({'op': op, **room_record(room_instance)})
+
+
+def apply_record(record):
+    room_id = record['id']
+    # WAL 中的记录比快照新，覆盖尚未载入的旧版本
+    stored_rooms.pop(room_id, None)
+    if record['op'] == 'cleanup':
+        room.pop(room_id, None)
+        for uid in record['uids']:
+            name.pop(uid, None)
+            where.pop(uid, None)
+        return
+    room[room_id] = load_room(record['room'])
+    for uid, username in record['name'].items():
+        name[uid] = username
+        where[uid] = room_id
+
+
+class StoredRoom:
+    """未载入内存的房间：记录在 path 文件的 [offset, offset + length) 处；
+    休眠的房间另有 expires_at，到时仍未被访问即清理"""
+
+    __slots__ = ('path', 'offset', 'length', 'status', 'timer_at', 'expires_at')
+
+    def __init__(self, path, offset, length, status, timer_at, expires_at=None):
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.status = status
+        self.timer_at = timer_at
+        self.expires_at = expires_at
+
+    def index_entry(self, offset):
+        """快照索引中的一项，offset 为在新记录文件中的位置"""
+        return [offset, self.length, self.status, self.timer_at, self.expires_at]
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            return f.read(self.length)
+
+
+def room_record(room_instance):
+    """房间的持久化记录：与 WAL 记录相同，含房间内玩家的昵称，调用方需持有房间锁"""
+    return {
+        'id': room_instance['id'],
+        'room': dump_room(room_instance),
+        'name': {uid: name.get(uid) for uid in room_instance['player']},
+    }
+
+
+def room_timer(room_instance):
+    """房间下一个定时点：进行中为回合超时，其余为清理时间"""
+    if room_instance.get('status') == 'playing':
+        return room_instance.get('turn_deadline')
+    return room_instance.get('cleanup_at')
+
+
+def read_stored_room(stored):
+    """读出并解析未载入房间的记录，返回 (房间, 昵称表)；不碰任何登记表，可在线程池中执行"""
+    record = json.loads(stored.read())
+    return load_room(record['room']), record['name']
+
+
+def hydrate_room(room_id):
+    """把未载入的房间读回内存并登记其玩家，返回房间锁；不存在或读取失败时返回 None
+
+    读文件与解析不持锁，registry_lock 只在登记进 room/where/name/room_locks 时持有；
+    并发读回同一房间时先登记者生效，其余线程丢弃自己的结果"""
+    while True:
+        room_lock = room_locks.get(room_id)
+        stored = stored_rooms.get(room_id)
+        if room_lock is not None or stored is None:
+            return room_lock
+        try:
+            loaded = read_stored_room(stored)
+        except OSError as e:
+            if stored_rooms.get(room_id) is not stored:
+                # 新快照已把它改指向新的记录文件，旧文件随后被删除，按新位置重读
+                continue
+            logger.error(f"Failed to load room {room_id}: {e}")
+            return None
+        except (ValueError, KeyError) as e:
+            logger.error(f"Failed to load room {room_id}: {e}")
+            return None
+        return install_room(room_id, stored, *loaded)
+
+
+def install_room(room_id, stored, current_room, names):
+    """登记 read_stored_room 读出的房间并返回房间锁；房间已被读回或已清理时丢弃读出的结果，
+    返回现有的锁（或 None）。asyncio 模式下须在事件循环中调用"""
+    current_room.setdefault('id', room_id)
+    deadline = None
+    if current_room.get('status') == 'playing' and stored.timer_at is None:
+        # 休眠时暂停的回合从读回时重新计时
+        deadline = current_room['turn_deadline'] = time.time() + TURN_TIMEOUT
+    with registry_lock:
+        if room_id in room_locks or room_id not in stored_rooms:
+            return room_locks.get(room_id)
+        for uid, username in names.items():
+            name[uid] = username
+            where[uid] = room_id
+        room[room_id] = current_room
+        room_lock = room_locks[room_id] = new_room_lock()
+        del stored_rooms[room_id]
+    if deadline is not None:
+        scheduler.call_at(deadline, turn_timeout, room_id)
+    logger.debug(f"Room {room_id} loaded from {stored.path}")
+    return room_lock
+
+
+def capture_hibernation(room_id, active_at):
+    """在房间锁内序列化待休眠的房间，返回 (room_id, active_at, 版本, 记录, 状态, 定时点)；
+    房间不存在或 active_at 之后被访问过时返回 None"""
+    room_lock = room_locks.get(room_id)
+    if room_lock is None:
+        return None
+    with room_lock:
+        current_room = room.get(room_id)
+        if current_room is None or room_activity.get(room_id, 0) > active_at:
+            return None
+        record = room_record(current_room)
+        if current_room.get('status') == 'playing':
+            # 进行中的对局暂停回合计时，读回时重新计时
+            record['room']['turn_deadline'] = None
+        data = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        return (
+            room_id,
+            active_at,
+            current_room.get('version', 0),
+            data.encode('utf-8'),
+            current_room.get('status'),
+            room_timer(record['room']),
+        )
+
+
+def write_hibernated(captured):
+    """把 capture_hibernation 的结果一次追加到当前记录文件，返回 (记录文件, 各条偏移)；
+    不持锁也不碰登记表，asyncio 模式下在线程池中执行"""
+    path = current_rooms_file
+    offsets = []
+    with open(path, 'ab') as f:
+        for item in captured:
+            offsets.append(f.tell())
+            f.write(item[3] + b'\n')
+    return path, offsets
+
+
+def finish_hibernation(captured, path, offsets):
+    """写出之后把房间移出内存，返回实际休眠的房间数；写出期间被访问、状态有变，
+    或记录文件已随快照换代的房间留在内存中。asyncio 模式下须在事件循环中调用"""
+    count = 0
+    for (room_id, active_at, version, data, status, timer_at), offset in zip(
+        captured, offsets
+    ):
+        room_lock = room_locks.get(room_id)
+        if room_lock is None:
+            continue
+        with room_lock:
+            current_room = room.get(room_id)
+            if (
+                current_room is None
+                or room_activity.get(room_id, 0) > active_at
+                or current_room.get('version', 0) != version
+            ):
+                continue
+            expires_at = time.time() + HIBERNATE_MAX_AGE
+            with registry_lock:
+                if path != current_rooms_file:
+                    continue
+                stored_rooms[room_id] = StoredRoom(
+                    path, offset, len(data), status, timer_at, expires_at
+                )
+                for uid in current_room['player']:
+                    name.pop(uid, None)
+                    # 旧格式 uid 无法还原房间号，归属保留在 where 中
+                    if ids.room_of(uid) == room_id:
+                        where.pop(uid, None)
+                del room[room_id]
+                del room_locks[room_id]
+            room_events.pop(room_id, None)
+            status_cache.pop(room_id, None)
+            room_activity.pop(room_id, None)
+        scheduler.call_at(expires_at, expire_room, room_id, expires_at)
+        HIBERNATED_ROOMS.inc()
+        logger.info(f"Room {room_id} hibernated")
+        count += 1
+    return count
+
+
+def hibernate_room(room_id, active_at):
+    """把 active_at 之后未再被访问的房间写入记录文件并移出内存，返回是否已写出；
+    下次被访问时由 hydrate_room 读回"""
+    captured = capture_hibernation(room_id, active_at)
+    if captured is None:
+        return False
+    try:
+        written = write_hibernated([captured])
+    except OSError as e:
+        logger.error(f"Failed to hibernate room {room_id}: {e}")
+        return False
+    return finish_hibernation([captured], *written) == 1
+
+
+def expire_room(room_id, expires_at):
+    """休眠到期仍无人访问的房间视为废弃，清理并回收房间号；期间被读回过的不处理"""
+    stored = stored_rooms.get(room_id)
+    if stored is None or stored.expires_at != expires_at:
+        return
+    logger.info(f"Room {room_id} abandoned while hibernated")
+    cleanup_room(room_id)
+
+
+def capture_idle_rooms(now):
+    """空闲检查的第一步：选出空闲超过 HIBERNATE_AFTER 的房间；常驻房间数超出 ROOM_BUDGET 时，
+    再按最久未访问的顺序补足，直到回到预算以内。返回各房间的 capture_hibernation 结果"""
+    # 重启后载入、尚无访问记录的房间从第一次检查时开始计时
+    idle = sorted((room_activity.setdefault(rid, now), rid) for rid in list(room))
+    excess = len(idle) - ROOM_BUDGET if ROOM_BUDGET > 0 else 0
+    captured = []
+    for active_at, room_id in idle:
+        if active_at > now - HIBERNATE_AFTER and (
+            excess <= 0 or active_at > now - HIBERNATE_MIN_IDLE
+        ):
+            break
+        item = capture_hibernation(room_id, active_at)
+        if item is not None:
+            captured.append(item)
+            excess -= 1
+    return captured
+
+
+def hibernate_idle_rooms():
+    """一次空闲检查：选出房间、整批写入记录文件，再移出内存"""
+    captured = capture_idle_rooms(time.time())
+    if not captured:
+        return
+    try:
+        written = write_hibernated(captured)
+    except OSError as e:
+        logger.error(f"Failed to hibernate rooms: {e}")
+        return
+    finish_hibernation(captured, *written)
+
+
+def hibernate_periodically():
+    """定期空闲检查；在单独的线程中进行，写盘不拖慢调度线程上的回合超时"""
+    while True:
+        time.sleep(HIBERNATE_INTERVAL)
+        try:
+            hibernate_idle_rooms()
+        except Exception as e:
+            logger.error(f"Failed to hibernate idle rooms: {e}")
+
+
+def capture_snapshot(mark):
+    """逐个房间在各自锁内拷贝出可序列化的记录，未载入的房间只记下位置；mark 为 WAL 切分序号"""
+    with registry_lock:
+        stored = dict(stored_rooms)
+        # 新格式 uid 自带房间号，只需保存旧格式 uid 的归属
+        legacy_where = {
+            uid: room_id
+            for uid, room_id in where.items()
+            if ids.room_of(uid) != room_id
+        }
+        locks = list(room_locks.items())
+    records = {}
+    for room_id, room_lock in locks:
+        with room_lock:
+            if room_id in room:
+                current_room = room[room_id]
+                records[room_id] = (
+                    room_record(current_room),
+                    current_room.get('status'),
+                    room_timer(current_room),
+                )
+    return {'seq': mark, 'records': records, 'stored': stored, 'where': legacy_where}
+
+
+def write_snapshot(snapshot):
+    """先写本代记录文件，再原子替换索引；返回 (记录文件, 索引)，交给 finish_snapshot"""
+    seq = snapshot['seq']
+    rooms_path = f'{ROOMS_FILE}.{seq}'
+    index = {}
+    with open(rooms_path + '.tmp', 'wb') as f:
+        for room_id, (record, status, timer_at) in snapshot['records'].items():
+            data = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+            data = data.encode('utf-8')
+            index[room_id] = [f.tell(), len(data), status, timer_at, None]
+            f.write(data + b'\n')
+        # 未载入的房间原样拷贝字节，不解析
+        for room_id, stored in snapshot['stored'].items():
+            data = stored.read()
+            index[room_id] = stored.index_entry(f.tell())
+            f.write(data + b'\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(rooms_path + '.tmp', rooms_path)
+
+    tmp_file = DATA_FILE + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(
+            {
+                'format': SNAPSHOT_FORMAT,
+                'seq': seq,
+                'rooms_file': os.path.basename(rooms_path),
+                'rooms': index,
+                'where': snapshot['where'],
+            },
+            f,
+            ensure_ascii=False,
+            separators=(',', ':'),
+        )
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, DATA_FILE)
+    return rooms_path, index
+
+
+def finish_snapshot(snapshot, rooms_path, index):
+    """快照落盘后：仍未载入的房间改指向新记录文件，删除不再被引用的旧文件与已被覆盖的 WAL 段；
+    会修改 stored_rooms，asyncio 模式下须在事件循环中调用"""
+    global current_rooms_file
+    with registry_lock:
+        current_rooms_file = rooms_path
+        for room_id, stored in snapshot['stored'].items():
+            if stored_rooms.get(room_id) is stored:
+                stored_rooms[room_id] = StoredRoom(rooms_path, *index[room_id])
+        referenced = {stored.path for stored in stored_rooms.values()}
+        for path in rooms_files():
+            if path != rooms_path and path not in referenced:
+                os.remove(path)
+    wal.discard(snapshot['seq'])
+
+
+def rooms_files():
+    """已有的各代记录文件，路径形式与 write_snapshot 中的一致"""
+    directory = os.path.dirname(ROOMS_FILE)
+    prefix = os.path.basename(ROOMS_FILE) + '.'
+    return [
+        os.path.join(directory, filename)
+        for filename in os.listdir(directory or '.')
+        if filename.startswith(prefix) and filename[len(prefix) :].isdigit()
+    ]
+
+
+def save_snapshot():
+    """写紧凑快照：先切分 WAL，再拷贝房间，最后不持锁写盘"""
+    snapshot = capture_snapshot(wal.rotate())
+    finish_snapshot(snapshot, *write_snapshot(snapshot))
 
 
 def save_data_periodically():
     while True:
         time.sleep(SAVE_INTERVAL)
+        start = time.perf_counter()
         try:
-            with lock:
-                with open(DATA_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(
-                        {'name': name, 'room': room, 'where': where},
-                        f,
-                        ensure_ascii=False,
-                        indent=2,
-                    )
+            save_snapshot()
+            SAVE_SECONDS.observe(time.perf_counter() - start)
         except Exception as e:
             logger.error(f"Failed to save data: {e}")
 
 
 def load_data_on_start():
+    """恢复：先读快照索引，再重放其后的 WAL 记录；快照中的房间留在磁盘上按需载入"""
+    global current_rooms_file
+    seq = 0
     try:
         with open(DATA_FILE, 'r', encoding='utf-8') as f:
             data = json.load(f)
-        with lock:
+        seq = data.get('seq', 0)
+        if data.get('format') == SNAPSHOT_FORMAT:
+            directory = os.path.dirname(DATA_FILE)
+            rooms_path = os.path.join(directory, data['rooms_file'])
+            current_rooms_file = rooms_path
+            for room_id, entry in data['rooms'].items():
+                stored_rooms[room_id] = StoredRoom(rooms_path, *entry)
+        else:
+            # 旧版快照：所有房间都在同一个文件里，只能一次性载入
             name.update(data.get('name', {}))
-            room.update(data.get('room', {}))
-            where.update(data.get('where', {}))
-        logger.info('Data loaded from data.json')
+            for room_id, current_room in data.get('room', {}).items():
+                room[room_id] = load_room(current_room)
+        where.update(data.get('where', {}))
+        logger.info(f'Data loaded from {DATA_FILE} ({len(stored_rooms)} rooms on disk)')
     except Exception as e:
         logger.warning(f"No previous data loaded: {e}")
+    try:
+        count = wal.replay(seq, apply_record)
+        logger.info(f"Replayed {count} WAL records")
+    except Exception as e:
+        logger.error(f"Failed to replay WAL: {e}")
+    with registry_lock:
+        for room_id, current_room in room.items():
+            current_room.setdefault('id', room_id)
+            room_locks[room_id] = new_room_lock()
+        room_ids.rebuild(itertools.chain(room, stored_rooms))
 
 
 if __name__ == '__main__':
     load_data_on_start()
     threading.Thread(target=save_data_periodically, daemon=True).start()
-    for room_id, current_room in room.items():
-        if current_room.get('status') == 'playing':
-            logger.info(f"Restarting auto-skip thread for active room {room_id}")
-            start_auto_skip_thread(room_id)
+    threading.Thread(target=hibernate_periodically, daemon=True).start()
+    resume_timers()
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,256 @@
+"""NumPy 批量蒙特卡洛模拟：K 局同时推进，每步所有未结束的对局各走一回合
+
+规则与 engine.GameEngine 一致（牌表来自 cards），状态全部是数组：
+牌堆顺序与剩余张数、每个座位按牌面计数的手牌、当前座位、方向、顶牌、选定颜色。
+策略很简单：在能出的牌面中均匀随机选一种，没有能出的牌就 SK，
+万能牌选手里最多的颜色。输出对局长度分布、牌堆补牌次数与各座位胜率（JSON）：
+
+    python simulate.py --games 1000000 --players 4 --output sim.json
+
+座位 0 为开局先出牌的玩家。需要 numpy，服务端与客户端都不依赖本脚本。
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+import cards
+from engine import MIN_COUNT, MAX_COUNT, HAND_SIZE
+
+DECK_SIZE = len(cards.FULL_DECK)
+FULL_DECK = np.frombuffer(cards.FULL_DECK, dtype=np.uint8)
+IS_DIGIT = np.frombuffer(cards.IS_DIGIT, dtype=np.uint8).astype(bool)
+IS_WILD = np.frombuffer(cards.IS_WILD, dtype=np.uint8).astype(bool)
+REVERSES = np.frombuffer(cards.REVERSES, dtype=np.uint8).astype(bool)
+SKIPS = np.frombuffer(cards.SKIPS, dtype=np.uint8).astype(bool)
+DRAW_COUNT = np.frombuffer(cards.DRAW_COUNT, dtype=np.uint8).astype(np.int16)
+COLOR_OF = np.frombuffer(cards.COLOR_OF, dtype=np.uint8)
+# PLAYABLE[top, chosen_color, card]
+PLAYABLE = (
+    np.frombuffer(cards.PLAYABLE, dtype=np.uint8)
+    .reshape(cards.CARD_KINDS, cards.CARD_KINDS, cards.WILD_COLOR + 1)
+    .transpose(1, 2, 0)
+    .astype(bool)
+)
+# 每种牌面属于哪种颜色的 one-hot，用于统计手牌各颜色张数
+COLOR_MATRIX = np.zeros((cards.CARD_KINDS, len(cards.COLORS)), dtype=np.int16)
+for _card, _color in enumerate(COLOR_OF):
+    if _color < len(cards.COLORS):
+        COLOR_MATRIX[_card, _color] = 1
+
+
+class BatchGame:
+    """K 局、每局 players 人的批量对局状态"""
+
+    def __init__(self, games, players, rng):
+        self.k = games
+        self.n = players
+        self.rng = rng
+        rows = np.arange(games)
+
+        self.deck = rng.permuted(np.tile(FULL_DECK, (games, 1)), axis=1)
+        self.deck_len = np.full(games, DECK_SIZE, dtype=np.int16)
+        self.counts = np.zeros((games, players, cards.CARD_KINDS), dtype=np.int16)
+        self.sizes = np.zeros((games, players), dtype=np.int16)
+        self.turn = np.zeros(games, dtype=np.int16)
+        self.direction = np.ones(games, dtype=np.int16)
+        self.chosen = np.full(games, cards.WILD_COLOR, dtype=np.uint8)
+        self.finished = np.zeros(games, dtype=bool)
+        self.winner = np.full(games, -1, dtype=np.int16)
+        self.turns = np.zeros(games, dtype=np.int32)
+        self.refills = np.zeros(games, dtype=np.int32)
+
+        # 与 Hand.draw_from 相同，每人依次从牌堆末尾摸 7 张
+        for seat in range(players):
+            end = DECK_SIZE - HAND_SIZE * seat
+            dealt = self.deck[:, end - HAND_SIZE : end]
+            np.add.at(
+                self.counts,
+                (np.repeat(rows, HAND_SIZE), seat, dealt.ravel()),
+                1,
+            )
+        self.sizes[:] = HAND_SIZE
+        self.deck_len -= HAND_SIZE * players
+
+        # 翻开第一张：不是数字牌就放回、洗剩余牌堆再翻
+        self.top = np.zeros(games, dtype=np.uint8)
+        pending = rows
+        while len(pending):
+            pos = self.deck_len[pending] - 1
+            top = self.deck[pending, pos]
+            ok = IS_DIGIT[top]
+            done = pending[ok]
+            self.top[done] = top[ok]
+            self.deck_len[done] -= 1
+            pending = pending[~ok]
+            if len(pending):
+                self.shuffle_remaining(pending)
+
+    def shuffle_remaining(self, games):
+        """只打乱这些对局牌堆中尚未摸走的部分"""
+        keys = self.rng.random((len(games), DECK_SIZE))
+        keys[np.arange(DECK_SIZE) >= self.deck_len[games][:, None]] = 2
+        order = np.argsort(keys, axis=1)
+        self.deck[games] = np.take_along_axis(self.deck[games], order, axis=1)
+
+    def draw(self, games, seats, count):
+        """与 GameEngine 相同：牌堆为空先换新牌，再最多摸到牌堆见底"""
+        empty = games[self.deck_len[games] == 0]
+        if len(empty):
+            self.deck[empty] = self.rng.permuted(
+                np.tile(FULL_DECK, (len(empty), 1)), axis=1
+            )
+            self.deck_len[empty] = DECK_SIZE
+            self.refills[empty] += 1
+        count = np.minimum(count, self.deck_len[games])
+        for i in range(int(count.max(initial=0))):
+            more = count > i
+            g = games[more]
+            pos = self.deck_len[g] - 1
+            self.counts[g, seats[more], self.deck[g, pos]] += 1
+            self.deck_len[g] = pos
+        self.sizes[games, seats] += count
+
+    def step(self, sk_rate=0.0):
+        """所有未结束的对局各走一回合，返回仍在进行的对局数"""
+        games = np.flatnonzero(~self.finished)
+        if not len(games):
+            return 0
+        seats = self.turn[games]
+        direction = self.direction[games]
+        hand = self.counts[games, seats]
+        legal = (hand > 0) & PLAYABLE[self.top[games], self.chosen[games]]
+
+        scores = self.rng.random(legal.shape)
+        scores[~legal] = -1
+        card = scores.argmax(axis=1).astype(np.uint8)
+        play = legal.any(axis=1)
+        if sk_rate:
+            play &= self.rng.random(len(games)) >= sk_rate
+        self.turns[games] += 1
+
+        # SK：摸一张，轮到下家
+        skip = games[~play]
+        if len(skip):
+            self.draw(skip, seats[~play], np.ones(len(skip), dtype=np.int16))
+            self.turn[skip] = (seats[~play] + direction[~play]) % self.n
+
+        games = games[play]
+        if not len(games):
+            return int((~self.finished).sum())
+        seats = seats[play]
+        direction = direction[play]
+        hand = hand[play]
+        card = card[play]
+
+        self.counts[games, seats, card] -= 1
+        self.sizes[games, seats] -= 1
+        self.top[games] = card
+        wild = IS_WILD[card]
+        colors = (hand - np.eye(cards.CARD_KINDS, dtype=np.int16)[card]) @ COLOR_MATRIX
+        self.chosen[games] = np.where(wild, colors.argmax(axis=1), cards.WILD_COLOR)
+
+        direction = np.where(REVERSES[card], -direction, direction)
+        self.direction[games] = direction
+        draw_count = DRAW_COUNT[card]
+        penalty = draw_count > 0
+        if penalty.any():
+            target = (seats[penalty] + direction[penalty]) % self.n
+            self.draw(games[penalty], target, draw_count[penalty])
+        # 万能牌后继续由自己出牌，跳过/加2跳到下下家，其余轮到下家
+        steps = np.where(wild, 0, np.where(SKIPS[card], 2, 1))
+        self.turn[games] = (seats + steps * direction) % self.n
+
+        won = self.sizes[games, seats] == 0
+        self.finished[games[won]] = True
+        self.winner[games[won]] = seats[won]
+        return int((~self.finished).sum())
+
+
+def simulate(games, players, seed=None, sk_rate=0.0, max_turns=2000, batch=100000):
+    """跑 games 局，每 batch 局一批，返回各局的 (长度, 补牌次数, 胜者座位)"""
+    rng = np.random.default_rng(seed)
+    lengths, refills, winners = [], [], []
+    for start in range(0, games, batch):
+        state = BatchGame(min(batch, games - start), players, rng)
+        for _ in range(max_turns):
+            if not state.step(sk_rate):
+                break
+        lengths.append(state.turns)
+        refills.append(state.refills)
+        winners.append(state.winner)
+    return np.concatenate(lengths), np.concatenate(refills), np.concatenate(winners)
+
+
+def summarize(lengths, refills, winners, players):
+    done = winners >= 0
+    finished = lengths[done]
+    percentiles = (50, 90, 95, 99)
+    histogram, edges = np.histogram(finished, bins=20) if len(finished) else ([], [])
+    return {
+        'games': len(lengths),
+        'finished': int(done.sum()),
+        'truncated': int((~done).sum()),
+        'length': {
+            'mean': round(float(finished.mean()), 3) if len(finished) else None,
+            'min': int(finished.min()) if len(finished) else None,
+            'max': int(finished.max()) if len(finished) else None,
+            **{
+                f'p{p}': float(np.percentile(finished, p)) if len(finished) else None
+                for p in percentiles
+            },
+            'histogram': {
+                'counts': [int(c) for c in histogram],
+                'edges': [round(float(e), 1) for e in edges],
+            },
+        },
+        'refills': {
+            'per_game': round(float(refills.mean()), 4),
+            'games_with_refill': round(float((refills > 0).mean()), 4),
+        },
+        'win_rate_by_seat': [
+            round(float((winners == seat).sum() / max(1, done.sum())), 4)
+            for seat in range(players)
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batched UNO Monte Carlo simulator')
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument(
+        '--sk-rate', type=float, default=0, help='chance to SK with a legal card'
+    )
+    parser.add_argument(
+        '--max-turns', type=int, default=2000, help='give up on longer games'
+    )
+    parser.add_argument(
+        '--batch', type=int, default=100000, help='games kept in memory at once'
+    )
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+    if not MIN_COUNT <= args.players <= MAX_COUNT:
+        parser.error(f'--players must be within {MIN_COUNT}..{MAX_COUNT}')
+
+    start = time.time()
+    lengths, refills, winners = simulate(
+        args.games, args.players, args.seed, args.sk_rate, args.max_turns, args.batch
+    )
+    duration = time.time() - start
+    report = summarize(lengths, refills, winners, args.players)
+    report['duration'] = round(duration, 3)
+    report['games_per_second'] = round(args.games / duration, 1)
+    report['config'] = vars(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
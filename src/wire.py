@@ -0,0 +1,145 @@
+"""/status 的紧凑二进制格式，客户端在 Accept 中带上 MEDIA_TYPE 时使用
+
+所有整数为网络字节序，依次为：
+    头部 HEADER（见下）
+    各玩家手牌数     玩家数 × uint16
+    自己的手牌       每张 1 字节（cards 的整数编码）
+    出牌记录         从 history_start 到 history_len，每条 1 字节
+    玩家昵称         带昵称时为全部玩家，每个为 uint16 长度 + UTF-8
+座次在玩家加入与开局洗牌时变化，房间为此记下座次版本 roster。客户端带上已知的
+座次版本，与房间一致时不发昵称，否则按座位重发全部昵称。
+失败的回复仍是 JSON。只依赖标准库与 cards，客户端可以直接使用。
+"""
+
+import struct
+
+import cards
+
+MEDIA_TYPE = 'application/x-uno-status'
+FORMAT_VERSION = 2
+
+# 格式版本, 房间版本, 对局状态, 当前/下家/自己的座位, 方向, 顶牌, 选定颜色, 胜者座位,
+# 历史长度, 历史起点, 玩家数, 座次版本, 是否带昵称, 手牌张数
+HEADER = struct.Struct('!BIBBBbbBBBIIBIBH')
+NONE = 0xFF
+GAME_STATUSES = ('waiting', 'playing', 'finished', 'unknown')
+NAME_LEN = struct.Struct('!H')
+
+
+class Roster:
+    """客户端已知的座次：版本与按座位排列的昵称，decode_status 原地更新"""
+
+    __slots__ = ('version', 'names')
+
+    def __init__(self):
+        self.version = None
+        self.names = []
+
+
+def encode_status(current_room, names, uid, history_start, with_names):
+    """current_room 为服务端内部的房间 dict，names 为按座位排列的昵称"""
+    players = current_room['player']
+    hands = current_room['hand']
+    hand = hands.get(uid)
+    hand_cards = hand.cards() if hand is not None else b''
+    history = current_room.get('table_history', b'')
+    # 较早的出牌记录可能已归档，内存中只有 history_offset 之后的部分
+    offset = current_room.get('history_offset', 0)
+    turn_idx = current_room.get('turn', 0)
+    direction = current_room.get('direction', 1)
+    top = current_room.get('top')
+    chosen_color = current_room.get('chosen_color')
+    winner = current_room.get('winner')
+    status = current_room.get('status', 'unknown')
+    header = HEADER.pack(
+        FORMAT_VERSION,
+        current_room.get('version', 0),
+        GAME_STATUSES.index(status if status in GAME_STATUSES else 'unknown'),
+        turn_idx,
+        (turn_idx + direction) % len(players) if players else 0,
+        players.index(uid) if uid in players else -1,
+        direction,
+        NONE if top is None else top,
+        NONE if chosen_color is None else chosen_color,
+        names.index(winner) if winner in names else NONE,
+        offset + len(history),
+        history_start,
+        len(players),
+        current_room.get('roster', 0),
+        with_names,
+        len(hand_cards),
+    )
+    counts = struct.pack(
+        f'!{len(players)}H', *(len(hands.get(p, b'')) for p in players)
+    )
+    parts = [
+        header,
+        counts,
+        bytes(hand_cards),
+        bytes(history[history_start - offset :]),
+    ]
+    if with_names:
+        for player_name in names:
+            data = player_name.encode('utf-8')
+            parts.append(NAME_LEN.pack(len(data)))
+            parts.append(data)
+    return b''.join(parts)
+
+
+def decode_status(body, roster):
+    """解析为与 JSON 回复相同结构的 dict；roster 为客户端已知的 Roster，带昵称时原地替换"""
+    (
+        _,
+        version,
+        game_status,
+        current_idx,
+        next_idx,
+        my_idx,
+        direction,
+        top,
+        chosen_color,
+        winner,
+        history_len,
+        history_start,
+        player_count,
+        roster_version,
+        with_names,
+        hand_len,
+    ) = HEADER.unpack_from(body)
+    offset = HEADER.size
+    hand_count = list(struct.unpack_from(f'!{player_count}H', body, offset))
+    offset += 2 * player_count
+    hand = body[offset : offset + hand_len]
+    offset += hand_len
+    history_end = offset + history_len - history_start
+    history = body[offset:history_end]
+    offset = history_end
+    if with_names:
+        names = []
+        while offset < len(body):
+            (length,) = NAME_LEN.unpack_from(body, offset)
+            offset += NAME_LEN.size
+            names.append(body[offset : offset + length].decode('utf-8'))
+            offset += length
+        roster.names = names
+    roster.version = roster_version
+    known_names = roster.names
+    return {
+        'status': 'success',
+        'players': list(known_names),
+        'hand': [cards.CODES[c] for c in hand],
+        'current_idx': current_idx,
+        'next_idx': next_idx,
+        'my_idx': my_idx,
+        'top': None if top == NONE else cards.CODES[top],
+        'chosen_color': None if chosen_color == NONE else cards.COLORS[chosen_color],
+        'table_history': [cards.CODES[c] for c in history],
+        'history_start': history_start,
+        'history_len': history_len,
+        'game_status': GAME_STATUSES[game_status],
+        'winner': None if winner == NONE else known_names[winner],
+        'hand_count': hand_count,
+        'direction': direction,
+        'version': version,
+        'roster': roster_version,
+    }
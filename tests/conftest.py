@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+# 源码为 src/ 下的单文件模块，按模块名直接导入
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src'))
+
+
+def reset_server(module):
+    """清空 server 模块的内存状态，相当于一个刚启动、尚未载入数据的进程"""
+    for table in (
+        module.name,
+        module.room,
+        module.where,
+        module.room_events,
+        module.status_cache,
+        module.stored_rooms,
+        module.room_activity,
+        module.room_locks,
+    ):
+        table.clear()
+    module.wal = module.WriteAheadLog(module.WAL_FILE)
+    module.room_ids.rebuild(())
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """在 tmp_path 中使用 server 模块：数据文件都是相对路径，随工作目录落在这里"""
+    monkeypatch.chdir(tmp_path)
+    import server as module
+
+    monkeypatch.setattr(module, 'RATE_LIMIT', False)
+    monkeypatch.setattr(module, 'current_rooms_file', f'{module.ROOMS_FILE}.0')
+    reset_server(module)
+    yield module
+    reset_server(module)
+
+
+@pytest.fixture
+def restart(server):
+    """模拟进程重启：丢掉内存状态，再从快照与 WAL 恢复"""
+
+    def restart():
+        # 切分一次作为屏障，确保已入队的 WAL 记录都已落盘
+        server.wal.rotate()
+        reset_server(server)
+        server.load_data_on_start()
+
+    return restart
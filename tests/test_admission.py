@@ -0,0 +1,161 @@
+import pytest
+
+import admission
+import httpio
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_burst_then_refill():
+    clock = FakeClock()
+    limiter = admission.TokenBucketLimiter(rate=2, burst=3, clock=clock)
+    assert [limiter.allow('a') for _ in range(4)] == [True, True, True, False]
+    assert limiter.retry_after('a') == pytest.approx(0.5)
+    # 其他键互不影响
+    assert limiter.allow('b')
+    clock.now = 0.5
+    assert limiter.allow('a')
+    assert not limiter.allow('a')
+    # 补充不超过桶容量
+    clock.now = 100
+    assert [limiter.allow('a') for _ in range(4)] == [True, True, True, False]
+
+
+def test_token_bucket_evicts_idle_and_caps_buckets():
+    clock = FakeClock()
+    limiter = admission.TokenBucketLimiter(rate=1, burst=2, max_buckets=3, clock=clock)
+    for key in 'abcde':
+        limiter.allow(key)
+    assert len(limiter) <= 3
+    # 空闲超过 burst / rate 的桶已经是满的，随后的检查顺带淘汰
+    clock.now = 10
+    limiter.allow('x')
+    limiter.allow('y')
+    assert len(limiter) <= 2 + admission.EVICT_PER_CHECK
+
+
+def test_prefix_trie_matches_networks():
+    trie = admission.PrefixTrie()
+    assert '10.1.2.3' not in trie
+    assert trie.add('10.0.0.0/8') == '10.0.0.0/8'
+    assert trie.add('192.168.1.7') == '192.168.1.7/32'
+    assert trie.add('2001:db8::/32') == '2001:db8::/32'
+    assert '10.1.2.3' in trie
+    assert '11.0.0.1' not in trie
+    assert '192.168.1.7' in trie
+    assert '192.168.1.8' not in trie
+    assert '2001:db8:1::5' in trie
+    assert '2001:db9::1' not in trie
+    # 双栈监听下的 IPv4 映射地址按 IPv4 匹配
+    assert '::ffff:10.9.9.9' in trie
+    assert 'not an ip' not in trie
+    assert list(trie) == ['10.0.0.0/8', '192.168.1.7/32', '2001:db8::/32']
+
+
+def test_prefix_trie_discard_only_exact_network():
+    trie = admission.PrefixTrie()
+    trie.add('10.0.0.0/8')
+    trie.add('10.1.0.0/16')
+    trie.discard('10.0.0.0/8')
+    assert '10.1.2.3' in trie
+    assert '10.2.0.1' not in trie
+    trie.discard('10.9.0.0/16')
+    assert len(trie) == 1
+    with pytest.raises(ValueError):
+        trie.add('10.0.0.0/99')
+
+
+def test_too_many_requests_reason_phrase():
+    head = httpio.encode_response(429, b'{}', 'application/json')
+    assert head.startswith(b'HTTP/1.1 429 Too Many Requests\r\n')
+
+
+@pytest.fixture
+def limited_server(server, monkeypatch):
+    monkeypatch.setattr(server, 'RATE_LIMIT', True)
+    monkeypatch.setattr(
+        server,
+        'RATE_LIMITERS',
+        {
+            (route, scope): admission.TokenBucketLimiter(rate, burst)
+            for route, scopes in server.ROUTE_LIMITS.items()
+            for scope, (rate, burst) in scopes.items()
+        },
+    )
+    return server
+
+
+def test_spectators_are_limited_per_ip_not_per_token(limited_server):
+    client = limited_server.app.test_client()
+    room_id = client.post('/create', json={'count': 2}).json['id']
+    client.post('/join', json={'id': room_id, 'username': 'p'})
+    token = client.post('/spectate', json={'id': room_id}).json['token']
+
+    codes = [
+        client.post(
+            '/status',
+            json={'uid': token},
+            environ_base={'REMOTE_ADDR': f'10.0.{i // 250}.{i % 250}'},
+        ).status_code
+        for i in range(50)
+    ]
+    assert codes == [200] * 50
+
+    # 同一个 IP 仍受按 IP 的限额约束
+    burst = limited_server.ROUTE_LIMITS['status']['ip'][1]
+    codes = [
+        client.post(
+            '/status', json={'uid': token}, environ_base={'REMOTE_ADDR': '10.9.9.9'}
+        ).status_code
+        for _ in range(2 * burst)
+    ]
+    assert 429 in codes
+
+
+def test_players_are_still_limited_per_uid(limited_server):
+    client = limited_server.app.test_client()
+    room_id = client.post('/create', json={'count': 2}).json['id']
+    uid = client.post('/join', json={'id': room_id, 'username': 'p'}).json['uid']
+    burst = limited_server.ROUTE_LIMITS['status']['uid'][1]
+    replies = [
+        client.post(
+            '/status', json={'uid': uid}, environ_base={'REMOTE_ADDR': f'10.1.0.{i}'}
+        )
+        for i in range(burst + 5)
+    ]
+    assert [r.status_code for r in replies[:burst]] == [200] * burst
+    rejected = [r for r in replies if r.status_code == 429]
+    assert rejected
+    assert int(rejected[0].headers['Retry-After']) >= 1
+
+
+def test_batch_ops_count_against_ip_and_uid_limits(limited_server):
+    client = limited_server.app.test_client()
+    room_id = client.post('/create', json={'count': 2}).json['id']
+    uid = client.post('/join', json={'id': room_id, 'username': 'p'}).json['uid']
+    burst = limited_server.ROUTE_LIMITS['status']['uid'][1]
+    ops = [{'op': 'status', 'uid': uid}] * (burst + 5)
+
+    reply = client.post('/batch', json={'ops': ops})
+    assert reply.status_code == 200
+    reasons = [result.get('reason') for result in reply.json['results']]
+    assert reasons[:burst] == [None] * burst
+    assert 'Too many requests' in reasons
+    # 直接调用 /status 与批量中的操作共用同一个 uid 限额
+    assert client.post('/status', json={'uid': uid}).status_code == 429
+
+    # 每个操作消耗一个 IP 令牌，批量不再能绕过按 IP 的限额
+    ip_burst = limited_server.ROUTE_LIMITS['batch']['ip'][1]
+    ops = [{'op': 'status', 'uid': 'unknown'}] * ip_burst
+    addr = {'REMOTE_ADDR': '10.2.0.1'}
+    assert (
+        client.post('/batch', json={'ops': ops}, environ_base=addr).status_code == 200
+    )
+    reply = client.post('/batch', json={'ops': ops[:1]}, environ_base=addr)
+    assert reply.status_code == 429
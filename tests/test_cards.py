@@ -0,0 +1,47 @@
+import random
+
+import cards
+
+
+def test_full_deck():
+    assert len(cards.FULL_DECK) == 108
+    counts = [cards.FULL_DECK.count(card) for card in range(cards.CARD_KINDS)]
+    assert counts[cards.encode('R0')] == 1
+    assert counts[cards.encode('G7')] == 2
+    assert counts[cards.encode('BD')] == 2
+    assert counts[cards.encode('WW')] == counts[cards.encode('WD')] == 4
+
+
+def test_playable_table_matches_rules():
+    for card in range(cards.CARD_KINDS):
+        for top in range(cards.CARD_KINDS):
+            expected = cards._match(card, top, None)
+            assert bool(cards.can_play(card, top)) == expected
+            for color in range(len(cards.COLORS)):
+                assert bool(cards.can_play(card, top, color)) == expected
+    assert cards.can_play(cards.encode('R3'), cards.encode('B3'))
+    assert cards.can_play(cards.encode('WW'), cards.encode('B3'))
+    assert not cards.can_play(cards.encode('R3'), cards.encode('B4'))
+
+
+def test_hand_is_an_ordered_multiset():
+    hand = cards.Hand(cards.encode_cards(['WD', 'R5', 'B1', 'R5']))
+    assert len(hand) == 4
+    assert hand.codes() == ['R5', 'R5', 'B1', 'WD']
+    hand.remove(cards.encode('R5'))
+    assert hand.codes() == ['R5', 'B1', 'WD']
+    assert cards.encode('R5') in hand
+    assert cards.SK not in hand
+    hand.add(cards.encode('G2'))
+    assert list(hand) == list(cards.encode_cards(['R5', 'G2', 'B1', 'WD']))
+
+
+def test_draw_from_stops_at_an_empty_deck():
+    deck = cards.new_deck(random.Random(0))
+    hand = cards.Hand()
+    assert hand.draw_from(deck, 7) == 7
+    assert len(deck) == 101
+    short = bytearray(deck[:3])
+    assert hand.draw_from(short, 4) == 3
+    assert not short
+    assert len(hand) == 10
@@ -0,0 +1,132 @@
+import random
+
+import pytest
+
+import cards
+import engine
+
+
+def make_engine(hands, top, deck=(), turn=0, direction=1, seed=0):
+    """按给定手牌与顶牌摆好一局进行中的牌桌，玩家依次为 a、b、c…"""
+    players = [chr(ord('a') + i) for i in range(len(hands))]
+    state = engine.new_state(players)
+    state['hand'] = {
+        player: cards.Hand(cards.encode_cards(codes))
+        for player, codes in zip(players, hands)
+    }
+    state['deck'] = cards.encode_cards(deck)
+    state['top'] = cards.encode(top)
+    state['table_history'] = bytearray([state['top']])
+    state['turn'] = turn
+    state['direction'] = direction
+    state['status'] = 'playing'
+    return engine.GameEngine(state, random.Random(seed))
+
+
+def test_new_game_deals_and_flips_a_digit():
+    game = engine.GameEngine.new_game(['a', 'b', 'c'], seed=7)
+    state = game.state
+    assert sorted(state['player']) == ['a', 'b', 'c']
+    assert all(len(state['hand'][p]) == engine.HAND_SIZE for p in state['player'])
+    assert cards.IS_DIGIT[state['top']]
+    assert state['table_history'] == bytearray([state['top']])
+    assert len(state['deck']) == len(cards.FULL_DECK) - 3 * engine.HAND_SIZE - 1
+    assert state['status'] == 'playing'
+    assert game.drain_events() == [('game_started', {})]
+
+    again = engine.GameEngine.new_game(['a', 'b', 'c'], seed=7).state
+    assert again['player'] == state['player']
+    assert again['deck'] == state['deck']
+    assert again['hand']['a'].cards() == state['hand']['a'].cards()
+
+
+def test_digit_passes_to_next_player():
+    game = make_engine([['R1', 'R2'], ['B1'], ['G1']], 'R5')
+    game.play('a', cards.encode('R1'))
+    assert game.current_player == 'b'
+    assert game.state['top'] == cards.encode('R1')
+    with pytest.raises(engine.IllegalMove, match='Not your turn'):
+        game.play('a', cards.encode('R2'))
+
+
+def test_skip_and_draw_two_jump_over_next_player():
+    game = make_engine([['RS', 'RD', 'R9'], ['B1'], ['G1']], 'R5', deck=['Y1'] * 4)
+    game.play('a', cards.encode('RS'))
+    assert game.current_player == 'c'
+
+    game = make_engine([['RD', 'R9'], ['B1'], ['G1']], 'R5', deck=['Y1'] * 4)
+    game.play('a', cards.encode('RD'))
+    assert game.current_player == 'c'
+    assert len(game.state['hand']['b']) == 3
+    assert ('draw', {'player': 'b', 'count': 2}) in game.drain_events()
+
+
+def test_reverse_changes_direction():
+    game = make_engine([['R1'], ['B1'], ['RR', 'G1']], 'R5', turn=2)
+    game.play('c', cards.encode('RR'))
+    assert game.state['direction'] == -1
+    assert game.current_player == 'b'
+
+
+def test_wild_keeps_the_turn_and_sets_colour():
+    game = make_engine([['WW', 'WD', 'B3'], ['B1'], ['G1']], 'R5', deck=['Y1'] * 8)
+    game.play('a', cards.encode('WW'), cards.encode_color('B'))
+    assert game.current_player == 'a'
+    assert game.state['chosen_color'] == cards.encode_color('B')
+
+    game.play('a', cards.encode('WD'))
+    assert game.current_player == 'a'
+    assert game.state['chosen_color'] is not None
+    assert len(game.state['hand']['b']) == 5
+
+    game.play('a', cards.encode('B3'))
+    assert game.state['chosen_color'] is None
+
+
+def test_draw_event_reports_cards_actually_drawn():
+    # 牌堆只剩一张时 +4 只能摸到 1 张，事件按实际张数上报
+    game = make_engine([['WD', 'R1'], ['B1']], 'R5', deck=['Y1'])
+    game.play('a', cards.encode('WD'), cards.encode_color('R'))
+    assert len(game.state['hand']['b']) == 2
+    assert ('draw', {'player': 'b', 'count': 1}) in game.drain_events()
+
+
+def test_skip_action_and_timeout_draw_one_and_pass():
+    game = make_engine([['R1'], ['B1'], ['G1']], 'Y5', deck=['Y1', 'Y2'])
+    game.skip('a')
+    assert game.current_player == 'b'
+    assert len(game.state['hand']['a']) == 2
+    assert game.state['table_history'][-1] == cards.SK
+
+    game.timeout()
+    assert game.current_player == 'c'
+    assert len(game.state['hand']['b']) == 2
+    assert game.state['table_history'][-1] == cards.TL
+    assert ('timeout', {'player': 'b'}) in game.drain_events()
+
+    # 牌堆摸空后换一副新牌
+    game.skip('c')
+    assert game.drain_events()[0] == ('deck_refilled', {})
+
+
+def test_illegal_moves():
+    game = make_engine([['R1', 'B2'], ['B1']], 'R5')
+    with pytest.raises(engine.IllegalMove, match='Card not in hand'):
+        game.play('a', cards.encode('G1'))
+    with pytest.raises(engine.IllegalMove, match='Card not in hand'):
+        game.play('a', None)
+    with pytest.raises(engine.IllegalMove, match='Card does not match'):
+        game.play('a', cards.encode('B2'))
+    game.state['status'] = 'waiting'
+    with pytest.raises(engine.IllegalMove, match='Game is not in progress'):
+        game.skip('a')
+
+
+def test_last_card_wins():
+    game = make_engine([['R1'], ['B1']], 'R5')
+    game.play('a', cards.encode('R1'))
+    assert game.state['status'] == 'finished'
+    assert game.state['winner'] == 'a'
+    assert game.drain_events()[-1] == ('game_finished', {'winner': 'a'})
+    with pytest.raises(engine.IllegalMove, match='Game is not in progress'):
+        game.play('b', cards.encode('B1'))
@@ -0,0 +1,112 @@
+import os
+import threading
+
+import pytest
+
+from conftest import reset_server
+
+
+def start_game(client):
+    room_id = client.post('/create', json={'count': 2}).json['id']
+    uids = [
+        client.post('/join', json={'id': room_id, 'username': f'p{i}'}).json['uid']
+        for i in range(2)
+    ]
+    return room_id, uids
+
+
+def skip_turns(client, uids, turns):
+    for _ in range(turns):
+        for uid in uids:
+            reply = client.post('/play', json={'uid': uid, 'card': 'SK'}).json
+            if reply['status'] == 'success':
+                break
+
+
+def test_archived_history_reads_back_before_and_after_write(server, monkeypatch):
+    monkeypatch.setattr(server, 'HISTORY_KEEP', 4)
+    client = server.app.test_client()
+    room_id, uids = start_game(client)
+    skip_turns(client, uids, 30)
+
+    current_room = server.room[room_id]
+    assert current_room['history_offset'] > 0
+    assert len(current_room['table_history']) < 2 * server.HISTORY_KEEP
+    # 后台尚未写出时也能读到完整记录
+    full = client.post('/history', json={'uid': uids[0]}).json
+    assert len(full['table_history']) == server.history_length(current_room)
+
+    server.history_archive.flush()
+    assert os.path.getsize(server.history_path(room_id)) == (
+        current_room['history_offset']
+    )
+    assert client.post('/history', json={'uid': uids[0]}).json == full
+    tail = client.post('/history', json={'uid': uids[0], 'from': 5}).json
+    assert tail['table_history'] == full['table_history'][5:]
+
+
+def test_missing_archive_is_reported(server, monkeypatch):
+    monkeypatch.setattr(server, 'HISTORY_KEEP', 4)
+    client = server.app.test_client()
+    room_id, uids = start_game(client)
+    skip_turns(client, uids, 30)
+    server.history_archive.flush()
+    os.remove(server.history_path(room_id))
+    reply = client.post('/history', json={'uid': uids[0]}).json
+    assert reply == {'status': 'fail', 'reason': 'History unavailable'}
+
+
+def test_cleanup_removes_archive(server, monkeypatch):
+    monkeypatch.setattr(server, 'HISTORY_KEEP', 4)
+    client = server.app.test_client()
+    room_id, uids = start_game(client)
+    skip_turns(client, uids, 30)
+    server.cleanup_room(room_id)
+    server.history_archive.flush()
+    assert not os.path.exists(server.history_path(room_id))
+
+
+class Crash(BaseException):
+    """让 WAL 线程就地退出，模拟进程在两次写入之间崩溃"""
+
+
+@pytest.mark.parametrize('archive_synced', [False, True])
+def test_crash_between_archive_and_wal_keeps_history(
+    server, monkeypatch, archive_synced
+):
+    monkeypatch.setattr(server, 'HISTORY_KEEP', 4)
+    client = server.app.test_client()
+    room_id, uids = start_game(client)
+    server.wal.flush()
+
+    # 下一次提交时，归档片段落盘之前或之后、记录写入之前崩溃
+    played = threading.Event()
+    crashing = True
+    sync = server.HistoryArchive.sync
+
+    def crash(self, skip=None):
+        if crashing:
+            played.wait()
+            if archive_synced:
+                sync(self, skip)
+            raise Crash
+        sync(self, skip)
+
+    monkeypatch.setattr(server.HistoryArchive, 'sync', crash)
+    monkeypatch.setattr(threading, 'excepthook', lambda args: None)
+    skip_turns(client, uids, 30)
+    assert server.room[room_id]['history_offset'] > 0
+    played.set()
+    server.wal._thread.join(timeout=5)
+    assert not server.wal._thread.is_alive()
+    assert os.path.exists(server.history_path(room_id)) == archive_synced
+    history = client.post('/history', json={'uid': uids[0]}).json['table_history']
+
+    # 重启：内存中的待写片段随进程一起丢失
+    crashing = False
+    monkeypatch.setattr(server, 'history_archive', server.HistoryArchive())
+    reset_server(server)
+    server.load_data_on_start()
+    reply = client.post('/history', json={'uid': uids[0]}).json
+    assert reply['status'] == 'success'
+    assert reply['table_history'] == history[: reply['history_len']]
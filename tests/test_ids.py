@@ -0,0 +1,71 @@
+import random
+
+import ids
+
+
+def test_check_digit_round_trip():
+    room_id = ids.with_check_digit('04217')
+    assert len(room_id) == ids.ROOM_ID_LEN
+    assert ids.is_valid_room_id(room_id)
+
+
+def test_check_digit_catches_single_digit_errors_and_swaps():
+    room_id = ids.with_check_digit('04217')
+    for i in range(ids.ROOM_ID_LEN):
+        for d in '0123456789':
+            if d != room_id[i]:
+                assert not ids.is_valid_room_id(room_id[:i] + d + room_id[i + 1 :])
+    for i in range(ids.ROOM_ID_LEN - 1):
+        swapped = room_id[:i] + room_id[i + 1] + room_id[i] + room_id[i + 2 :]
+        if swapped != room_id:
+            assert not ids.is_valid_room_id(swapped)
+
+
+def test_uid_layout():
+    room_id = ids.with_check_digit('31337')
+    uid = ids.make_uid(room_id, 3, random.Random(1))
+    assert len(uid) == ids.PLAYER_ID_LEN
+    assert ids.PLAYER_ID_LEN - ids.ROOM_ID_LEN - ids.SEAT_LEN - 1 >= 12
+    assert ids.is_valid_uid(uid)
+    assert ids.room_of(uid) == room_id
+    assert uid[ids.ROOM_ID_LEN : ids.ROOM_ID_LEN + ids.SEAT_LEN] == '03'
+
+
+def test_invalid_values():
+    room_id = ids.with_check_digit('31337')
+    uid = ids.make_uid(room_id, 0)
+    bad_digit = uid[:-1] + str((int(uid[-1]) + 1) % 10)
+    for value in (None, 123, '', 'abcdefghijklmnop', uid[:-1], bad_digit):
+        assert not ids.is_valid_uid(value)
+        assert ids.room_of(value) is None
+    # 旧版 12 位随机 uid 不满足结构，交给调用方查表
+    assert ids.room_of('482915730164') is None
+
+
+def test_shard_of():
+    room_id = ids.with_check_digit('00007')
+    uid = ids.make_uid(room_id, 1)
+    assert ids.shard_of(room_id, 4) == 3
+    assert ids.shard_of(uid, 4) == 3
+    assert ids.shard_of(uid, 1) == 0
+    assert ids.shard_of('not-an-id', 4) is None
+
+
+def test_allocator_stays_on_shard_and_recycles_last():
+    allocator = ids.RoomIdAllocator(4, 2, random.Random(0))
+    first = allocator.allocate()
+    assert ids.is_valid_room_id(first)
+    assert ids.shard_of(first, 4) == 2
+    allocator.release(first)
+    assert allocator.free[-1] == int(first[: ids.ROOM_SERIAL_LEN])
+    assert len(allocator.free) == 10**ids.ROOM_SERIAL_LEN // 4
+
+
+def test_allocator_rebuild_skips_live_ids_and_exhausts():
+    # 分片数取 10**5 // 3 时，1 号分片只有 1、33334、66667 三个编号
+    allocator = ids.RoomIdAllocator(10**ids.ROOM_SERIAL_LEN // 3, 1, random.Random(0))
+    live = ids.with_check_digit('00001')
+    allocator.rebuild([live])
+    remaining = {allocator.allocate(), allocator.allocate()}
+    assert remaining == {ids.with_check_digit('33334'), ids.with_check_digit('66667')}
+    assert allocator.allocate() is None
@@ -0,0 +1,16 @@
+import metrics
+
+
+def test_callback_counter_renders_as_counter():
+    dropped = {'n': 3}
+    counter = metrics.CallbackCounter(
+        'test_dropped_total', 'Dropped records', collect=lambda: {(): dropped['n']}
+    )
+    lines = metrics.render().splitlines()
+    metrics._metrics.remove(counter)
+    assert '# TYPE test_dropped_total counter' in lines
+    assert 'test_dropped_total 3' in lines
+
+
+def test_server_log_drops_are_a_counter(server):
+    assert '# TYPE uno_log_dropped_total counter' in server.handle_metrics()
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import threading
+import time
+import types
+
+
+def create_rooms(client, count, players=2, joined=2):
+    rooms = []
+    for _ in range(count):
+        room_id = client.post('/create', json={'count': players}).json['id']
+        uids = [
+            client.post('/join', json={'id': room_id, 'username': f'p{i}'}).json['uid']
+            for i in range(joined)
+        ]
+        rooms.append((room_id, uids))
+    return rooms
+
+
+def test_hydrate_reads_outside_registry_lock(server, restart, monkeypatch):
+    client = server.app.test_client()
+    [(room_id, uids)] = create_rooms(client, 1)
+    server.save_snapshot()
+    restart()
+
+    read = server.StoredRoom.read
+    held = []
+
+    def checked_read(stored):
+        held.append(server.registry_lock.locked())
+        return read(stored)
+
+    monkeypatch.setattr(server.StoredRoom, 'read', checked_read)
+    assert client.post('/status', json={'uid': uids[0]}).json['status'] == 'success'
+    assert held == [False]
+
+
+def test_concurrent_hydration_publishes_once(server, restart):
+    client = server.app.test_client()
+    [(room_id, uids)] = create_rooms(client, 1)
+    server.save_snapshot()
+    restart()
+
+    barrier = threading.Barrier(8)
+    locks = []
+
+    def hydrate():
+        barrier.wait()
+        locks.append(server.get_room_lock(room_id))
+
+    threads = [threading.Thread(target=hydrate) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(lock) for lock in locks}) == 1
+    assert locks[0] is server.room_locks[room_id]
+    assert room_id not in server.stored_rooms
+    assert all(server.where[uid] == room_id for uid in uids)
+
+
+def wait_until(predicate, timeout=3):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def hibernate_all(server, monkeypatch):
+    monkeypatch.setattr(server, 'HIBERNATE_AFTER', 0)
+    server.hibernate_idle_rooms()
+
+
+def version(client, uid):
+    return client.post('/status', json={'uid': uid}).json['version']
+
+
+def test_hibernated_game_is_paused_and_wakes_on_access(server, monkeypatch):
+    monkeypatch.setattr(server, 'TURN_TIMEOUT', 0.2)
+    client = server.app.test_client()
+    [(room_id, uids)] = create_rooms(client, 1)
+    before = client.post('/status', json={'uid': uids[0]}).json
+
+    hibernate_all(server, monkeypatch)
+    assert room_id in server.stored_rooms
+    assert room_id not in server.room and room_id not in server.room_locks
+    assert not any(uid in server.where or uid in server.name for uid in uids)
+    # 休眠期间回合计时暂停，不替缺席的玩家自动跳过
+    time.sleep(0.5)
+    assert client.post('/status', json={'uid': uids[0]}).json == before
+    assert room_id in server.room
+    # 读回后重新计时
+    assert wait_until(lambda: version(client, uids[0]) > before['version'])
+
+
+def test_budget_hibernates_least_recently_used(server, monkeypatch):
+    monkeypatch.setattr(server, 'ROOM_BUDGET', 2)
+    monkeypatch.setattr(server, 'HIBERNATE_MIN_IDLE', 0)
+    client = server.app.test_client()
+    rooms = create_rooms(client, 4)
+    for room_id, uids in rooms[2:] + rooms[:1]:
+        client.post('/status', json={'uid': uids[0]})
+        time.sleep(0.01)
+    server.hibernate_idle_rooms()
+    assert set(server.room) == {rooms[3][0], rooms[0][0]}
+    assert set(server.stored_rooms) == {rooms[1][0], rooms[2][0]}
+
+
+def test_status_retries_when_room_hibernates_before_lock(server, monkeypatch):
+    client = server.app.test_client()
+    [(room_id, uids)] = create_rooms(client, 1)
+    get_room_lock = server.get_room_lock
+    calls = []
+
+    def racing_get_room_lock(rid):
+        room_lock = get_room_lock(rid)
+        if not calls:
+            # 请求查到锁之后、拿到锁之前，房间恰好休眠
+            calls.append(rid)
+            server.hibernate_room(rid, time.time())
+        return room_lock
+
+    monkeypatch.setattr(server, 'get_room_lock', racing_get_room_lock)
+    for handler, data in (
+        (server.handle_status, {'uid': uids[0]}),
+        (server.handle_play, {'uid': uids[0], 'card': 'SK'}),
+    ):
+        calls.clear()
+        reply = handler(data)
+        if isinstance(reply, bytes):
+            reply = json.loads(reply)
+        assert calls == [room_id]
+        # 出牌可能因未轮到而失败，但不能因房间恰好休眠而找不到
+        assert reply.get('reason') != 'Room not found'
+    assert room_id in server.room
+
+
+def test_abandoned_hibernated_room_is_cleaned_up(server, monkeypatch):
+    monkeypatch.setattr(server, 'HIBERNATE_MAX_AGE', 0.2)
+    client = server.app.test_client()
+    [(room_id, uids)] = create_rooms(client, 1)
+    serial = int(room_id[: server.ids.ROOM_SERIAL_LEN])
+    hibernate_all(server, monkeypatch)
+    assert room_id in server.stored_rooms
+
+    assert wait_until(lambda: room_id not in server.stored_rooms)
+    assert room_id not in server.room
+    assert server.room_ids.free[-1] == serial
+    reply = client.post('/status', json={'uid': uids[0]}).json
+    assert reply == {'status': 'fail', 'reason': 'Invalid uid'}
+
+
+def test_expiry_survives_restart(server, restart, monkeypatch):
+    monkeypatch.setattr(server, 'HIBERNATE_MAX_AGE', 0.5)
+    client = server.app.test_client()
+    [(room_id, _)] = create_rooms(client, 1)
+    hibernate_all(server, monkeypatch)
+    server.save_snapshot()
+    restart()
+    assert server.stored_rooms[room_id].expires_at is not None
+    server.resume_timers()
+    assert wait_until(lambda: room_id not in server.stored_rooms)
+    server.save_snapshot()
+    restart()
+    assert room_id not in server.stored_rooms
+
+
+def test_hibernation_keeps_rooms_touched_while_writing(server):
+    client = server.app.test_client()
+    [(first, first_uids), (second, second_uids)] = create_rooms(client, 2)
+    captured = server.capture_idle_rooms(time.time() + 2 * server.HIBERNATE_AFTER)
+    assert sorted(item[0] for item in captured) == sorted([first, second])
+    written = server.write_hibernated(captured)
+    # 写记录文件期间 first 被访问，留在内存中，这次写出的记录不被引用
+    client.post('/status', json={'uid': first_uids[0]})
+    assert server.finish_hibernation(captured, *written) == 1
+    assert first in server.room and first not in server.stored_rooms
+    assert second in server.stored_rooms
+    reply = client.post('/status', json={'uid': second_uids[0]}).json
+    assert sorted(reply['players']) == ['p0', 'p1']
+
+
+def test_aserver_reads_stored_rooms_off_the_event_loop(server, restart, monkeypatch):
+    import aserver
+
+    client = server.app.test_client()
+    [(room_id, uids)] = create_rooms(client, 1)
+    server.save_snapshot()
+    restart()
+
+    read = server.read_stored_room
+    readers = []
+
+    def tracked_read(stored):
+        readers.append(threading.get_ident())
+        return read(stored)
+
+    monkeypatch.setattr(server, 'read_stored_room', tracked_read)
+    request = types.SimpleNamespace(
+        method='POST', json=lambda: {'ops': [{'op': 'status', 'uid': uids[0]}]}
+    )
+
+    async def load():
+        await aserver.load_rooms(aserver.request_rooms(request))
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(load())
+    assert room_id in server.room
+    assert readers and loop_thread not in readers
@@ -0,0 +1,92 @@
+import json
+
+
+def read_all(wal, after=0):
+    records = []
+    wal.replay(after, records.append)
+    return records
+
+
+def test_replay_after_rotation_skips_snapshotted_records(server, tmp_path):
+    wal = server.WriteAheadLog(str(tmp_path / 'test.wal'))
+    wal.append({'op': 'create', 'id': 'a'})
+    wal.append({'op': 'join', 'id': 'a'})
+    mark = wal.rotate()
+    wal.append({'op': 'play', 'id': 'a'})
+    # 再切一次作为屏障，确保之前的记录都已落盘
+    wal.rotate()
+
+    restarted = server.WriteAheadLog(wal.path)
+    assert [r['op'] for r in read_all(restarted, mark)] == ['play']
+    assert [r['op'] for r in read_all(restarted)] == ['create', 'join', 'play']
+    # 重放后继续编号，新记录的序号大于已有记录
+    restarted.append({'op': 'timeout', 'id': 'a'})
+    restarted.rotate()
+    records = read_all(server.WriteAheadLog(wal.path))
+    assert [r['seq'] for r in records] == sorted(r['seq'] for r in records)
+    assert records[-1]['op'] == 'timeout'
+
+
+def test_discard_removes_segments_covered_by_snapshot(server, tmp_path):
+    wal = server.WriteAheadLog(str(tmp_path / 'test.wal'))
+    wal.append({'op': 'create', 'id': 'a'})
+    first = wal.rotate()
+    wal.append({'op': 'join', 'id': 'a'})
+    second = wal.rotate()
+    wal.discard(first)
+    assert [mark for mark, _ in wal.segments()] == [second]
+    assert [r['op'] for r in read_all(server.WriteAheadLog(wal.path))] == ['join']
+
+
+def test_replay_skips_torn_last_line(server, tmp_path):
+    path = tmp_path / 'test.wal'
+    record = json.dumps({'op': 'create', 'id': 'a', 'seq': 1})
+    path.write_text(record + '\n' + record[:10], encoding='utf-8')
+    assert [r['seq'] for r in read_all(server.WriteAheadLog(str(path)))] == [1]
+
+
+def statuses(client, uids):
+    return {uid: client.post('/status', json={'uid': uid}).json for uid in uids}
+
+
+def test_restart_restores_snapshot_plus_wal(server, restart):
+    client = server.app.test_client()
+    first = client.post('/create', json={'count': 3}).json['id']
+    uids = [
+        client.post('/join', json={'id': first, 'username': f'p{i}'}).json['uid']
+        for i in range(2)
+    ]
+    server.save_snapshot()
+
+    # 快照之后的变更只在 WAL 中：开局、出牌、新房间
+    uids.append(client.post('/join', json={'id': first, 'username': 'p2'}).json['uid'])
+    state = statuses(client, uids)
+    # 开局时座位会打乱，按各自的 my_idx 找出当前玩家
+    current = next(u for u in uids if state[u]['my_idx'] == state[u]['current_idx'])
+    reply = client.post('/play', json={'uid': current, 'card': 'SK'}).json
+    assert reply['status'] == 'success', reply
+    second = client.post('/create', json={'count': 2}).json['id']
+    waiting = client.post('/join', json={'id': second, 'username': 'q'}).json['uid']
+    before = statuses(client, uids + [waiting])
+
+    restart()
+    assert statuses(client, uids + [waiting]) == before
+    assert statuses(client, uids)[uids[0]]['game_status'] == 'playing'
+
+
+def test_snapshot_rooms_stay_on_disk_until_accessed(server, restart):
+    client = server.app.test_client()
+    room_ids = [client.post('/create', json={'count': 2}).json['id'] for _ in range(3)]
+    uid = client.post('/join', json={'id': room_ids[0], 'username': 'p'}).json['uid']
+    before = statuses(client, [uid])
+    server.save_snapshot()
+
+    restart()
+    assert not server.room
+    assert set(server.stored_rooms) == set(room_ids)
+    assert statuses(client, [uid]) == before
+    assert set(server.room) == {room_ids[0]}
+    # 下一次快照原样带上仍在磁盘上的房间
+    server.save_snapshot()
+    restart()
+    assert set(server.stored_rooms) == set(room_ids)
@@ -0,0 +1,145 @@
+import cards
+import wire
+
+
+def make_room(status='playing', history_offset=0):
+    players = ['uid-a', 'uid-b', 'uid-c']
+    return {
+        'version': 42,
+        'roster': 7,
+        'status': status,
+        'player': players,
+        'hand': {
+            'uid-a': cards.Hand(cards.encode_cards(['R1', 'B7', 'WW'])),
+            'uid-b': cards.Hand(cards.encode_cards(['G2'])),
+            'uid-c': cards.Hand(),
+        },
+        'turn': 1,
+        'direction': -1,
+        'top': cards.encode('WD'),
+        'chosen_color': cards.encode_color('Y'),
+        # 服务端在对局结束时把胜者记为昵称
+        'winner': 'carol' if status == 'finished' else None,
+        'table_history': cards.encode_cards(['R5', 'RS', 'WD']),
+        'history_offset': history_offset,
+    }
+
+
+def test_round_trip():
+    names = ['alice', '鲍勃', 'carol']
+    room = make_room()
+    body = wire.encode_status(room, names, 'uid-a', 0, True)
+    roster = wire.Roster()
+    status = wire.decode_status(body, roster)
+    assert roster.names == names
+    assert roster.version == 7
+    assert status == {
+        'status': 'success',
+        'players': names,
+        'hand': [cards.CODES[c] for c in room['hand']['uid-a'].cards()],
+        'current_idx': 1,
+        'next_idx': 0,
+        'my_idx': 0,
+        'top': 'WD',
+        'chosen_color': 'Y',
+        'table_history': ['R5', 'RS', 'WD'],
+        'history_start': 0,
+        'history_len': 3,
+        'game_status': 'playing',
+        'winner': None,
+        'hand_count': [3, 1, 0],
+        'direction': -1,
+        'version': 42,
+        'roster': 7,
+    }
+
+
+def test_incremental_history_and_names():
+    names = ['alice', 'bob', 'carol']
+    room = make_room(status='finished', history_offset=10)
+    body = wire.encode_status(room, names, 'uid-b', 12, False)
+    roster = wire.Roster()
+    roster.version = 7
+    roster.names = list(names)
+    status = wire.decode_status(body, roster)
+    # 座次版本未变时不发昵称，沿用已知的
+    assert roster.names == names
+    assert status['players'] == names
+    assert status['table_history'] == ['WD']
+    assert status['history_start'] == 12
+    assert status['history_len'] == 13
+    assert status['winner'] == 'carol'
+    assert status['game_status'] == 'finished'
+
+
+def test_spectator_and_waiting_room():
+    room = make_room(status='waiting')
+    room['top'] = None
+    room['chosen_color'] = None
+    status = wire.decode_status(
+        wire.encode_status(room, ['a', 'b', 'c'], 'spectator', 0, True),
+        wire.Roster(),
+    )
+    assert status['my_idx'] == -1
+    assert status['hand'] == []
+    assert status['top'] is None
+    assert status['chosen_color'] is None
+    assert status['game_status'] == 'waiting'
+
+
+def test_server_binary_status_matches_json(server):
+    client = server.app.test_client()
+    room_id = client.post('/create', json={'count': 2}).json['id']
+    uids = [
+        client.post('/join', json={'id': room_id, 'username': f'p{i}'}).json['uid']
+        for i in range(2)
+    ]
+    for uid in uids:
+        reply = client.post('/status', json={'uid': uid})
+        binary = client.post(
+            '/status', json={'uid': uid}, headers={'Accept': wire.MEDIA_TYPE}
+        )
+        assert binary.content_type == wire.MEDIA_TYPE
+        decoded = wire.decode_status(binary.data, wire.Roster())
+        expected = reply.json
+        assert {key: expected[key] for key in decoded} == decoded
+
+
+def test_spectator_sees_seats_reshuffled_at_start(server):
+    client = server.app.test_client()
+    room_id = client.post('/create', json={'count': 3}).json['id']
+    token = client.post('/spectate', json={'id': room_id}).json['token']
+    headers = {'Accept': wire.MEDIA_TYPE}
+    roster = wire.Roster()
+
+    def binary_status():
+        body = client.post(
+            '/status', json={'uid': token, 'roster': roster.version}, headers=headers
+        ).data
+        return wire.decode_status(body, roster)
+
+    client.post('/join', json={'id': room_id, 'username': 'alice'})
+    client.post('/join', json={'id': room_id, 'username': 'bob'})
+    assert binary_status()['players'] == ['alice', 'bob']
+    # 座次未变时不再重发昵称
+    body = client.post(
+        '/status', json={'uid': token, 'roster': roster.version}, headers=headers
+    ).data
+    assert (
+        len(body)
+        == len(client.post('/status', json={'uid': token}, headers=headers).data)
+        - len(b'alice')
+        - len(b'bob')
+        - 2 * wire.NAME_LEN.size
+    )
+
+    # 第三人加入后开局洗牌，座次版本变化，客户端拿到完整的新座次
+    server.random.seed(3)
+    client.post('/join', json={'id': room_id, 'username': 'carol'})
+    status = binary_status()
+    expected = client.post('/status', json={'uid': token}).json
+    assert expected['players'] != ['alice', 'bob', 'carol']
+    assert status['players'] == expected['players']
+    assert sorted(status['players']) == ['alice', 'bob', 'carol']
+    assert status['current_idx'] == expected['current_idx']
+    assert status['roster'] == expected['roster']